@@ -0,0 +1,190 @@
+# addressFilter.py - Appartenenza di un account a un grande insieme di indirizzi (Bloom + conferma esatta)
+#
+#   python addressFilter.py     -> filtro della watch list corrente: voci, bit, byte per voce
+#
+# Un indirizzo TON è workchain + 32 byte di account id (hash dello StateInit): i byte sono già
+# distribuiti in modo uniforme, quindi le k posizioni del Bloom filter si ricavano direttamente da
+# due interi a 64 bit dell'id (double hashing), senza calcolare hash. Il filtro occupa ~1.2 byte per
+# voce all'1% di falsi positivi (PREFILTER_FP_RATE); gli id esatti stanno in un unico blob ordinato
+# da 32 byte per voce, consultato con una ricerca binaria solo per i candidati del filtro.
+# Un insieme di stringhe '0:HEX' costa invece ~190 byte per voce. Con NumPy un intero blocco di
+# transazioni si controlla con poche operazioni vettoriali (contains_many); senza, stesso risultato
+# con un ciclo Python. Il workchain non fa parte della chiave: due account con lo stesso id su
+# workchain diversi sono la stessa voce.
+import bisect
+import math
+from typing import Iterable, List, Optional
+
+try:
+    import numpy as np
+except ImportError:   # dipendenza opzionale: stessi risultati con bytearray
+    np = None
+
+import metrics
+from config import PREFILTER_FP_RATE
+from functions import normalize_address
+
+ID_SIZE = 32
+MASK64 = (1 << 64) - 1
+
+
+def account_id(address: str) -> Optional[bytes]:
+    """32 byte dell'account da un indirizzo RAW ('0:HEX', il formato di TON Center) o user-friendly"""
+    if not address:
+        return None
+    if len(address) >= 66 and address[-65] == ':':
+        try:
+            return bytes.fromhex(address[-64:])
+        except ValueError:
+            return None
+    normalized = normalize_address(address)
+    return bytes.fromhex(normalized[-64:]) if normalized else None
+
+
+class SortedIds:
+    """Id da 32 byte ordinati in un solo blob: sequenza per bisect, 32 byte per voce"""
+    __slots__ = ('blob',)
+
+    def __init__(self, ids: Iterable[bytes]):
+        self.blob = b''.join(sorted(set(ids)))
+
+    def __len__(self):
+        return len(self.blob) // ID_SIZE
+
+    def __getitem__(self, index: int) -> bytes:
+        return self.blob[index * ID_SIZE:(index + 1) * ID_SIZE]
+
+    def __contains__(self, account: bytes) -> bool:
+        index = bisect.bisect_left(self, account)
+        return index < len(self) and self[index] == account
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class BloomFilter:
+    """Bloom filter su id da 32 byte: bit in un bytearray, k posizioni h1 + i*h2 (mod 2^64, mod m)"""
+    __slots__ = ('size', 'hashes', 'bits', 'array')
+
+    def __init__(self, capacity: int, fp_rate: float = PREFILTER_FP_RATE):
+        capacity = max(capacity, 1)
+        self.size = max(64, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))   # bit
+        self.hashes = max(1, round(-math.log2(fp_rate)))   # k ottimale per il tasso di falsi positivi
+        self.bits = bytearray((self.size + 7) // 8)
+        # Vista NumPy sugli stessi byte (nessuna copia) per le operazioni a lotti
+        self.array = np.frombuffer(self.bits, dtype=np.uint8) if np is not None else None
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.bits)
+
+    def _positions(self, account: bytes) -> List[int]:
+        h1 = int.from_bytes(account[:8], 'little')
+        h2 = int.from_bytes(account[8:16], 'little') | 1
+        return [((h1 + i * h2) & MASK64) % self.size for i in range(self.hashes)]
+
+    def _vector_positions(self, blob: bytes):
+        """Matrice (k, n) delle posizioni con NumPy da id concatenati (uint64: l'overflow fa già il mod 2^64)"""
+        words = np.frombuffer(blob, dtype='<u8').reshape(-1, ID_SIZE // 8)
+        h1, h2 = words[:, 0], words[:, 1] | np.uint64(1)
+        steps = np.arange(self.hashes, dtype=np.uint64)[:, None]
+        return (h1 + steps * h2) % np.uint64(self.size)
+
+    def add_many(self, accounts: List[bytes]):
+        if not accounts:
+            return
+        if np is not None:
+            positions = self._vector_positions(b''.join(accounts)).ravel()
+            np.bitwise_or.at(self.array, (positions >> np.uint64(3)).astype(np.intp),
+                             (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)))
+            return
+        for account in accounts:
+            for position in self._positions(account):
+                self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, account: bytes) -> bool:
+        # Stesse posizioni di _positions, calcolate una alla volta: un assente esce al primo bit a zero
+        h1 = int.from_bytes(account[:8], 'little')
+        h2 = int.from_bytes(account[8:16], 'little') | 1
+        bits, size = self.bits, self.size
+        for i in range(self.hashes):
+            position = ((h1 + i * h2) & MASK64) % size
+            if not bits[position >> 3] >> (position & 7) & 1:
+                return False
+        return True
+
+    def contains_many(self, accounts: List[bytes]) -> List[bool]:
+        """Risultato del filtro per ogni id (True = forse presente)"""
+        if not accounts:
+            return []
+        if np is None:
+            return [account in self for account in accounts]
+        return self.contains_blob(b''.join(accounts))
+
+    def contains_blob(self, blob: bytes) -> List[bool]:
+        """Come contains_many, con gli id già concatenati (32 byte ciascuno)"""
+        if np is None:
+            return [self.__contains__(blob[i:i + ID_SIZE]) for i in range(0, len(blob), ID_SIZE)]
+        positions = self._vector_positions(blob)
+        found = self.array[(positions >> np.uint64(3)).astype(np.intp)] >> (positions & np.uint64(7)).astype(np.uint8)
+        return np.bitwise_and(found, 1).all(axis=0).tolist()
+
+
+class AddressFilter:
+    """Insieme di indirizzi: Bloom filter come prefiltro, id ordinati per confermare i candidati"""
+
+    def __init__(self, addresses: Iterable[str], fp_rate: float = PREFILTER_FP_RATE):
+        ids = {account for account in map(account_id, addresses) if account}
+        self.exact = SortedIds(ids)
+        self.bloom = BloomFilter(len(ids), fp_rate)
+        self.bloom.add_many(list(self.exact))
+
+    def __len__(self):
+        return len(self.exact)
+
+    @property
+    def nbytes(self) -> int:
+        """Memoria di filtro e id esatti (senza l'overhead fisso degli oggetti)"""
+        return self.bloom.nbytes + len(self.exact.blob)
+
+    def __contains__(self, address: str) -> bool:
+        account = account_id(address)
+        return account is not None and account in self.bloom and account in self.exact
+
+    def select(self, addresses: List[str]) -> List[int]:
+        """Indici degli indirizzi presenti nell'insieme (prefiltro su tutto il lotto, conferma sui candidati)"""
+        if not len(self.exact) or not addresses:
+            return []
+        try:
+            # Caso comune (transazioni TON Center): tutti RAW, un solo fromhex per l'intero lotto
+            blob = bytes.fromhex(''.join([address[-64:] for address in addresses
+                                          if len(address) >= 66 and address[-65] == ':']))
+        except (TypeError, ValueError):
+            blob = b''
+        if len(blob) == len(addresses) * ID_SIZE:
+            maybe = self.bloom.contains_blob(blob)
+            candidates = [i for i, hit in enumerate(maybe) if hit]
+            confirmed = [i for i in candidates if blob[i * ID_SIZE:(i + 1) * ID_SIZE] in self.exact]
+        else:
+            ids = [account_id(address) for address in addresses]
+            positions = [i for i, account in enumerate(ids) if account]
+            maybe = self.bloom.contains_many([ids[i] for i in positions])
+            candidates = [i for i, hit in zip(positions, maybe) if hit]
+            confirmed = [i for i in candidates if ids[i] in self.exact]
+        if len(candidates) > len(confirmed):
+            metrics.inc('prefilter.false_positives', len(candidates) - len(confirmed))
+        return confirmed
+
+
+def watch_filter(snapshot=None, extra: Iterable[str] = ()) -> AddressFilter:
+    """Filtro degli indirizzi royalty della watch list (+ altri indirizzi noti, es. contratti di vendita)"""
+    if snapshot is None:
+        from watchList import watch_list as snapshot
+    return AddressFilter(list(snapshot.royalty_addresses) + list(extra))
+
+
+if __name__ == '__main__':
+    address_filter = watch_filter()
+    print(f"{len(address_filter)} addresses, {address_filter.bloom.size} bits, "
+          f"{address_filter.bloom.hashes} hashes, {address_filter.nbytes} bytes "
+          f"({address_filter.nbytes / max(len(address_filter), 1):.1f} B/entry), NumPy: {np is not None}")
@@ -0,0 +1,167 @@
+# alertLedger.py - Registro persistente degli alert: ogni vendita notificata una sola volta
+import json
+import sqlite3
+import threading
+import time
+from typing import Optional, List
+
+import metrics
+from config import ALERTS_DB, ALERT_MAX_ATTEMPTS, ALERT_RETRY_MAX_AGE
+
+# Ciclo di vita di un alert (chiave = trace_id + NFT + chat destinataria; tx_hash = transazione
+# da cui è stata rilevata la vendita, per saltarla prima di risolverla):
+#   detected -> sending (accodato nell'outbox persistente) -> sent
+#                                                          -> failed -> sending ... (fino a ALERT_MAX_ATTEMPTS)
+# Un alert rimasto in 'detected' dopo un crash viene accodato al riavvio; quelli in 'sending'
+# sono già nell'outbox su disco. L'unica finestra di possibile doppione è il crash
+# durante la chiamata a Telegram (il messaggio resta in coda e viene reinviato).
+DETECTED = 'detected'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alerts (
+    trace_id TEXT NOT NULL,
+    nft TEXT NOT NULL,
+    chat_id TEXT NOT NULL DEFAULT '',
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    payload TEXT NOT NULL,
+    tx_time INTEGER NOT NULL DEFAULT 0,
+    tx_hash TEXT,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (trace_id, nft, chat_id)
+);
+CREATE INDEX IF NOT EXISTS idx_alerts_state ON alerts (state, created_at);
+CREATE INDEX IF NOT EXISTS idx_alerts_tx ON alerts (tx_hash);
+"""
+
+
+class AlertLedger:
+    """Stato degli alert su SQLite; tutte le verifiche sono lookup per chiave primaria"""
+
+    def __init__(self, db_path: str = ALERTS_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            with self._schema_lock:
+                if not self._schema_ready:
+                    self._migrate(conn)
+                    conn.executescript(SCHEMA)
+                    conn.commit()
+                    self._schema_ready = True
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection):
+        """Registri creati prima del routing per chat: chiave (trace_id, nft) -> (trace_id, nft, chat_id)"""
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(alerts)")]
+        if not columns:
+            return
+        if 'chat_id' in columns:
+            if 'tx_hash' not in columns:
+                # Alert già registrati senza hash: la loro tx viene risolta di nuovo, la chiave ferma i doppioni
+                with conn:
+                    conn.execute("ALTER TABLE alerts ADD COLUMN tx_hash TEXT")
+            return
+        with conn:
+            conn.execute("ALTER TABLE alerts RENAME TO alerts_old")
+            conn.execute("DROP INDEX IF EXISTS idx_alerts_state")
+            conn.executescript(SCHEMA)
+            conn.execute(
+                "INSERT INTO alerts (trace_id, nft, chat_id, state, attempts, payload, tx_time, "
+                "last_error, created_at, updated_at) "
+                "SELECT trace_id, nft, '', state, attempts, payload, tx_time, last_error, created_at, updated_at "
+                "FROM alerts_old"
+            )
+            conn.execute("DROP TABLE alerts_old")
+        print("[alerts] ✅ Ledger migrated to per-chat keys", flush=True)
+
+    # --- lettura ---
+
+    def has_tx(self, tx_hash: str) -> bool:
+        """
+        True se la transazione ha già prodotto un alert (qualsiasi stato): si può saltare senza
+        chiamate API. Per hash e non per trace: un acquisto multiplo ha più vendite nella stessa trace.
+        """
+        if not tx_hash:
+            return False
+        row = self._db().execute("SELECT 1 FROM alerts WHERE tx_hash = ? LIMIT 1", (tx_hash,)).fetchone()
+        return row is not None
+
+    def get_state(self, trace_id: str, nft: str, chat_id: str = '') -> Optional[str]:
+        row = self._db().execute("SELECT state FROM alerts WHERE trace_id = ? AND nft = ? AND chat_id = ?",
+                                 (trace_id, nft, str(chat_id))).fetchone()
+        return row[0] if row else None
+
+    def pending(self, limit: int = 50) -> List[dict]:
+        """Alert da (ri)accodare: detected (crash prima dell'accodamento) e failed con tentativi residui"""
+        min_created = time.time() - ALERT_RETRY_MAX_AGE
+        rows = self._db().execute(
+            "SELECT trace_id, nft, chat_id, state, attempts, payload FROM alerts "
+            "WHERE state IN (?, ?) AND attempts < ? AND created_at >= ? "
+            "ORDER BY created_at LIMIT ?",
+            (DETECTED, FAILED, ALERT_MAX_ATTEMPTS, min_created, limit)
+        ).fetchall()
+        return [{'trace_id': r[0], 'nft': r[1], 'chat_id': r[2], 'state': r[3], 'attempts': r[4],
+                 'payload': json.loads(r[5])} for r in rows]
+
+    def counts(self) -> dict:
+        rows = self._db().execute("SELECT state, COUNT(*) FROM alerts GROUP BY state").fetchall()
+        return {state: count for state, count in rows}
+
+    # --- scrittura ---
+
+    def record_detected(self, trace_id: str, nft: str, payload: dict, tx_time: int = 0,
+                        chat_id: str = '', tx_hash: str = '') -> bool:
+        """Registra una vendita da notificare a una chat; False se era già nel registro (duplicato)"""
+        now = time.time()
+        db = self._db()
+        with db:
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO alerts (trace_id, nft, chat_id, state, payload, tx_time, tx_hash, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (trace_id, nft, str(chat_id), DETECTED, json.dumps(payload), tx_time, tx_hash or None, now, now)
+            )
+        if cursor.rowcount:
+            metrics.inc('alerts.detected')
+            return True
+        metrics.inc('alerts.duplicate')
+        return False
+
+    def _set_state(self, trace_id: str, nft: str, chat_id: str, state: str, error: Optional[str] = None,
+                   attempt: bool = False):
+        db = self._db()
+        with db:
+            db.execute(
+                "UPDATE alerts SET state = ?, last_error = ?, updated_at = ?, attempts = attempts + ? "
+                "WHERE trace_id = ? AND nft = ? AND chat_id = ?",
+                (state, error, time.time(), 1 if attempt else 0, trace_id, nft, str(chat_id))
+            )
+
+    def mark_sending(self, trace_id: str, nft: str, chat_id: str = ''):
+        self._set_state(trace_id, nft, chat_id, SENDING, attempt=True)
+
+    def mark_sent(self, trace_id: str, nft: str, chat_id: str = ''):
+        self._set_state(trace_id, nft, chat_id, SENT)
+        metrics.inc('alerts.sent')
+
+    def mark_failed(self, trace_id: str, nft: str, chat_id: str = '', error: str = ''):
+        self._set_state(trace_id, nft, chat_id, FAILED, error=error[:500] if error else None)
+        metrics.inc('alerts.failed')
+
+
+# Global instance (il file SQLite viene aperto al primo utilizzo)
+alert_ledger = AlertLedger()
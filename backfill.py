@@ -0,0 +1,309 @@
+# backfill.py - Ricostruzione dello storico vendite di un indirizzo royalty (nessuna notifica Telegram)
+#
+#   python backfill.py 0:68F3... --since 2025-01-01 --until 2025-06-30
+#   python backfill.py 0:68F3... --start-lt 48000000000000 --end-lt 49000000000000
+#
+# Le vendite finiscono nel sales ledger (e i metadata NFT nella cache); il checkpoint
+# permette di riprendere da dove si era interrotto rilanciando lo stesso comando.
+# Una transazione non risolta per errore del provider (429, timeout, rete) viene ritentata;
+# se resta irrisolta il backfill si ferma senza superare la sua pagina.
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import metrics
+from httpPool import get_session, close_session
+from config import TONCENTER_API_V3, BACKFILL_CHECKPOINT, BACKFILL_PAGE_SIZE, BACKFILL_CONCURRENCY, BACKFILL_RATE
+from config import BACKFILL_RETRIES
+from secretData import toncenter_api_key
+from functions import parse_sale_stack, get_sale_data_v2, get_sale_data_via_tonapi, normalize_address
+from nftData import get_nft_data
+from salesLedger import sales_ledger, sale_record
+from tgOutbox import RateLimiter
+
+TONCENTER_HEADERS = {"accept": "application/json"}
+if toncenter_api_key:
+    TONCENTER_HEADERS["X-API-Key"] = toncenter_api_key
+
+
+class ResolveError(Exception):
+    """Provider non disponibile durante la risoluzione: la tx va ritentata, non è una non-vendita"""
+
+
+class RateBudget:
+    """Budget di richieste/secondo condiviso da tutte le coroutine del backfill"""
+
+    def __init__(self, rate: float):
+        self.limiter = RateLimiter(rate, 1)
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            wait = self.limiter.delay()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self.limiter.consume()
+
+    def penalize(self, seconds: float):
+        """Dopo un 429: nessuna richiesta per `seconds`"""
+        self.limiter.block(seconds)
+
+
+# --- checkpoint ---
+
+def load_checkpoint(key: str) -> dict:
+    try:
+        with open(BACKFILL_CHECKPOINT) as f:
+            return json.load(f).get(key, {})
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_checkpoint(key: str, state: dict):
+    """Scrittura atomica (file temporaneo + rename): un crash non corrompe il checkpoint"""
+    try:
+        with open(BACKFILL_CHECKPOINT) as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        data = {}
+    data[key] = state
+    tmp_path = f"{BACKFILL_CHECKPOINT}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, BACKFILL_CHECKPOINT)
+
+
+# --- TON Center ---
+
+async def fetch_page(budget: RateBudget, address: str, start_utime: Optional[int], end_utime: Optional[int],
+                     start_lt: Optional[int], end_lt: Optional[int], limit: int) -> Optional[list]:
+    """Una pagina di transazioni (dalla più recente) nell'intervallo; None se la richiesta fallisce"""
+    params = {"account": address, "limit": limit, "sort": "desc"}
+    for name, value in (("start_utime", start_utime), ("end_utime", end_utime),
+                        ("start_lt", start_lt), ("end_lt", end_lt)):
+        if value is not None:
+            params[name] = value
+
+    for attempt in range(5):
+        await budget.acquire()
+        try:
+            session = get_session()
+            async with session.get(f"{TONCENTER_API_V3}/transactions", headers=TONCENTER_HEADERS,
+                                   params=params) as response:
+                if response.status == 429:
+                    budget.penalize(2 ** attempt)
+                    metrics.inc('backfill.rate_limited')
+                    continue
+                if response.status != 200:
+                    print(f"[backfill] ⚠️ /transactions returned {response.status}", flush=True)
+                    await asyncio.sleep(2 ** attempt)
+                    continue
+                data = await response.json()
+                return data.get("transactions", [])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[backfill] ⚠️ Page fetch error: {e}", flush=True)
+            await asyncio.sleep(2 ** attempt)
+    return None
+
+
+async def resolve_sale(budget: RateBudget, tx: dict, royalty_address: str) -> Optional[dict]:
+    """
+    Stesso percorso di royalty_trs (get_sale_data -> parse -> NFT data) ma senza notifiche.
+    None = non è una vendita; ResolveError se un provider non ha risposto.
+    """
+    source_address = (tx.get('in_msg') or {}).get('source')
+    if not source_address:
+        return None
+
+    await budget.acquire()
+    stack = await get_sale_data_v2(source_address)
+    if not stack:
+        await budget.acquire()
+        fallback = await get_sale_data_via_tonapi(source_address)
+        if stack is None and fallback is None:
+            raise ResolveError(f"get_sale_data unavailable for {source_address[-12:]}")
+        stack = fallback
+    if not stack:
+        return None
+
+    sale = parse_sale_stack(stack)
+    if not sale or not sale.is_complete:
+        return None
+
+    nft_address = sale.nft
+    if not nft_address:
+        return None
+
+    await budget.acquire()
+    # Aste e offerte hanno il buyer nello stack: l'owner non va richiesto
+    nft_info = await get_nft_data(nft_address, owner=sale.buyer)
+    if nft_info is None:
+        raise ResolveError(f"NFT data unavailable for {nft_address[-12:]}")
+    if not nft_info.ok:
+        return None
+    return sale_record(tx, sale, nft_address, nft_info, royalty_address)
+
+
+# --- backfill ---
+
+async def backfill(address: str, since: Optional[int] = None, until: Optional[int] = None,
+                   start_lt: Optional[int] = None, end_lt: Optional[int] = None,
+                   concurrency: int = BACKFILL_CONCURRENCY, rate: float = BACKFILL_RATE,
+                   page_size: int = BACKFILL_PAGE_SIZE, restart: bool = False) -> dict:
+    """
+    Scorre lo storico dell'indirizzo dalla fine dell'intervallo all'inizio, una pagina alla volta.
+    Le vendite di una pagina sono risolte in parallelo (max `concurrency`, entro `rate` richieste/s)
+    e scritte nel ledger in un lotto; poi il checkpoint avanza al lt più vecchio della pagina.
+    Le tx fallite per errore del provider sono ritentate (BACKFILL_RETRIES); se qualcuna resta
+    irrisolta il backfill si ferma e il checkpoint resta all'inizio della pagina.
+    """
+    key = f"{address}|{since}|{until}|{start_lt}|{end_lt}"
+    state = {} if restart else load_checkpoint(key)
+    if state.get('done'):
+        print(f"[backfill] ✅ Already completed ({state['transactions']} tx, {state['sales']} sales)", flush=True)
+        return state
+    if state:
+        print(f"[backfill] 🔁 Resuming from lt {state['cursor_lt']}", flush=True)
+
+    state.setdefault('cursor_lt', end_lt)
+    state.setdefault('transactions', 0)
+    state.setdefault('sales', 0)
+    state.setdefault('elapsed', 0.0)
+
+    budget = RateBudget(rate)
+    semaphore = asyncio.Semaphore(concurrency)
+    run_started = time.time()
+    previous_elapsed = state['elapsed']
+    run_tx = run_sales = run_errors = unresolved = 0
+
+    async def resolve(tx):
+        """(record o None, True se la tx va ritentata)"""
+        async with semaphore:
+            try:
+                return await resolve_sale(budget, tx, address), False
+            except ResolveError as e:
+                print(f"[backfill] ⚠️ {e} (tx {tx.get('hash', '')[:16]})", flush=True)
+            except Exception as e:
+                print(f"[backfill] ❌ Resolve error for {tx.get('hash', '')[:16]}: {e}", flush=True)
+            metrics.inc('backfill.errors')
+            return None, True
+
+    while True:
+        page = await fetch_page(budget, address, since, until, start_lt, state['cursor_lt'], page_size)
+        if page is None:
+            print("[backfill] ❌ Cannot fetch transactions, stopping (run again to resume)", flush=True)
+            break
+        if not page:
+            state['done'] = True
+            break
+
+        # Solo transazioni in entrata con mittente (i pagamenti royalty dei contratti di vendita)
+        candidates = [tx for tx in page if (tx.get('in_msg') or {}).get('source')]
+        records = []
+        for attempt in range(BACKFILL_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(2 ** attempt)
+            results = await asyncio.gather(*(resolve(tx) for tx in candidates))
+            records += [record for record, _ in results if record]
+            candidates = [tx for tx, (_, failed) in zip(candidates, results) if failed]
+            run_errors += len(candidates)
+            if not candidates:
+                break
+        sales_ledger.record_sales(records)
+        if candidates:
+            # Il checkpoint non supera la pagina: al riavvio viene riletta (i doppioni li ignora il ledger)
+            unresolved = len(candidates)
+            print(f"[backfill] ❌ {unresolved} transactions unresolved after {BACKFILL_RETRIES} retries, "
+                  "stopping at this page (run again to resume)", flush=True)
+            break
+
+        run_tx += len(page)
+        run_sales += len(records)
+        state['transactions'] += len(page)
+        state['sales'] += len(records)
+        # end_lt è inclusivo: la pagina successiva parte dal lt precedente al più vecchio visto
+        state['cursor_lt'] = min(int(tx['lt']) for tx in page) - 1
+        state['oldest_utime'] = min(tx.get('now', 0) for tx in page)
+        if len(page) < page_size:
+            state['done'] = True
+
+        elapsed = time.time() - run_started
+        metrics.inc('backfill.transactions', len(page))
+        metrics.inc('backfill.sales', len(records))
+        print(f"[backfill] 📄 {len(page)} tx, {len(records)} sales | down to "
+              f"{time.ctime(state['oldest_utime'])} | {run_tx / elapsed:.1f} tx/s, {run_sales / elapsed:.2f} sales/s",
+              flush=True)
+        state['elapsed'] = previous_elapsed + elapsed
+        save_checkpoint(key, state)
+        if state.get('done'):
+            break
+
+    elapsed = time.time() - run_started
+    state['elapsed'] = previous_elapsed + elapsed
+    save_checkpoint(key, state)
+
+    report = {
+        'address': address,
+        'done': bool(state.get('done')),
+        'transactions': run_tx,
+        'sales': run_sales,
+        'seconds': round(elapsed, 2),
+        'tx_per_second': round(run_tx / elapsed, 2) if elapsed else 0.0,
+        'sales_per_second': round(run_sales / elapsed, 3) if elapsed else 0.0,
+        'errors': run_errors,
+        'unresolved': unresolved,
+        'total_transactions': state['transactions'],
+        'total_sales': state['sales'],
+    }
+    print(f"[backfill] 🏁 {json.dumps(report)}", flush=True)
+    return report
+
+
+def parse_time(value: Optional[str]) -> Optional[int]:
+    """Unix timestamp oppure data ISO (2025-01-31 / 2025-01-31T12:00), UTC"""
+    if value is None:
+        return None
+    if value.isdigit():
+        return int(value)
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill sales history of a royalty address (no alerts)")
+    parser.add_argument('address', help="royalty address (raw 0:... or EQ...)")
+    parser.add_argument('--since', help="start time (unix or ISO date, UTC)")
+    parser.add_argument('--until', help="end time (unix or ISO date, UTC)")
+    parser.add_argument('--start-lt', type=int, help="start logical time")
+    parser.add_argument('--end-lt', type=int, help="end logical time")
+    parser.add_argument('--concurrency', type=int, default=BACKFILL_CONCURRENCY)
+    parser.add_argument('--rate', type=float, default=BACKFILL_RATE, help="API requests per second")
+    parser.add_argument('--page-size', type=int, default=BACKFILL_PAGE_SIZE)
+    parser.add_argument('--restart', action='store_true', help="ignore the saved checkpoint")
+    args = parser.parse_args()
+
+    address = normalize_address(args.address)
+    if not address:
+        parser.error(f"invalid address: {args.address}")
+
+    async def run():
+        try:
+            return await backfill(address, parse_time(args.since), parse_time(args.until),
+                                  args.start_lt, args.end_lt, args.concurrency, args.rate,
+                                  args.page_size, args.restart)
+        finally:
+            await close_session()
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()
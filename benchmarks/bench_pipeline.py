@@ -0,0 +1,295 @@
+# benchmarks/bench_pipeline.py - Benchmark end-to-end della pipeline (rilevamento -> ledger -> outbox -> Telegram)
+#
+#   python benchmarks/bench_pipeline.py                          -> tutti i workload, JSON in benchmarks/results/
+#   python benchmarks/bench_pipeline.py --workload burst         -> un solo workload
+#   python benchmarks/bench_pipeline.py --ingestion collections  -> feed di collezione invece delle tx royalty
+#   python benchmarks/bench_pipeline.py --ingestion blocks       -> blocchi masterchain filtrati in locale
+#   python benchmarks/bench_pipeline.py --compare results/a.json -> confronto con un'esecuzione precedente
+#
+# Nessuna rete: TON Center / TonAPI / Getgems / prezzi rispondono da benchmarks/fakes.py con una
+# latenza simulata, la Bot API è finta. Ogni workload gira in un processo separato (RSS di picco
+# pulito, database SQLite temporanei) e il codice misurato è quello vero di main.py.
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+WORKLOADS = {
+    # ciclo tranquillo: 25 tx già viste a ogni giro, nessuna vendita nuova
+    'quiet': {'cycles': 10, 'tx_per_cycle': 25, 'sale_ratio': 0.0, 'already_seen': True},
+    # raffica: 25 vendite nella stessa finestra di polling
+    'burst': {'cycles': 1, 'tx_per_cycle': 25, 'sale_ratio': 1.0},
+    # traffico misto: 25 tx nuove per ciclo, il 30% sono vendite
+    'mixed': {'cycles': 4, 'tx_per_cycle': 25, 'sale_ratio': 0.3},
+    # storico: 500 vendite risolte da backfill.py (nessuna notifica)
+    'backfill': {'sales': 500},
+}
+
+ROYALTY_ADDRESS = '0:68F3A076D3451A18FD41E05C71B4C020545D46B2757064E65825DED0C49BF02C'
+COLLECTION = '0:388B9F22B92F4351846D519F7BB19A399A791B898501A565D039EDDD11409C3F'
+BENCH_CHAT = '-1009999999999'
+
+
+def percentile(values: list, fraction: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return round(ordered[index], 4)
+
+
+def peak_rss_mb() -> float:
+    import resource
+    # ru_maxrss è in KB su Linux, in byte su macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+# --- processo figlio: un workload ---
+
+async def run_workload(name: str, spec: dict, args, tmpdir: str) -> dict:
+    import main
+    import backfill
+    import httpPool
+    import tgMessage
+    from alertLedger import alert_ledger
+    from nftCache import nft_cache
+    from salesLedger import sales_ledger
+    from tgOutbox import outbox
+    from mediaCache import media_cache
+    from fakes import FakeChain, FakeProviders, FakeBot
+
+    # Stato su disco isolato nella cartella temporanea
+    nft_cache.db_path = os.path.join(tmpdir, 'nft_cache.db')
+    sales_ledger.db_path = os.path.join(tmpdir, 'sales.db')
+    alert_ledger.db_path = os.path.join(tmpdir, 'alerts.db')
+    outbox.db_path = os.path.join(tmpdir, 'outbox.db')
+    media_cache.db_path = os.path.join(tmpdir, 'media.db')
+    media_cache.media_dir = os.path.join(tmpdir, 'media')
+    backfill.BACKFILL_CHECKPOINT = os.path.join(tmpdir, 'backfill_checkpoint.json')
+
+    chain = FakeChain(ROYALTY_ADDRESS, COLLECTION, seed=args.seed)
+    providers = FakeProviders(chain, latency=args.api_latency)
+    httpPool.use_session(providers)
+    bot = FakeBot(latency=args.telegram_latency)
+    tgMessage.tg_notifier.bot = bot
+    tgMessage.DIGEST_WINDOW = args.digest_window
+    main.toncenter_api.min_request_interval = 0   # il rate limit di produzione misurerebbe solo lo sleep
+
+    now = int(time.time())
+    result = {'workload': name, **spec}
+    if name != 'backfill':
+        result['ingestion'] = args.ingestion
+
+    if name == 'backfill':
+        chain.add_transactions(spec['sales'], 1.0, now - spec['sales'] * 5)
+        started = time.perf_counter()
+        report = await backfill.backfill(ROYALTY_ADDRESS, concurrency=args.backfill_concurrency,
+                                         rate=1_000_000, restart=True)
+        elapsed = time.perf_counter() - started
+        result.update(seconds=round(elapsed, 3), transactions=report['transactions'], sales=report['sales'],
+                      tx_per_second=round(report['transactions'] / elapsed, 2),
+                      sales_per_second=round(report['sales'] / elapsed, 2),
+                      api_calls=providers.pipeline_calls(),
+                      api_calls_per_sale=round(providers.pipeline_calls() / max(report['sales'], 1), 2))
+        return result
+
+    # lastUtime in memoria (il file reale resta intatto)
+    state = {'last_utime': now if spec.get('already_seen') else 0}
+    if args.ingestion == 'collections' and not spec.get('already_seen'):
+        state['last_utime'] = now - 3600   # senza checkpoint il feed partirebbe da adesso
+    main.read_last_utime = lambda royalty_address=None: state['last_utime']
+    main.write_last_utime = lambda utime, royalty_address=None: state.update(last_utime=utime)
+    follower = None
+    if args.ingestion == 'blocks':
+        from blockFollower import block_follower as follower
+        follower.checkpoint_path = os.path.join(tmpdir, 'lastSeqno.txt')
+
+    detected, sent = {}, {}
+    record_detected, mark_sent = alert_ledger.record_detected, alert_ledger.mark_sent
+
+    def timed_detected(trace_id, nft, payload, tx_time=0, chat_id='', tx_hash=''):
+        created = record_detected(trace_id, nft, payload, tx_time, chat_id=chat_id, tx_hash=tx_hash)
+        if created:
+            detected[(trace_id, nft, chat_id)] = time.perf_counter()
+        return created
+
+    def timed_sent(trace_id, nft, chat_id=''):
+        sent.setdefault((trace_id, nft, chat_id), time.perf_counter())
+        return mark_sent(trace_id, nft, chat_id)
+
+    alert_ledger.record_detected = timed_detected
+    alert_ledger.mark_sent = timed_sent
+
+    main.start_background_services()
+    await asyncio.sleep(0.1)   # primo giro di prezzi e floor fuori dalla misura
+    calls_before = providers.pipeline_calls()
+
+    if spec.get('already_seen'):
+        chain.add_transactions(spec['tx_per_cycle'], 0.0, now - spec['tx_per_cycle'] * 5 - 60)
+        if follower:
+            follower.write_checkpoint(chain.head_seqno())
+
+    transactions = 0
+    detect_time = 0.0
+    for cycle in range(spec['cycles']):
+        if not spec.get('already_seen'):
+            start = max(state['last_utime'], now - 3600) + 1
+            added = chain.add_transactions(spec['tx_per_cycle'], spec['sale_ratio'], start)
+            transactions += len(added)
+            if follower:
+                # La catena finta avanza fino all'ultima tx aggiunta: il follower riparte dal blocco della prima
+                follower.write_checkpoint(chain.seqno(added[0]['now']) - 1)
+        else:
+            transactions += spec['tx_per_cycle']
+        started = time.perf_counter()
+        await main.retry_pending_alerts()
+        if args.ingestion == 'collections':
+            from collectionFeed import collection_trs
+            utime = await collection_trs(COLLECTION)
+        elif follower:
+            await follower.step()
+            utime = chain.transactions[-1]['now']
+        else:
+            utime = await main.royalty_trs(ROYALTY_ADDRESS)
+        detect_time += time.perf_counter() - started
+        if utime:
+            state['last_utime'] = utime
+
+    # Attende che l'outbox abbia consegnato tutto (digest compresi)
+    drain_started = time.perf_counter()
+    while len(sent) < len(detected) and time.perf_counter() - drain_started < args.drain_timeout:
+        await asyncio.sleep(0.05)
+
+    latencies = [sent[key] - detected[key] for key in detected if key in sent]
+    sales = len(detected)
+    api_calls = providers.pipeline_calls() - calls_before
+    result.update(
+        transactions=transactions,
+        sales=sales,
+        detect_seconds=round(detect_time, 3),
+        tx_per_second=round(transactions / detect_time, 2) if detect_time else None,
+        sales_per_second=round(sales / detect_time, 2) if detect_time and sales else None,
+        api_calls=api_calls,
+        api_calls_per_sale=round(api_calls / sales, 2) if sales else None,
+        api_calls_per_tx=round(api_calls / transactions, 2) if transactions else None,
+        alert_latency_p50=percentile(latencies, 0.50),
+        alert_latency_p95=percentile(latencies, 0.95),
+        alert_latency_p99=percentile(latencies, 0.99),
+        alerts_sent=len(latencies),
+        alerts_undelivered=sales - len(latencies),
+        telegram_requests=len(bot.sent),
+        photo_uploads=bot.uploads,
+    )
+    return result
+
+
+def child(name: str, args):
+    """Esegue un workload e stampa il risultato JSON su stdout (i log del bot vanno scartati)"""
+    os.environ.setdefault('BOT_TOKEN', '000000:bench')
+    os.environ['NOTIFY_CHAT'] = BENCH_CHAT
+    os.environ['HTTP_CASSETTE_MODE'] = 'off'
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+    log = sys.stdout if args.verbose else open(os.devnull, 'w')
+    real_stdout, sys.stdout = sys.stdout, log
+    with tempfile.TemporaryDirectory(prefix='bench-') as tmpdir:
+        result = asyncio.run(run_workload(name, WORKLOADS[name], args, tmpdir))
+    result['peak_rss_mb'] = peak_rss_mb()
+    sys.stdout = real_stdout
+    print(json.dumps(result), flush=True)
+
+
+# --- processo padre ---
+
+def run_child(name: str, args) -> dict:
+    command = [sys.executable, os.path.abspath(__file__), '--child', name,
+               '--seed', str(args.seed), '--api-latency', str(args.api_latency),
+               '--telegram-latency', str(args.telegram_latency), '--digest-window', str(args.digest_window),
+               '--drain-timeout', str(args.drain_timeout),
+               '--backfill-concurrency', str(args.backfill_concurrency), '--ingestion', args.ingestion]
+    if args.verbose:
+        command.append('--verbose')
+    completed = subprocess.run(command, stdout=subprocess.PIPE, text=True)
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        return {'workload': name, 'error': f"exit code {completed.returncode}"}
+    return json.loads(lines[-1])
+
+
+COMPARE_FIELDS = ('tx_per_second', 'sales_per_second', 'api_calls_per_sale', 'alert_latency_p50',
+                  'alert_latency_p95', 'alert_latency_p99', 'peak_rss_mb')
+
+
+def compare(previous: dict, current: dict):
+    old = {r['workload']: r for r in previous.get('results', [])}
+    print(f"\n{'workload':<10} {'metric':<20} {'before':>12} {'after':>12} {'change':>9}")
+    for result in current['results']:
+        before = old.get(result['workload'])
+        if not before:
+            continue
+        for field in COMPARE_FIELDS:
+            a, b = before.get(field), result.get(field)
+            if a is None or b is None:
+                continue
+            change = f"{(b - a) / a * 100:+.1f}%" if a else ''
+            print(f"{result['workload']:<10} {field:<20} {a:>12} {b:>12} {change:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the sale alert pipeline (offline)")
+    parser.add_argument('--workload', action='append', choices=list(WORKLOADS),
+                        help="workload to run (repeatable, default: all)")
+    parser.add_argument('--output', help="result file (default: benchmarks/results/pipeline-<time>.json)")
+    parser.add_argument('--compare', help="previous result file to compare with")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--api-latency', type=float, default=0.02, help="seconds per provider request")
+    parser.add_argument('--telegram-latency', type=float, default=0.03, help="seconds per Bot API request")
+    parser.add_argument('--digest-window', type=float, default=2, help="DIGEST_WINDOW during the run")
+    parser.add_argument('--drain-timeout', type=float, default=120, help="max seconds waiting for the outbox")
+    parser.add_argument('--backfill-concurrency', type=int, default=8)
+    parser.add_argument('--ingestion', choices=('royalty', 'collections', 'blocks'), default='royalty',
+                        help="detection source (INGESTION_MODE)")
+    parser.add_argument('--verbose', action='store_true', help="keep the bot logs")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args)
+        return
+
+    results = []
+    for name in args.workload or list(WORKLOADS):
+        print(f"[bench] ▶️ {name}...", flush=True)
+        result = run_child(name, args)
+        results.append(result)
+        print(f"[bench] {json.dumps(result)}", flush=True)
+
+    report = {
+        'timestamp': int(time.time()),
+        'python': sys.version.split()[0],
+        'settings': {'seed': args.seed, 'api_latency': args.api_latency,
+                     'telegram_latency': args.telegram_latency, 'digest_window': args.digest_window},
+        'results': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"pipeline-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"[bench] ✅ Results written to {output}", flush=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
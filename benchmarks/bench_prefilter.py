@@ -0,0 +1,137 @@
+# benchmarks/bench_prefilter.py - Micro-benchmark del prefiltro degli indirizzi (addressFilter.py)
+#
+#   python benchmarks/bench_prefilter.py                      -> 200k indirizzi, lookup/s e byte per voce
+#   python benchmarks/bench_prefilter.py --entries 2000000    -> scala di milioni di contratti
+#
+# Confronta AddressFilter (Bloom + id ordinati) con un set di stringhe '0:HEX': memoria per voce
+# (tracemalloc), lookup singoli e a lotti di --batch indirizzi (come le transazioni di un blocco),
+# con una frazione --hit-ratio di indirizzi presenti. Verifica che i risultati coincidano con il
+# set e misura il tasso di falsi positivi del Bloom filter.
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def random_addresses(count: int, rng: random.Random) -> list:
+    return [f"0:{rng.getrandbits(256):064X}" for _ in range(count)]
+
+
+def allocated(build):
+    """(oggetto, byte allocati per costruirlo e ancora vivi)"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    value = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return value, after - before
+
+
+def rate(function, items: list, repeat: int) -> float:
+    """Elementi al secondo (migliore di `repeat` passate)"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(items)
+        best = min(best, time.perf_counter() - started)
+    return len(items) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark of the address prefilter (Bloom filter)")
+    parser.add_argument('--entries', type=int, default=200_000, help="addresses in the set")
+    parser.add_argument('--lookups', type=int, default=200_000, help="addresses looked up per pass")
+    parser.add_argument('--hit-ratio', type=float, default=0.01, help="fraction of lookups that are members")
+    parser.add_argument('--batch', type=int, default=1000, help="addresses per select() call (one block)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="write the results as JSON")
+    args = parser.parse_args()
+
+    os.environ.setdefault('BOT_TOKEN', '000000:bench')
+    os.environ.setdefault('NOTIFY_CHAT', '-1009999999999')
+    sys.path.insert(0, ROOT)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import addressFilter
+
+    rng = random.Random(args.seed)
+    # Stringhe create fuori dalla misura: il set le referenzia soltanto (come le risposte dell'API)
+    members = random_addresses(args.entries, rng)
+    hits = int(args.lookups * args.hit_ratio)
+    lookups = rng.sample(members, hits) + random_addresses(args.lookups - hits, rng)
+    rng.shuffle(lookups)
+    print(f"{args.entries:,} entries, {args.lookups:,} lookups ({hits:,} members), "
+          f"NumPy: {addressFilter.np is not None}")
+
+    started = time.perf_counter()
+    address_filter = addressFilter.AddressFilter(members)
+    build_seconds = time.perf_counter() - started
+    # Memoria: il set conta anche le stringhe (copie nuove), il filtro solo i propri array
+    strings, set_bytes = allocated(lambda: {str(a.encode().decode()) for a in members})
+    _, filter_bytes = allocated(lambda: addressFilter.AddressFilter(members))
+
+    # Stessi risultati del set (nessun falso negativo, falsi positivi scartati dalla conferma)
+    expected = [i for i, a in enumerate(lookups) if a in strings]
+    selected = []
+    for start in range(0, len(lookups), args.batch):
+        selected += [start + i for i in address_filter.select(lookups[start:start + args.batch])]
+    if selected != expected or [i for i, a in enumerate(lookups) if a in address_filter] != expected:
+        print("[bench] ❌ AddressFilter results differ from the set", flush=True)
+        sys.exit(2)
+    misses = [addressFilter.account_id(a) for a in lookups if a not in strings]
+    false_positives = sum(address_filter.bloom.contains_many(misses))
+
+    def set_lookups(items):
+        return [a for a in items if a in strings]
+
+    def filter_lookups(items):
+        return [a for a in items if a in address_filter]
+
+    def filter_batches(items):
+        for start in range(0, len(items), args.batch):
+            address_filter.select(items[start:start + args.batch])
+
+    rates = {
+        'set': rate(set_lookups, lookups, args.repeat),
+        'filter_single': rate(filter_lookups, lookups, args.repeat),
+        'filter_batch': rate(filter_batches, lookups, args.repeat),
+    }
+
+    result = {
+        'entries': args.entries,
+        'numpy': addressFilter.np is not None,
+        'bloom_bits': address_filter.bloom.size,
+        'bloom_hashes': address_filter.bloom.hashes,
+        'build_seconds': round(build_seconds, 3),
+        'false_positive_rate': round(false_positives / max(len(misses), 1), 5),
+        'set_bytes_per_entry': round(set_bytes / args.entries, 1),
+        'filter_bytes_per_entry': round(filter_bytes / args.entries, 1),
+        'bloom_bytes_per_entry': round(address_filter.bloom.nbytes / args.entries, 2),
+        'lookups_per_second': {name: round(value) for name, value in rates.items()},
+    }
+
+    print(f"\n{'structure':<16} {'bytes/entry':>12} {'lookups/s':>14}")
+    print(f"{'set of str':<16} {result['set_bytes_per_entry']:>12,.1f} {rates['set']:>14,.0f}")
+    print(f"{'filter single':<16} {result['filter_bytes_per_entry']:>12,.1f} {rates['filter_single']:>14,.0f}")
+    print(f"{'filter batch':<16} {'':>12} {rates['filter_batch']:>14,.0f}")
+    print(f"\nBloom: {result['bloom_bits']:,} bits, {result['bloom_hashes']} hashes, "
+          f"{result['bloom_bytes_per_entry']} B/entry, false positives {result['false_positive_rate']:.3%}, "
+          f"built in {build_seconds:.2f}s")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'timestamp': int(time.time()), 'python': sys.version.split()[0], 'result': result},
+                      f, indent=2)
+        print(f"\n[bench] ✅ Results written to {args.output}", flush=True)
+
+
+if __name__ == '__main__':
+    main()
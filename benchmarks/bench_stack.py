@@ -0,0 +1,158 @@
+# benchmarks/bench_stack.py - Micro-benchmark del parsing degli stack get_sale_data
+#
+#   python benchmarks/bench_stack.py                    -> ns/stack per formato, fast path vs riferimento
+#   python benchmarks/bench_stack.py --min-speedup 5    -> exit code 1 se il fast path non è abbastanza veloce
+#
+# Gli stack hanno le forme restituite da TON Center v2 (liste pytonlib), TON Center v3 (dict 'value')
+# e TonAPI (dict 'num'/'cell' con BOC hex): fix price e aste, con e senza offerte. Prima di misurare
+# verifica che functions.parse_sale_stack dia gli stessi campi del parser di riferimento (tuple).
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+
+def build_stacks(count: int, seed: int) -> list:
+    from fakes import random_address, fixprice_stack, auction_stack
+    rng = random.Random(seed)
+    marketplace = random_address(rng)
+    stacks = []
+    for i in range(count):
+        created = 1_700_000_000 + i * 60
+        price = round(rng.uniform(1, 500), 2)
+        if rng.random() < 0.7:
+            stacks.append(fixprice_stack(marketplace, random_address(rng), random_address(rng), price, created))
+        else:
+            buyer = random_address(rng) if rng.random() < 0.8 else None
+            stacks.append(auction_stack(marketplace, random_address(rng), random_address(rng), buyer, price, created))
+    return stacks
+
+
+# Campi delle vecchie tuple posizionali, per confrontare i record tipizzati con il riferimento
+LEGACY_FIELDS = {
+    'SaleFixPrice': ('action', 'is_complete', 'created_at', 'marketplace', 'nft', 'seller', 'price_ton'),
+    'SaleAuction': ('action', 'is_complete', 'created_at', 'marketplace', 'nft', 'seller', 'min_bid', 'max_bid',
+                    'min_step', 'last_bid_at', 'buyer', 'price_ton', 'is_canceled', 'end_time'),
+    'SaleOffer': ('action', 'is_complete', 'created_at', 'marketplace', 'nft', 'buyer', 'price_ton'),
+}
+
+
+def same_sale(record, legacy: tuple) -> bool:
+    if record is None or legacy is None:
+        return record is None and legacy is None
+    return record.as_dict() == {**record.as_dict(), **dict(zip(LEGACY_FIELDS[legacy[0]], legacy))}
+
+
+def measure(function, stacks: list, repeat: int) -> float:
+    """Miglior tempo su `repeat` passate, in ns per stack (stdout scartato: i print fanno parte del costo)"""
+    best = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            started = time.perf_counter_ns()
+            for stack in stacks:
+                function(stack)
+            elapsed = time.perf_counter_ns() - started
+            best = elapsed if best is None else min(best, elapsed)
+    return best / len(stacks)
+
+
+def per_item_bytes(build) -> float:
+    """Byte allocati per elemento della lista costruita da build() (i valori sono condivisi, conta il contenitore)"""
+    import tracemalloc
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    items = build()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return size / len(items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark of get_sale_data stack parsing")
+    parser.add_argument('--stacks', type=int, default=200, help="stacks per format")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--min-speedup', type=float, help="fail if a format is below this speedup")
+    args = parser.parse_args()
+
+    os.environ.setdefault('BOT_TOKEN', '000000:bench')
+    os.environ.setdefault('NOTIFY_CHAT', '-1009999999999')
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+    with contextlib.redirect_stdout(io.StringIO()):
+        import functions
+        import stack_reference
+        from fakes import to_v3, to_tonapi
+
+    v2 = build_stacks(args.stacks, args.seed)
+    shapes = {'v2': v2, 'v3': [to_v3(s) for s in v2], 'tonapi': [to_tonapi(s) for s in v2]}
+
+    results = []
+    print(f"{'format':<8} {'reference ns':>14} {'fast ns':>10} {'speedup':>8}")
+    for name, stacks in shapes.items():
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = [stack_reference.parse_sale_stack(s) for s in stacks]
+        actual = [functions.parse_sale_stack(s) for s in stacks]
+        mismatches = sum(not same_sale(a, e) for a, e in zip(actual, expected))
+        if mismatches:
+            print(f"[bench] ❌ {name}: {mismatches}/{len(stacks)} stacks differ from the reference", flush=True)
+            sys.exit(2)
+        if any(r is None or r[3] is None for r in expected):
+            print(f"[bench] ❌ {name}: reference parser failed to decode addresses", flush=True)
+            sys.exit(2)
+
+        reference_ns = measure(stack_reference.parse_sale_stack, stacks, args.repeat)
+        fast_ns = measure(functions.parse_sale_stack, stacks, args.repeat)
+        speedup = reference_ns / fast_ns
+        results.append({'format': name, 'stacks': len(stacks), 'reference_ns': round(reference_ns),
+                        'fast_ns': round(fast_ns), 'speedup': round(speedup, 1)})
+        print(f"{name:<8} {reference_ns:>14,.0f} {fast_ns:>10,.0f} {speedup:>7.1f}x")
+
+    # Helper singoli sugli item v2 (numero e cella indirizzo)
+    number, cell = v2[0][6], v2[0][4]
+    helpers = {
+        'hex_to_int': (stack_reference.hex_to_int, functions.STACK_READERS['v2'][1], number),
+        'parse_address_from_cell': (stack_reference.parse_address_from_cell,
+                                    functions.STACK_READERS['v2'][2], cell),
+    }
+    print(f"\n{'helper':<24} {'reference ns':>14} {'fast ns':>10} {'speedup':>8}")
+    for name, (reference, fast, item) in helpers.items():
+        reference_ns = measure(reference, [item] * 1000, args.repeat)
+        fast_ns = measure(fast, [item] * 1000, args.repeat)
+        results.append({'helper': name, 'reference_ns': round(reference_ns), 'fast_ns': round(fast_ns),
+                        'speedup': round(reference_ns / fast_ns, 1)})
+        print(f"{name:<24} {reference_ns:>14,.0f} {fast_ns:>10,.0f} {reference_ns / fast_ns:>7.1f}x")
+
+    # Memoria per vendita: record con __slots__ contro lo stesso contenuto in un dict
+    records = [functions.parse_sale_stack(s) for s in v2]
+    record_bytes = per_item_bytes(lambda: [copy.copy(r) for r in records])
+    dict_bytes = per_item_bytes(lambda: [r.as_dict() for r in records])
+    results.append({'memory': 'sale', 'record_bytes': round(record_bytes), 'dict_bytes': round(dict_bytes)})
+    print(f"\nmemory per sale: record {record_bytes:,.0f} B, dict {dict_bytes:,.0f} B "
+          f"({dict_bytes / record_bytes:.1f}x)")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'timestamp': int(time.time()), 'python': sys.version.split()[0], 'results': results},
+                      f, indent=2)
+        print(f"\n[bench] ✅ Results written to {args.output}", flush=True)
+
+    if args.min_speedup:
+        slow = [r['format'] for r in results if 'format' in r and r['speedup'] < args.min_speedup]
+        if slow:
+            print(f"[bench] ❌ Below {args.min_speedup}x: {', '.join(slow)}", flush=True)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+# benchmarks/bench_startup.py - Tempo di avvio: import di main.py (-X importtime) e time-to-first-poll
+#
+#   python benchmarks/bench_startup.py                    -> moduli più lenti + avvio fino alla prima richiesta
+#   python benchmarks/bench_startup.py --target-ms 300    -> exit code 1 se la mediana supera il target
+#
+# Ogni misura è un interprete nuovo: il time-to-first-poll va dal lancio del processo alla prima
+# GET /transactions di TON Center, passando da web_server.run_bot() come in produzione. La rete è
+# sostituita da una sessione finta (httpPool.use_session): nessun token né connessione necessari.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+# Librerie che non devono essere caricate prima del primo poll
+HEAVY_MODULES = ('telegram', 'tonsdk', 'ton')
+
+
+def bench_env(data_dir: str) -> dict:
+    env = dict(os.environ)
+    env.update(BOT_TOKEN=env.get('BOT_TOKEN') or '000000:bench', NOTIFY_CHAT='-1009999999999',
+               DATA_DIR=data_dir, HTTP_CASSETTE_MODE='off', HA_ENABLED='0', SHARD_WORKERS='1',
+               PYTHONPATH=ROOT)
+    return env
+
+
+def parse_importtime(stderr: str) -> list:
+    """Righe di -X importtime -> [(modulo, self_us, cumulative_us, profondità)]"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def import_profile(env: dict) -> dict:
+    """Un `import main` a freddo con -X importtime: totale, moduli più costosi e librerie pesanti caricate"""
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=ROOT, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    rows = parse_importtime(completed.stderr)
+    total = next((cumulative for name, _, cumulative, _ in rows if name == 'main'), None)
+    loaded = {name for name, _, _, _ in rows}
+    return {
+        'import_main_ms': round(total / 1000, 1) if total else None,
+        'import_stdout_lines': len(completed.stdout.splitlines()),
+        'heavy_loaded': sorted(m for m in HEAVY_MODULES if m in loaded),
+        'slowest': [{'module': name, 'self_ms': round(s / 1000, 1), 'cumulative_ms': round(c / 1000, 1)}
+                    for name, s, c, _ in sorted(rows, key=lambda r: -r[1])[:15]],
+    }
+
+
+# --- processo figlio: avvio fino al primo poll ---
+
+CHILD = r'''
+import asyncio, json, os, sys, time
+T0 = float(os.environ['BENCH_T0'])
+import httpPool
+from httpCassette import CassetteRequest, CassetteResponse
+
+class FirstPoll:
+    closed = False
+    def get(self, url, **kwargs): return self.request('GET', url, **kwargs)
+    def post(self, url, **kwargs): return self.request('POST', url, **kwargs)
+    def request(self, method, url, **kwargs): return CassetteRequest(self._respond(str(url)))
+    async def close(self): pass
+    async def _respond(self, url):
+        if '/transactions' in url:
+            elapsed = time.time() - T0
+            heavy = sorted({m.split('.')[0] for m in sys.modules} & {'telegram', 'tonsdk', 'ton'})
+            sys.__stdout__.write(json.dumps({'first_poll_ms': round(elapsed * 1000, 1), 'modules': heavy}) + '\n')
+            sys.__stdout__.flush()
+            os._exit(0)
+        if 'api.telegram.org' in url:
+            await asyncio.sleep(60)
+            body = {'ok': True, 'result': []}
+        else:
+            body = {}
+        return CassetteResponse(200, {'Content-Type': 'application/json'}, json.dumps(body).encode(), url)
+
+httpPool.use_session(FirstPoll())
+sys.stdout = open(os.devnull, 'w')
+import web_server
+web_server.run_bot()
+'''
+
+
+def first_poll(env: dict) -> dict:
+    env = dict(env, BENCH_T0=repr(time.time()))
+    completed = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=env, timeout=60,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        return {'error': f"exit code {completed.returncode}"}
+    return json.loads(lines[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup benchmark: import profile and time-to-first-poll")
+    parser.add_argument('--runs', type=int, default=5, help="fresh processes per measure")
+    parser.add_argument('--target-ms', type=float, help="fail if the median time-to-first-poll is above this")
+    parser.add_argument('--output', help="write the results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench-startup-') as data_dir:
+        env = bench_env(data_dir)
+        profile = import_profile(env)
+        imports = [import_profile(env)['import_main_ms'] for _ in range(args.runs - 1)] + [profile['import_main_ms']]
+        polls = [first_poll(env) for _ in range(args.runs)]
+
+    errors = [p['error'] for p in polls if 'error' in p]
+    if errors:
+        print(f"[bench] ❌ Startup run failed: {errors[0]}", flush=True)
+        sys.exit(2)
+
+    first_poll_ms = [p['first_poll_ms'] for p in polls]
+    heavy = sorted({m for p in polls for m in p['modules']})
+    result = {
+        'import_main_ms': {'min': min(imports), 'median': statistics.median(imports)},
+        'first_poll_ms': {'min': min(first_poll_ms), 'median': statistics.median(first_poll_ms),
+                          'max': max(first_poll_ms)},
+        'import_stdout_lines': profile['import_stdout_lines'],
+        'heavy_before_first_poll': heavy,
+        'slowest_imports': profile['slowest'],
+    }
+
+    print(f"{'module':<36} {'self ms':>8} {'cumul ms':>9}")
+    for row in profile['slowest']:
+        print(f"{row['module']:<36} {row['self_ms']:>8} {row['cumulative_ms']:>9}")
+    print(f"\nimport main:       median {result['import_main_ms']['median']} ms "
+          f"(min {result['import_main_ms']['min']}), {profile['import_stdout_lines']} lines printed")
+    print(f"time-to-first-poll: median {result['first_poll_ms']['median']} ms "
+          f"(min {result['first_poll_ms']['min']}, max {result['first_poll_ms']['max']})")
+    print(f"heavy libraries before the first poll: {', '.join(heavy) or 'none'}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'timestamp': int(time.time()), 'python': sys.version.split()[0], 'runs': args.runs,
+                       'results': result}, f, indent=2)
+        print(f"\n[bench] ✅ Results written to {args.output}", flush=True)
+
+    if args.target_ms and result['first_poll_ms']['median'] > args.target_ms:
+        print(f"[bench] ❌ Median time-to-first-poll above {args.target_ms} ms", flush=True)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
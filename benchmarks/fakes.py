@@ -0,0 +1,323 @@
+# benchmarks/fakes.py - Provider finti (TON Center, TonAPI, Getgems, prezzi) e Bot API Telegram finta
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Optional
+from urllib.parse import urlsplit
+
+from tonsdk.boc import begin_cell
+from tonsdk.utils import Address
+
+from httpCassette import CassetteResponse, CassetteRequest
+
+NANO = 1_000_000_000
+FIXPRICE_MAGIC = 0x46495850   # "FIXP"
+AUCTION_MAGIC = 0x415543      # "AUC"
+BLOCK_TIME = 5                # secondi per blocco masterchain della catena finta
+
+# PNG 1x1 servito come preview degli NFT
+FAKE_PNG = base64.b64decode('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg==')
+
+# Endpoint contati come chiamate della pipeline (prezzi e floor girano in background)
+PIPELINE_ENDPOINTS = ('toncenter.transactions', 'toncenter.v2.runGetMethod', 'toncenter.nft.getItems',
+                      'toncenter.v3.runGetMethod', 'tonapi.get_sale_data', 'toncenter.nft.transfers',
+                      'toncenter.actions', 'toncenter.masterchainInfo', 'toncenter.blocks')
+
+
+def random_address(rng: random.Random) -> str:
+    return f"0:{rng.getrandbits(256):064X}"
+
+
+def address_cell(address: Optional[str]) -> list:
+    """Stack item v2 (pytonlib) con una cella che contiene l'indirizzo (None = addr_none)"""
+    boc = begin_cell().store_address(Address(address) if address else None).end_cell().to_boc(False)
+    return ['tvm.Cell', {'bytes': base64.b64encode(boc).decode()}]
+
+
+def num(value: int) -> list:
+    return ['num', hex(value)]
+
+
+def fixprice_stack(marketplace: str, nft: str, seller: str, price_ton: float, created_at: int) -> list:
+    """get_sale_data di un contratto fix price Getgems (v2: lista di item)"""
+    return [num(FIXPRICE_MAGIC), num(1), num(created_at), address_cell(marketplace), address_cell(nft),
+            address_cell(seller), num(int(price_ton * NANO)), address_cell(marketplace), num(0),
+            address_cell(marketplace), num(0)]
+
+
+def auction_stack(marketplace: str, nft: str, seller: str, buyer: Optional[str], price_ton: float,
+                  created_at: int) -> list:
+    """get_sale_data di un'asta Getgems conclusa (20 item); buyer None = nessuna offerta"""
+    bid = int(price_ton * NANO)
+    return [num(AUCTION_MAGIC), num(1), num(created_at + 3600), address_cell(marketplace), address_cell(nft),
+            address_cell(seller), num(bid), address_cell(buyer), num(NANO), address_cell(marketplace),
+            num(5), num(100), address_cell(marketplace), num(5), num(100), num(bid * 2), num(bid // 2),
+            num(created_at), num(created_at + 1800), num(0)]
+
+
+def to_v3(stack: list) -> list:
+    """Stesso stack nel formato TON Center /api/v3: {'type', 'value'} con BOC base64"""
+    return [{'type': 'num', 'value': item[1]} if item[0] == 'num'
+            else {'type': 'cell', 'value': item[1]['bytes']} for item in stack]
+
+
+def to_tonapi(stack: list) -> list:
+    """Stesso stack nel formato TonAPI: {'type', 'num'} / {'type', 'cell'} con BOC hex"""
+    return [{'type': 'num', 'num': item[1]} if item[0] == 'num'
+            else {'type': 'cell', 'cell': base64.b64decode(item[1]['bytes']).hex()} for item in stack]
+
+
+class FakeChain:
+    """Storia sintetica di un indirizzo royalty: transazioni, contratti di vendita e NFT"""
+
+    def __init__(self, royalty_address: str, collection: str, seed: int = 1, block_noise: int = 100):
+        self.royalty_address = royalty_address
+        self.collection = collection
+        self.rng = random.Random(seed)
+        self.marketplace = random_address(self.rng)
+        self.transactions = []   # ordinate per lt crescente
+        self.sales = {}          # contratto di vendita -> stack
+        self.nfts = {}           # NFT -> item /nft/getItems
+        self.transfers = []      # item /nft/transfers delle vendite (ordinati per lt)
+        self.actions = {}        # trace_id -> azioni /actions
+        self.block_noise = block_noise   # transazioni di altri account in ogni blocco masterchain
+        self.next_lt = 40_000_000_000_000
+
+    def add_transactions(self, count: int, sale_ratio: float, start_time: int, spacing: int = 5) -> list:
+        added = []
+        for i in range(count):
+            now = start_time + i * spacing
+            source = random_address(self.rng)
+            purchase = None
+            if self.rng.random() < sale_ratio:
+                nft = random_address(self.rng)
+                seller, buyer = random_address(self.rng), random_address(self.rng)
+                price = round(self.rng.uniform(1, 200), 2)
+                if self.rng.random() < 0.7:
+                    self.sales[source] = fixprice_stack(self.marketplace, nft, seller, price, now - 600)
+                else:
+                    self.sales[source] = auction_stack(self.marketplace, nft, seller, buyer, price, now - 7200)
+                index = len(self.nfts)
+                self.nfts[nft] = {
+                    'address': nft,
+                    'collection': {'address': self.collection},
+                    'owner': {'address': buyer},
+                    'metadata': {'name': f'Bench NFT #{index}'},
+                    'previews': [{'resolution': '500x500', 'url': f'https://example.invalid/{index}.png'}],
+                }
+                purchase = {'nft_item': nft, 'nft_collection': self.collection, 'old_owner': source,
+                            'real_prev_owner': seller, 'new_owner': buyer, 'is_purchase': True,
+                            'price': str(int(price * NANO)), 'marketplace_address': self.marketplace}
+            self.next_lt += 1000
+            tx = {
+                'account': self.royalty_address,
+                'hash': base64.b64encode(self.rng.getrandbits(256).to_bytes(32, 'big')).decode(),
+                'lt': str(self.next_lt),
+                'now': now,
+                'trace_id': base64.b64encode(self.rng.getrandbits(256).to_bytes(32, 'big')).decode(),
+                'in_msg': {'source': source, 'value': str(int(self.rng.uniform(0.01, 5) * NANO))},
+                'out_msgs': [],
+            }
+            self.transactions.append(tx)
+            added.append(tx)
+            if purchase:
+                # Stessa vendita vista dai feed di collezione (trasferimento dell'NFT + azione della trace)
+                self.transfers.append({
+                    'nft_address': nft, 'nft_collection': self.collection, 'transaction_hash': tx['hash'],
+                    'transaction_lt': tx['lt'], 'transaction_now': now, 'transaction_aborted': False,
+                    'old_owner': source, 'new_owner': buyer, 'trace_id': tx['trace_id'],
+                })
+                self.actions[tx['trace_id']] = [{'trace_id': tx['trace_id'], 'type': 'nft_transfer',
+                                                 'success': True, 'details': purchase}]
+        return added
+
+    def query(self, params: dict) -> list:
+        """Filtri di GET /api/v3/transactions"""
+        def param(name):
+            value = params.get(name)
+            return int(value) if value not in (None, '') else None
+
+        start_utime, end_utime = param('start_utime'), param('end_utime')
+        start_lt, end_lt = param('start_lt'), param('end_lt')
+        result = [tx for tx in self.transactions
+                  if (start_utime is None or tx['now'] >= start_utime)
+                  and (end_utime is None or tx['now'] <= end_utime)
+                  and (start_lt is None or int(tx['lt']) >= start_lt)
+                  and (end_lt is None or int(tx['lt']) <= end_lt)]
+        if params.get('sort', 'desc') == 'desc':
+            result.reverse()
+        offset = param('offset') or 0
+        return result[offset:offset + (param('limit') or 10)]
+
+    def query_transfers(self, params: dict) -> list:
+        """Filtri di GET /api/v3/nft/transfers (collection_address, start_utime, sort, limit, offset)"""
+        start_utime = int(params.get('start_utime') or 0)
+        result = [t for t in self.transfers
+                  if params.get('collection_address') in (None, self.collection) and t['transaction_now'] >= start_utime]
+        if params.get('sort', 'desc') == 'desc':
+            result.reverse()
+        offset = int(params.get('offset') or 0)
+        return result[offset:offset + int(params.get('limit') or 10)]
+
+    @staticmethod
+    def seqno(utime: int) -> int:
+        """Blocco masterchain che contiene una transazione del tempo utime"""
+        return utime // BLOCK_TIME
+
+    def head_seqno(self) -> int:
+        """Ultimo blocco della catena: quello dell'ultima transazione (adesso se non ce ne sono)"""
+        if self.transactions:
+            return self.seqno(self.transactions[-1]['now'])
+        return self.seqno(int(time.time()))
+
+    def query_block(self, params: dict) -> list:
+        """GET /api/v3/transactionsByMasterchainBlock: transazioni royalty del blocco + rumore di altri account"""
+        seqno = int(params['seqno'])
+        noise = []
+        for i in range(self.block_noise):
+            digest = hashlib.sha256(f'{seqno}:{i}'.encode()).digest()
+            noise.append({'account': f"0:{digest.hex().upper()}", 'hash': base64.b64encode(digest).decode(),
+                          'lt': str(seqno * 10_000 + i), 'now': seqno * BLOCK_TIME, 'in_msg': {}, 'out_msgs': []})
+        result = noise + [tx for tx in self.transactions if self.seqno(tx['now']) == seqno]
+        offset = int(params.get('offset') or 0)
+        return result[offset:offset + int(params.get('limit') or 10)]
+
+    def query_actions(self, trace_ids: list) -> list:
+        return [action for trace_id in trace_ids for action in self.actions.get(trace_id, [])]
+
+
+class FakeProviders:
+    """
+    Sessione HTTP finta (stessa interfaccia di aiohttp usata nel repo) che risponde come i provider
+    reali, con una latenza simulata per richiesta. Si installa con httpPool.use_session().
+    """
+
+    def __init__(self, chain: FakeChain, latency: float = 0.02, ton_usd: float = 5.0):
+        self.chain = chain
+        self.latency = latency
+        self.ton_usd = ton_usd
+        self.calls = Counter()
+        self.closed = False
+
+    def pipeline_calls(self) -> int:
+        return sum(self.calls[name] for name in PIPELINE_ENDPOINTS)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method: str, url, **kwargs):
+        return CassetteRequest(self._respond(method, str(url), kwargs))
+
+    async def close(self):
+        self.closed = True
+
+    async def _respond(self, method: str, url: str, kwargs: dict) -> CassetteResponse:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        parts = urlsplit(url)
+        host, path = parts.hostname or '', parts.path
+        body = kwargs.get('json') or {}
+
+        if host == 'toncenter.com':
+            if path.endswith('/v3/transactions'):
+                self.calls['toncenter.transactions'] += 1
+                return self._json({'transactions': self.chain.query(kwargs.get('params') or {}),
+                                   'address_book': {}})
+            if path.endswith('/v3/nft/transfers'):
+                self.calls['toncenter.nft.transfers'] += 1
+                return self._json({'nft_transfers': self.chain.query_transfers(dict(kwargs.get('params') or {})),
+                                   'address_book': {}})
+            if path.endswith('/v3/actions'):
+                self.calls['toncenter.actions'] += 1
+                params = kwargs.get('params') or []
+                params = params.items() if isinstance(params, dict) else params
+                trace_ids = [value for name, value in params if name == 'trace_id']
+                return self._json({'actions': self.chain.query_actions(trace_ids), 'address_book': {}})
+            if path.endswith('/v3/masterchainInfo'):
+                self.calls['toncenter.masterchainInfo'] += 1
+                return self._json({'last': {'workchain': -1, 'seqno': self.chain.head_seqno()}})
+            if path.endswith('/v3/transactionsByMasterchainBlock'):
+                self.calls['toncenter.blocks'] += 1
+                return self._json({'transactions': self.chain.query_block(kwargs.get('params') or {}),
+                                   'address_book': {}})
+            if path.endswith('/v2/runGetMethod'):
+                self.calls['toncenter.v2.runGetMethod'] += 1
+                stack = self.chain.sales.get(body.get('address'))
+                if stack is None:
+                    return self._json({'ok': True, 'success': True, 'exit_code': 11, 'stack': []})
+                return self._json({'ok': True, 'success': True, 'exit_code': 0, 'stack': stack})
+            if path.endswith('/v3/nft/getItems'):
+                self.calls['toncenter.nft.getItems'] += 1
+                items = [self.chain.nfts[a] for a in body.get('addresses', []) if a in self.chain.nfts]
+                return self._json({'nft_items': items})
+            if path.endswith('/v3/runGetMethod'):
+                self.calls['toncenter.v3.runGetMethod'] += 1
+                return self._json({'ok': False, 'error': 'not found'}, status=404)
+
+        if host == 'tonapi.io':
+            if path.endswith('/methods/get_sale_data'):
+                self.calls['tonapi.get_sale_data'] += 1
+                return self._json({'error': 'not a sale contract'}, status=404)
+            if path.endswith('/v2/rates'):
+                self.calls['tonapi.rates'] += 1
+                return self._json({'rates': {'TON': {'prices': {'USD': self.ton_usd}}}})
+
+        if host == 'api.coingecko.com':
+            self.calls['coingecko'] += 1
+            return self._json({'the-open-network': {'usd': self.ton_usd}})
+
+        if host == 'api.getgems.io':
+            self.calls['getgems.floor'] += 1
+            edge = {'node': {'address': random_address(self.chain.rng), 'sale': {'fullPrice': str(10 * NANO)}}}
+            return self._json({'data': {'alphaNftItemSearch': {'edges': [edge]}}})
+
+        if host == 'example.invalid':
+            # Preview degli NFT finti (come il CDN delle preview di TON Center)
+            self.calls['media'] += 1
+            return CassetteResponse(200, {'Content-Type': 'image/png'}, FAKE_PNG, url)
+
+        self.calls['unknown'] += 1
+        return self._json({'error': 'unknown endpoint'}, status=404)
+
+    @staticmethod
+    def _json(data, status: int = 200) -> CassetteResponse:
+        return CassetteResponse(status, {'Content-Type': 'application/json'}, json.dumps(data).encode(), '')
+
+
+class FakeBot:
+    """Bot API finta: registra gli invii con una latenza simulata (nessuna rete)"""
+
+    def __init__(self, latency: float = 0.03):
+        self.latency = latency
+        self.sent = []   # (metodo, chat_id, timestamp)
+        self.uploads = 0   # foto inviate come file (non come file_id o URL)
+
+    async def _send(self, method: str, chat_id):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent.append((method, str(chat_id), time.time()))
+
+    def _photo_message(self, photo) -> SimpleNamespace:
+        if isinstance(photo, bytes) or hasattr(photo, 'input_file_content'):   # bytes o InputFile (album)
+            self.uploads += 1
+        file_id = photo if isinstance(photo, str) and photo.startswith('fake-file-') else f"fake-file-{len(self.sent)}"
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=file_id)])
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._send('sendMessage', chat_id)
+
+    async def send_photo(self, chat_id, photo, caption=None, **kwargs):
+        await self._send('sendPhoto', chat_id)
+        return self._photo_message(photo)
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        await self._send('sendMediaGroup', chat_id)
+        return [self._photo_message(item.media) for item in media]
@@ -0,0 +1,208 @@
+# benchmarks/stack_reference.py - Parser generico degli stack com'era prima del fast path (functions.py, user-038)
+# Riferimento per bench_stack.py: stessi risultati attesi, costo per stack da battere. Non usato dal bot.
+import base64
+from typing import Optional
+
+from functions import normalize_address
+
+# ============= FUNZIONI DI UTILITY PER LO STACK =============
+
+def get_stack_value(item, default='0'):
+    """Estrae il valore da uno stack item, sia dict (v3) che list (pytonlib)"""
+    try:
+        # CASO 1: Dict (API v3)
+        if isinstance(item, dict):
+            if 'value' in item:
+                return item['value']
+            elif 'num' in item:
+                return item['num']
+            elif 'cell' in item:
+                return item['cell']
+        
+        # CASO 2: List (pytonlib)
+        elif isinstance(item, list) and len(item) > 1:
+            return item[1]
+        
+        # CASO 3: Stringa diretta
+        elif isinstance(item, str):
+            return item
+        
+        return default
+    except:
+        return default
+
+def hex_to_int(value):
+    """Converte hex in int, gestisce dict, list, string"""
+    try:
+        # Estrai il valore come stringa
+        if isinstance(value, dict):
+            hex_str = get_stack_value(value, '0')
+        elif isinstance(value, list):
+            hex_str = get_stack_value(value, '0')
+        else:
+            hex_str = str(value)
+        
+        hex_str = hex_str.strip()
+        
+        # Converti
+        if hex_str.startswith('0x'):
+            return int(hex_str, 16)
+        elif hex_str.isdigit():
+            return int(hex_str)
+        else:
+            try:
+                return int(hex_str, 16)
+            except:
+                return 0
+    except:
+        return 0
+
+def read_address_from_boc(boc: str) -> Optional[str]:
+    """Indirizzo (RAW maiuscolo) da una cella serializzata, BOC hex o base64. None se addr_none."""
+    from tonsdk.boc import Cell
+    boc_hex = boc if boc[:8].lower() == 'b5ee9c72' else base64.b64decode(boc).hex()
+    address = Cell.one_from_boc(boc_hex).begin_parse().read_msg_addr()
+    return normalize_address(address.to_string(False)) if address else None
+
+def parse_address_from_cell(cell_data):
+    """Estrae indirizzo da cella, gestisce dict (v3 / TonAPI) e list (pytonlib)"""
+    try:
+        # CASO 1: API v3 / TonAPI - {"type": "cell", "cell"|"value": "boc"}
+        if isinstance(cell_data, dict):
+            if cell_data.get('type') == 'cell':
+                cell_boc = cell_data.get('cell') or cell_data.get('value') or ''
+                if cell_boc:
+                    try:
+                        return read_address_from_boc(cell_boc)
+                    except:
+                        pass
+        
+        # CASO 2: Pytonlib - ["tvm.Cell", {"bytes": "base64"}]
+        elif isinstance(cell_data, list) and len(cell_data) == 2:
+            if cell_data[0] == 'tvm.Cell' and isinstance(cell_data[1], dict):
+                cell_b64 = cell_data[1].get('bytes', '')
+                if cell_b64:
+                    try:
+                        return read_address_from_boc(cell_b64)
+                    except:
+                        pass
+        
+        return None
+    except:
+        return None
+
+# ============= PARSING STACK VENDITA =============
+
+def parse_sale_stack(stack: list) -> Optional[tuple]:
+    """
+    Parse sale stack - Supporta API v3 (dict) e pytonlib (list)
+    """
+    try:
+        if not stack or len(stack) < 7:
+            print(f"[parse_sale_stack] Stack too small: {len(stack) if stack else 0}")
+            return None
+        
+        # DEBUG: mostra struttura stack
+        print(f"[parse_sale_stack] Stack size: {len(stack)}")
+        for i, item in enumerate(stack[:3]):
+            if isinstance(item, dict):
+                print(f"  [{i}] dict keys: {list(item.keys())}")
+            elif isinstance(item, list):
+                print(f"  [{i}] list len: {len(item)}")
+            else:
+                print(f"  [{i}] type: {type(item)}")
+        
+        # Determina tipo vendita dal primo elemento
+        sale_type_value = get_stack_value(stack[0], '')
+        sale_type = str(sale_type_value).upper()
+        
+        if 'AUC' in sale_type or '415543' in sale_type:
+            return parse_auction_stack(stack)
+        elif 'OFFER' in sale_type or '4f46464552' in sale_type:
+            return parse_offer_stack(stack)
+        else:
+            return parse_fixprice_stack(stack)
+            
+    except Exception as e:
+        print(f'[parse_sale_stack] Error: {e}')
+        import traceback
+        traceback.print_exc()
+        return None
+
+def parse_fixprice_stack(stack: list) -> Optional[tuple]:
+    """Parse fixprice sale stack - Supporta dict e list"""
+    try:
+        if len(stack) < 7:
+            return None
+        
+        action = 'SaleFixPrice'
+        
+        # Estrai valori gestendo dict/list
+        is_complete = bool(hex_to_int(stack[1]))
+        created_at = hex_to_int(stack[2])
+        marketplace_address = parse_address_from_cell(stack[3])
+        nft_address = parse_address_from_cell(stack[4])
+        nft_owner_address = parse_address_from_cell(stack[5]) if len(stack) > 5 else None
+        full_price = hex_to_int(stack[6]) / 1_000_000_000
+        
+        return (action, is_complete, created_at, marketplace_address,
+                nft_address, nft_owner_address, full_price)
+        
+    except Exception as e:
+        print(f'[parse_fixprice_stack] Error: {e}')
+        return None
+
+def parse_auction_stack(stack: list) -> Optional[tuple]:
+    """Parse auction sale stack - Supporta dict e list"""
+    try:
+        if len(stack) < 20:
+            return None
+        
+        action = 'SaleAuction'
+        
+        # Estrai valori
+        is_end = bool(hex_to_int(stack[1]))
+        end_time = hex_to_int(stack[2])
+        marketplace_address = parse_address_from_cell(stack[3])
+        nft_address = parse_address_from_cell(stack[4])
+        nft_owner_address = parse_address_from_cell(stack[5])
+        last_bid = hex_to_int(stack[6]) / 1_000_000_000
+        last_member = parse_address_from_cell(stack[7])
+        min_step = hex_to_int(stack[8]) / 1_000_000_000
+        max_bid = hex_to_int(stack[15]) / 1_000_000_000
+        min_bid = hex_to_int(stack[16]) / 1_000_000_000
+        created_at = hex_to_int(stack[17])
+        last_bid_at = hex_to_int(stack[18])
+        is_canceled = bool(hex_to_int(stack[19]))
+        
+        return (action, is_end, created_at, marketplace_address, nft_address,
+                nft_owner_address, min_bid, max_bid, min_step, last_bid_at,
+                last_member, last_bid, is_canceled, end_time)
+        
+    except Exception as e:
+        print(f'[parse_auction_stack] Error: {e}')
+        return None
+
+def parse_offer_stack(stack: list) -> Optional[tuple]:
+    """Parse offer sale stack - Supporta dict e list"""
+    try:
+        if len(stack) < 8:
+            return None
+        
+        action = 'SaleOffer'
+        
+        # Estrai valori
+        is_complete = bool(hex_to_int(stack[1]))
+        created_at = hex_to_int(stack[2])
+        marketplace_address = parse_address_from_cell(stack[4])
+        nft_address = parse_address_from_cell(stack[5])
+        offer_owner_address = parse_address_from_cell(stack[6])
+        full_price = hex_to_int(stack[7]) / 1_000_000_000
+        
+        return (action, is_complete, created_at, marketplace_address,
+                nft_address, offer_owner_address, full_price)
+        
+    except Exception as e:
+        print(f'[parse_offer_stack] Error: {e}')
+        return None
+
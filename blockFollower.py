@@ -0,0 +1,188 @@
+# blockFollower.py - Rilevamento dai blocchi masterchain (INGESTION_MODE=blocks)
+#
+#   python blockFollower.py     -> ultimo blocco, checkpoint e ritardo
+#
+# Con migliaia di indirizzi royalty il polling per indirizzo costa una get_transactions ciascuno a
+# ogni ciclo. Qui invece si segue la masterchain: per ogni seqno una richiesta
+# /transactionsByMasterchainBlock restituisce tutte le transazioni del blocco e dei blocchi shard
+# che referenzia (a pagine di BLOCKS_PAGE_SIZE), filtrate in locale contro gli indirizzi della
+# watch list (Bloom filter + conferma esatta, vedi addressFilter.py). Le transazioni di un indirizzo
+# royalty passano a main.royalty_trs come nel modo per indirizzo. Il costo dipende dal ritmo dei
+# blocchi, non dalla lunghezza della watch list.
+# Checkpoint: ultimo seqno elaborato (BLOCKS_CHECKPOINT), aggiornato a ogni blocco le cui vendite sono
+# state tutte risolte; un blocco con errori del provider viene riletto (per al massimo
+# BLOCKS_RETRY_WINDOW secondi). Dopo un fermo si recuperano i blocchi mancanti (BLOCKS_MAX_CATCHUP per
+# giro), oltre BLOCKS_MAX_GAP si salta avanti.
+import time
+from typing import Dict, List, Optional
+
+import metrics
+from config import BLOCKS_CHECKPOINT, BLOCKS_PAGE_SIZE, BLOCKS_MAX_CATCHUP, BLOCKS_MAX_GAP, BLOCKS_RETRY_WINDOW
+from addressFilter import AddressFilter
+from functions import normalize_address
+from watchList import watch_list
+
+
+class BlockFollower:
+    """Cursore sulla masterchain: seqno elaborato su disco, blocchi letti in ordine"""
+
+    def __init__(self, checkpoint_path: str = BLOCKS_CHECKPOINT):
+        self.checkpoint_path = checkpoint_path
+        self.lag = 0              # blocchi ancora da leggere dopo l'ultimo step
+        self._indexed = None      # tupla della watch list da cui è costruito l'indice
+        self._index = AddressFilter(())
+        self._retrying = None     # (seqno, primo tentativo) del blocco con vendite non risolte
+
+    # --- checkpoint ---
+
+    def read_checkpoint(self) -> Optional[int]:
+        try:
+            with open(self.checkpoint_path) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def write_checkpoint(self, seqno: int):
+        try:
+            with open(self.checkpoint_path, 'w') as f:
+                f.write(str(seqno))
+        except OSError as e:
+            print(f"[blocks] Error saving checkpoint: {e}", flush=True)
+
+    # --- API ---
+
+    async def last_seqno(self) -> Optional[int]:
+        import main as bot
+        data = await bot.toncenter_api.get_json('/masterchainInfo', {})
+        try:
+            return int(data['last']['seqno'])
+        except (TypeError, KeyError, ValueError):
+            return None
+
+    async def fetch_block(self, seqno: int) -> Optional[List[dict]]:
+        """Tutte le transazioni del blocco masterchain (shard inclusi) per lt crescente; None se fallisce"""
+        import main as bot
+        transactions = []
+        offset = 0
+        while True:
+            data = await bot.toncenter_api.get_json('/transactionsByMasterchainBlock', {
+                'seqno': seqno, 'limit': BLOCKS_PAGE_SIZE, 'offset': offset, 'sort': 'asc'})
+            if data is None:
+                return None
+            page = data.get('transactions') or []
+            transactions.extend(page)
+            if len(page) < BLOCKS_PAGE_SIZE:
+                return transactions
+            offset += BLOCKS_PAGE_SIZE
+
+    # --- filtro ---
+
+    def index(self) -> AddressFilter:
+        """Filtro degli indirizzi royalty della watch list, ricostruito solo dopo una ricarica"""
+        addresses = watch_list.royalty_addresses
+        if addresses is not self._indexed:
+            self._index = AddressFilter(addresses)
+            self._indexed = addresses
+            metrics.set_gauge('prefilter.bytes', self._index.nbytes)
+        return self._index
+
+    def match(self, transactions: List[dict]) -> Dict[str, List[dict]]:
+        """Transazioni del blocco raggruppate per indirizzo royalty (ordine del blocco)"""
+        accounts = [tx.get('account') or '' for tx in transactions]
+        matched: Dict[str, List[dict]] = {}
+        for i in self.index().select(accounts):
+            # Chiave nel formato della watch list (RAW maiuscolo), qualunque sia quello della risposta
+            matched.setdefault(normalize_address(accounts[i]), []).append(transactions[i])
+        return matched
+
+    async def process(self, seqno: int, transactions: List[dict]) -> List[dict]:
+        """Passa le tx degli indirizzi royalty a royalty_trs; ritorna quelle non risolte per errore del provider"""
+        import main as bot
+        matched = self.match(transactions)
+        metrics.inc('blocks.transactions', len(transactions))
+        unresolved = []
+        for address, txs in matched.items():
+            print(f"[blocks] 🎯 Block {seqno}: {len(txs)} tx on {address[-8:]}", flush=True)
+            # royalty_trs si aspetta l'ordine di get_transactions (dalla più recente)
+            await bot.royalty_trs(address, transactions=txs[::-1], unresolved=unresolved)
+        metrics.inc('blocks.matched', sum(len(txs) for txs in matched.values()))
+        return unresolved
+
+    def give_up(self, seqno: int, unresolved: List[dict]) -> bool:
+        """True se il blocco va superato comunque: vendite non risolte da oltre BLOCKS_RETRY_WINDOW secondi"""
+        if self._retrying is None or self._retrying[0] != seqno:
+            self._retrying = (seqno, time.time())
+        metrics.inc('blocks.retries')
+        if time.time() - self._retrying[1] < BLOCKS_RETRY_WINDOW:
+            print(f"[blocks] ⚠️ Block {seqno}: {len(unresolved)} tx unresolved (provider error), "
+                  "retrying later", flush=True)
+            return False
+        hashes = ', '.join(tx.get('hash', '')[:16] for tx in unresolved)
+        print(f"[blocks] ❌ Block {seqno}: giving up on {len(unresolved)} unresolved tx after "
+              f"{BLOCKS_RETRY_WINDOW}s ({hashes}); use backfill.py for them", flush=True)
+        metrics.inc('blocks.unresolved', len(unresolved))
+        return True
+
+    # --- ciclo ---
+
+    async def step(self) -> int:
+        """Legge i blocchi dopo il checkpoint (al massimo BLOCKS_MAX_CATCHUP); ritorna quanti"""
+        last = await self.last_seqno()
+        if last is None:
+            print("[blocks] ⚠️ masterchainInfo unavailable", flush=True)
+            return 0
+        seqno = self.read_checkpoint()
+        if seqno is None:
+            # Primo avvio: si parte dal blocco corrente (lo storico si recupera con backfill.py)
+            self.write_checkpoint(last)
+            print(f"[blocks] ✅ New checkpoint at seqno {last}", flush=True)
+            self.lag = 0
+            return 0
+        if last - seqno > BLOCKS_MAX_GAP:
+            skipped = last - BLOCKS_MAX_GAP - seqno
+            print(f"[blocks] ⚠️ {last - seqno} blocks behind: skipping {skipped} "
+                  f"(use backfill.py for that range)", flush=True)
+            metrics.inc('blocks.skipped', skipped)
+            seqno = last - BLOCKS_MAX_GAP
+
+        read = 0
+        started = time.time()
+        while seqno < last and read < BLOCKS_MAX_CATCHUP:
+            transactions = await self.fetch_block(seqno + 1)
+            if transactions is None:
+                print(f"[blocks] ⚠️ Block {seqno + 1} unavailable, retrying later", flush=True)
+                break
+            unresolved = await self.process(seqno + 1, transactions)
+            # Il checkpoint non supera un blocco con vendite da ritentare (i doppioni li ferma l'alert ledger)
+            if unresolved and not self.give_up(seqno + 1, unresolved):
+                break
+            seqno += 1
+            read += 1
+            self.write_checkpoint(seqno)
+        self.lag = last - seqno
+        if read:
+            metrics.inc('blocks.processed', read)
+            metrics.observe('blocks.step_latency', time.time() - started)
+        metrics.set_gauge('blocks.lag', self.lag)
+        metrics.set_gauge('blocks.seqno', seqno)
+        if self.lag:
+            print(f"[blocks] ⏩ Catching up: seqno {seqno}, {self.lag} blocks behind", flush=True)
+        return read
+
+
+# Global instance (usata da main.block_scheduler)
+block_follower = BlockFollower()
+
+
+if __name__ == '__main__':
+    import asyncio
+    from httpPool import close_session
+
+    async def status():
+        last = await block_follower.last_seqno()
+        seqno = block_follower.read_checkpoint()
+        print(f"masterchain seqno {last}, checkpoint {seqno}, "
+              f"lag {last - seqno if last is not None and seqno is not None else '?'}")
+        await close_session()
+
+    asyncio.run(status())
@@ -0,0 +1,185 @@
+# collectionFeed.py - Rilevamento delle vendite per collezione (INGESTION_MODE=collections)
+#
+# Invece di leggere le transazioni degli indirizzi royalty e chiamare get_sale_data su ogni
+# contratto di vendita, per ogni collezione di collections_list:
+#   1. /nft/transfers?collection_address=...  -> trasferimenti dopo il checkpoint, a pagine (asc)
+#   2. /actions?trace_id=...&trace_id=...      -> azioni nft_transfer delle stesse trace, in blocco:
+#                                                 is_purchase, prezzo, venditore, compratore, marketplace
+# Nessuna get-method per vendita: una collezione costa 1 richiesta ogni COLLECTION_FEED_PAGE_SIZE
+# trasferimenti + 1 ogni COLLECTION_FEED_TRACE_BATCH trace nuove. Gli alert passano da
+# main.dispatch_sale come nel modo royalty (stesso ledger, stessi doppioni fermati).
+# Checkpoint per collezione: lastUtime.collection.0_HEX.txt (TonAPI non ha un feed di eventi per
+# collezione: per questo si usano trasferimenti e azioni di TON Center).
+import time
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+from config import COLLECTION_FEED_PAGE_SIZE, COLLECTION_FEED_MAX_PAGES, COLLECTION_FEED_TRACE_BATCH
+from functions import normalize_address
+from nftData import get_nft_data
+from saleRecords import FixPriceSale, NftInfo, NANO
+from salesLedger import sale_record
+from alertLedger import alert_ledger
+
+
+def checkpoint_key(collection: str) -> str:
+    """Chiave del checkpoint per main.read_last_utime / write_last_utime"""
+    return f'collection.{collection}'
+
+
+def start_collection_checkpoints(change):
+    """Watch list: una collezione aggiunta parte da adesso (lo storico si recupera con backfill.py)"""
+    import main as bot
+    now = int(time.time())
+    for collection in change.added_collections:
+        bot.write_last_utime(now, checkpoint_key(collection))
+        print(f"[collections] ✅ New checkpoint for {collection[-8:]}: {now}", flush=True)
+
+
+async def fetch_transfers(collection: str, start_utime: int) -> Optional[List[dict]]:
+    """Trasferimenti della collezione da start_utime (incluso), in ordine cronologico; None se la prima pagina fallisce"""
+    import main as bot
+    transfers = []
+    for page in range(COLLECTION_FEED_MAX_PAGES):
+        data = await bot.toncenter_api.get_json('/nft/transfers', {
+            'collection_address': collection,
+            'start_utime': start_utime,
+            'sort': 'asc',
+            'limit': COLLECTION_FEED_PAGE_SIZE,
+            'offset': page * COLLECTION_FEED_PAGE_SIZE,
+        })
+        if data is None:
+            # Pagine già lette: il checkpoint avanza fin lì, il resto al ciclo successivo
+            return transfers if page else None
+        items = data.get('nft_transfers') or []
+        transfers.extend(items)
+        if len(items) < COLLECTION_FEED_PAGE_SIZE:
+            break
+    return transfers
+
+
+def parse_purchase(action: dict) -> Optional[Tuple[str, dict]]:
+    """(nft, campi della vendita) da un'azione nft_transfer con is_purchase (o nft_purchase); None altrimenti"""
+    details = action.get('details') or {}
+    kind = action.get('type')
+    if kind == 'nft_transfer' and not details.get('is_purchase'):
+        return None
+    if kind not in ('nft_transfer', 'nft_purchase') or action.get('success') is False:
+        return None
+    nft = normalize_address(details.get('nft_item') or details.get('nft_address') or '')
+    try:
+        price = int(details.get('price') or details.get('amount') or 0)
+    except (TypeError, ValueError):
+        price = 0
+    if not nft or price <= 0:
+        return None
+    return nft, {
+        'is_complete': True,
+        'nft': nft,
+        'price_ton': price / NANO,
+        'seller': normalize_address(details.get('real_prev_owner') or details.get('old_owner')
+                                    or details.get('seller') or ''),
+        'buyer': normalize_address(details.get('new_owner') or details.get('buyer') or ''),
+        'marketplace': normalize_address(details.get('marketplace_address') or ''),
+    }
+
+
+async def fetch_purchases(trace_ids: List[str]) -> Optional[Dict[Tuple[str, str], dict]]:
+    """(trace_id, nft) -> campi della vendita, con una richiesta /actions per lotto di trace; None se fallisce"""
+    import main as bot
+    purchases = {}
+    for start in range(0, len(trace_ids), COLLECTION_FEED_TRACE_BATCH):
+        batch = trace_ids[start:start + COLLECTION_FEED_TRACE_BATCH]
+        params = [('trace_id', trace_id) for trace_id in batch]
+        params += [('action_type', 'nft_transfer'), ('action_type', 'nft_purchase'),
+                   ('limit', 10 * len(batch))]
+        data = await bot.toncenter_api.get_json('/actions', params)
+        if data is None:
+            return None
+        for action in data.get('actions') or []:
+            parsed = parse_purchase(action)
+            if parsed:
+                purchases[(action.get('trace_id'), parsed[0])] = parsed[1]
+    return purchases
+
+
+async def collection_trs(collection: str, deliver=None) -> Optional[int]:
+    """
+    Un ciclo di rilevamento su una collezione (checkpoint per collezione), come royalty_trs.
+    Ritorna il nuovo checkpoint (None se non è avanzato).
+    """
+    import main as bot
+    deliver = deliver or bot.deliver_alert
+    key = checkpoint_key(collection)
+    sale_records = []
+    try:
+        last_utime = bot.read_last_utime(key)
+        if not last_utime:
+            # Nessun checkpoint: partire da adesso, non dall'inizio della collezione
+            last_utime = int(time.time())
+            bot.write_last_utime(last_utime, key)
+        print(f"[collections] 🔍 {collection[-8:]} since {time.ctime(last_utime)}", flush=True)
+
+        transfers = await fetch_transfers(collection, last_utime)
+        if transfers is None:
+            return None
+        transfers = [t for t in transfers
+                     if t.get('trace_id') and not t.get('transaction_aborted')
+                     and int(t.get('transaction_now') or 0) >= last_utime]
+        if not transfers:
+            print(f"[collections] ⚠️ No new transfers for {collection[-8:]}", flush=True)
+            return None
+        metrics.inc('collections.transfers', len(transfers))
+
+        # Trasferimenti già nel registro alert: vendita già gestita. Le azioni si chiedono solo per le
+        # trace con trasferimenti nuovi (una trace può contenere più vendite, es. un acquisto multiplo)
+        new_transfers = [t for t in transfers if not alert_ledger.has_tx(t.get('transaction_hash'))]
+        new_traces = list(dict.fromkeys(t['trace_id'] for t in new_transfers))
+        purchases = await fetch_purchases(new_traces) if new_traces else {}
+        if purchases is None:
+            return None
+
+        processed_count = 0
+        for transfer in new_transfers:
+            nft_address = normalize_address(transfer.get('nft_address') or '')
+            fields = purchases.get((transfer['trace_id'], nft_address))
+            if not fields:
+                continue
+            purchases.pop((transfer['trace_id'], nft_address))   # un trasferimento per vendita
+            tx = {
+                'trace_id': transfer['trace_id'],
+                'hash': transfer.get('transaction_hash', ''),
+                'lt': transfer.get('transaction_lt') or 0,
+                'now': int(transfer.get('transaction_now') or 0),
+            }
+            sale = FixPriceSale.from_fields(created_at=tx['now'], **fields)
+            print(f"[collections] ✅ Sale {nft_address[-12:]}: {sale.price_ton} TON", flush=True)
+
+            # Metadati dalla cache / getItems (nessuna get-method); il buyer è già noto
+            nft_info = await get_nft_data(nft_address, owner=sale.buyer)
+            if not (nft_info and nft_info.ok):
+                nft_info = NftInfo(True, collection, sale.buyer, None, None)
+            elif nft_info.collection != collection:
+                nft_info = NftInfo(True, collection, nft_info.owner, nft_info.name, nft_info.image)
+
+            sale_records.append(sale_record(tx, sale, nft_address, nft_info, None))
+            outcome = await bot.dispatch_sale(tx, sale, nft_address, nft_info, deliver)
+            if outcome == 'queued':
+                processed_count += 1
+        metrics.inc('collections.sales', len(sale_records))
+
+        bot.flush_sale_records(sale_records)
+        # Tutte le vendite lette sono nei ledger: il checkpoint avanza all'ultimo trasferimento
+        # (quelli dello stesso secondo vengono riletti, i doppioni li ferma l'alert ledger)
+        new_utime = max(int(t.get('transaction_now') or 0) for t in transfers)
+        bot.write_last_utime(new_utime, key)
+        print(f"[collections] 💾 {collection[-8:]}: {len(transfers)} transfers, {len(sale_records)} sales, "
+              f"{processed_count} alerts, checkpoint {new_utime}", flush=True)
+        return new_utime
+
+    except Exception as e:
+        print(f"[collections] ❌ Error on {collection[-8:]}: {e}", flush=True)
+        import traceback
+        traceback.print_exc()
+        bot.flush_sale_records(sale_records)
+        return None
@@ -3,12 +3,29 @@ import pathlib
 import os
 
 current_path = pathlib.Path(__file__).parent.resolve()
+# Stato persistente (SQLite, checkpoint): su un disco condiviso per l'active/standby (vedi HA)
+data_path = os.environ.get('DATA_DIR', str(current_path))
 
 # === TON CENTER API CONFIG ===
 TONCENTER_API_V3 = "https://toncenter.com/api/v3"
 TONCENTER_API_V2 = "https://toncenter.com/api/v2"
 TONCENTER_RATE_LIMIT = 1  # secondi tra le richieste
 
+# === HTTP POOL ===
+HTTP_POOL_LIMIT = 50            # connessioni totali nel pool condiviso
+HTTP_POOL_LIMIT_PER_HOST = 10   # connessioni per singolo host
+HTTP_DEFAULT_TIMEOUT = 20       # secondi
+
+# === SELF-PING (keep-alive Render) ===
+SELF_PING_INTERVAL = int(os.environ.get('SELF_PING_INTERVAL', 300))  # secondi tra i ping
+SELF_PING_JITTER = int(os.environ.get('SELF_PING_JITTER', 30))       # +/- secondi casuali
+SELF_PING_INITIAL_DELAY = 30    # attesa prima del primo ping
+SELF_PING_TIMEOUT = 15
+
+# === HTTP CASSETTE (cattura / replay del traffico verso i provider, per test e benchmark offline) ===
+HTTP_CASSETTE_MODE = os.environ.get('HTTP_CASSETTE_MODE', 'off').lower()   # off | record | replay
+HTTP_CASSETTE_PATH = os.environ.get('HTTP_CASSETTE', f'{current_path}/cassettes/default.jsonl.gz')
+HTTP_CASSETTE_LATENCY = float(os.environ.get('HTTP_CASSETTE_LATENCY', 0))  # replay: 0 = subito, 1 = latenza registrata
 
 # === BOT CONFIGURATION ===
 trs_limit = 25
@@ -23,6 +40,14 @@ collections_list = [
     '0:388B9F22B92F4351846D519F7BB19A399A791B898501A565D039EDDD11409C3F'
 ]
 
+# Routing per collezione: ogni voce = una chat iscritta a una collezione.
+# Le collezioni di collections_list senza voci qui vanno a NOTIFY_CHAT con template 'full'.
+# Campi: collection (RAW o EQ), chat (default NOTIFY_CHAT), min_price / max_price (TON),
+#        sale_types (['SaleFixPrice', 'SaleAuction', 'SaleOffer']), template ('full' | 'compact')
+subscriptions = [
+    # {'collection': '0:388B...', 'chat': '-1001234567890', 'min_price': 50, 'template': 'compact'},
+]
+
 # === MARKETPLACES ===
 # NOTA: I marketplace possono avere DUE formati:
 # 1. Indirizzi EQ per link web (nelle markets_links)
@@ -48,10 +73,12 @@ markets_links = {
 }
 
 getgems_user_url = 'https://getgems.io/user/'
+getgems_collection_url = 'https://getgems.io/collection/'
 
 # === EXTERNAL APIs ===
 tonorg_price_url = 'https://api.coingecko.com/api/v3/simple/price?ids=the-open-network&vs_currencies=usd'
 cmc_url = 'https://pro-api.coinmarketcap.com/v1/cryptocurrency/quotes/latest'
+tonapi_rates_url = 'https://tonapi.io/v2/rates?tokens=ton&currencies=usd'
 getgems_api_url = 'https://api.getgems.io/graphql'
 getgems_query = """
 query nftSearch($count: Int!, $cursor: String, $query: String, $sort: String) {
@@ -70,6 +97,132 @@ query nftSearch($count: Int!, $cursor: String, $query: String, $sort: String) {
 }
 """
 
+# === TON/USD PRICE ORACLE ===
+PRICE_REFRESH_INTERVAL = 60       # secondi tra un refresh e l'altro
+PRICE_RETRY_INTERVAL = 15         # secondi se il refresh fallisce
+PRICE_STALE_AFTER = 600           # oltre questa età la quotazione è segnalata come stale
+PRICE_MAX_AGE = 6 * 3600          # oltre questa età non si converte più (meglio niente che un numero inventato)
+
+# === COLLECTION FLOOR CACHE ===
+FLOOR_REFRESH_INTERVAL = 300      # refresh periodico di tutte le collezioni monitorate
+FLOOR_MAX_AGE = 900               # oltre questa età il floor non viene mostrato negli alert
+FLOOR_SALE_REFRESH_DELAY = 5      # attesa dopo una vendita prima del refresh (raggruppa le vendite a raffica)
+
+# === NFT METADATA CACHE ===
+NFT_CACHE_DB = f'{data_path}/nft_cache.db'   # SQLite su disco (sopravvive ai riavvii)
+NFT_CACHE_MEMORY_SIZE = 5000                     # voci nella LRU in memoria
+NFT_OWNER_TTL = 120                              # secondi di validità dell'owner in cache
+
+# === SALES LEDGER ===
+SALES_DB = f'{data_path}/sales.db'            # storico vendite rilevate (SQLite WAL)
+
+# === SALES ANALYTICS (statistiche 1h/24h/7d in memoria, vedi salesAnalytics.py) ===
+ANALYTICS_PRICE_BINS = 160        # bin logaritmici dell'istogramma prezzi (mediana approssimata a ~6%)
+ANALYTICS_MIN_PRICE = 0.01        # TON, primo bin
+ANALYTICS_MAX_PRICE = 1_000_000   # TON, ultimo bin
+
+# === PRICE CLASSIFIER (tag #SushiLover / #WhaleHere dalle vendite recenti, vedi priceClassifier.py) ===
+PRICE_WINDOW = 200                # ultime vendite per collezione considerate
+PRICE_MIN_SAMPLES = 20            # sotto questa soglia si usa il floor (≤1.2x / ≥2x)
+PRICE_LOW_PERCENTILE = 10         # 🍣 #SushiLover: prezzo nel 10% più basso...
+PRICE_HIGH_PERCENTILE = 95        # 🔥 #WhaleHere: ...o nel 5% più alto
+PRICE_ZSCORE = 2.0                # ...o a più di 2 deviazioni standard (log prezzo) dalla media
+
+# === MEDIA (preview scaricate in anticipo + file_id Telegram, vedi mediaCache.py) ===
+MEDIA_DB = f'{data_path}/media.db'
+MEDIA_DIR = f'{data_path}/media'
+MEDIA_FETCH_TIMEOUT = 10          # secondi per scaricare una preview
+MEDIA_WAIT = 3                    # il sender aspetta un download in corso al massimo questi secondi
+MEDIA_MAX_SIDE = 1280             # px, lato lungo dopo il resize (serve Pillow)
+MEDIA_MAX_BYTES = 10 * 1024 * 1024   # limite Telegram per l'upload di una foto
+MEDIA_CONCURRENCY = 4             # download in parallelo
+MEDIA_KEEP = 24 * 3600            # file scaricati e mai inviati vengono eliminati dopo 24h
+MEDIA_RETRY_AFTER = 3600          # un'immagine non scaricabile viene ritentata dopo 1h
+MEDIA_IPFS_GATEWAY = 'https://ipfs.io/ipfs/'
+
+# === ALERT LEDGER (exactly-once notifiche) ===
+ALERTS_DB = f'{data_path}/alerts.db'
+ALERT_MAX_ATTEMPTS = 5            # tentativi di invio prima di rinunciare
+ALERT_RETRY_MAX_AGE = 6 * 3600    # alert più vecchi non vengono più ritentati
+
+# === TELEGRAM OUTBOX ===
+OUTBOX_DB = f'{data_path}/outbox.db'    # coda persistente dei messaggi da inviare
+OUTBOX_WORKERS = 4                          # sender concorrenti
+TELEGRAM_GLOBAL_RATE = 30                   # messaggi/secondo su tutto il bot
+TELEGRAM_GROUP_RATE = 20                    # messaggi/minuto per gruppo o canale
+TELEGRAM_PRIVATE_RATE = 1                   # messaggi/secondo per chat privata
+OUTBOX_MAX_ATTEMPTS = 8                     # poi il messaggio è scartato (dead)
+OUTBOX_BACKOFF_BASE = 2                     # secondi, raddoppia a ogni tentativo
+OUTBOX_BACKOFF_MAX = 300
+OUTBOX_KEEP_DONE = 24 * 3600                # i messaggi inviati restano in tabella per 24h
+
+# === DIGEST (raffiche di vendite) ===
+# Oltre DIGEST_THRESHOLD vendite della stessa collezione in DIGEST_WINDOW secondi
+# le vendite successive vengono raggruppate in un unico messaggio con album.
+DIGEST_ENABLED = True
+DIGEST_THRESHOLD = 3
+DIGEST_WINDOW = 60
+DIGEST_MAX_ITEMS = 10             # righe/immagini nel digest (un album Telegram ne accetta max 10)
+# Override per chat: {'-1001234567890': {'enabled': True, 'threshold': 5, 'window': 120}}
+DIGEST_CHAT_SETTINGS = {}
+
+# === TELEGRAM COMMANDS ===
+# 'polling' = getUpdates con sessione persistente; 'webhook' = update in POST sul web server del bot
+TELEGRAM_MODE = os.environ.get('TELEGRAM_MODE', 'polling').lower()
+TELEGRAM_WEBHOOK_URL = os.environ.get('TELEGRAM_WEBHOOK_URL') or os.environ.get('RENDER_EXTERNAL_URL', '')
+TELEGRAM_WEBHOOK_PATH = '/telegram/webhook'
+TELEGRAM_POLL_TIMEOUT = 30        # secondi di long polling per getUpdates
+COMMAND_WORKERS = 4               # comandi eseguiti in parallelo (chat diverse)
+COMMAND_QUEUE_LIMIT = 200         # comandi in attesa oltre i quali i nuovi vengono scartati
+
+# === BACKFILL (storico vendite, senza notifiche) ===
+BACKFILL_CHECKPOINT = f'{data_path}/backfill_checkpoint.json'
+BACKFILL_PAGE_SIZE = 100          # transazioni per pagina di /transactions
+BACKFILL_CONCURRENCY = 4          # vendite risolte in parallelo
+BACKFILL_RATE = float(os.environ.get('BACKFILL_RATE', 1))   # richieste/secondo (10 con API key TON Center)
+BACKFILL_RETRIES = 3              # nuovi tentativi sulle tx non risolte per errore del provider
+
+# === SHARDING (polling su più processi) ===
+# Con SHARD_WORKERS > 1 gli indirizzi royalty sono divisi tra N processi worker (hash consistente);
+# il processo principale riceve le vendite su una coda locale e invia gli alert.
+SHARD_WORKERS = int(os.environ.get('SHARD_WORKERS', 1))
+SHARD_POLL_INTERVAL = 180         # secondi tra i cicli di ogni worker
+SHARD_SWEEP_INTERVAL = 30         # il notifier riprende dal ledger gli alert non arrivati sulla coda
+SHARD_RESTART_DELAY = 5           # attesa prima di riavviare un worker terminato
+SHARD_VIRTUAL_NODES = 64          # punti per shard sull'anello di hash
+
+# === INGESTION (sorgente delle vendite) ===
+# 'royalty'     = transazioni degli indirizzi royalty + get_sale_data per ogni vendita (default)
+# 'collections' = feed /nft/transfers per collezione di collections_list + azioni in blocco (collectionFeed.py)
+# 'blocks'      = tutte le transazioni di ogni blocco masterchain, filtrate in locale (blockFollower.py)
+INGESTION_MODE = os.environ.get('INGESTION_MODE', 'royalty').lower()
+COLLECTION_FEED_PAGE_SIZE = 100   # trasferimenti per pagina
+COLLECTION_FEED_MAX_PAGES = 10    # pagine per collezione e ciclo (il resto al ciclo successivo)
+COLLECTION_FEED_TRACE_BATCH = 50  # trace per richiesta /actions
+BLOCKS_CHECKPOINT = f'{data_path}/lastSeqno.txt'   # ultimo blocco masterchain elaborato
+BLOCKS_PAGE_SIZE = 256            # transazioni per richiesta (un blocco può richiederne più di una)
+BLOCKS_POLL_INTERVAL = 3          # secondi di attesa quando si è in pari (un blocco ogni ~3-5s)
+BLOCKS_MAX_CATCHUP = 100          # blocchi per giro prima di riprovare gli alert in sospeso
+BLOCKS_MAX_GAP = 20000            # ritardo massimo recuperato (~1 giorno); oltre si salta avanti
+BLOCKS_RETRY_WINDOW = 600         # secondi di tentativi su un blocco con vendite non risolte, poi si supera
+
+# === ADDRESS PREFILTER (Bloom filter sugli account id, vedi addressFilter.py) ===
+PREFILTER_FP_RATE = 0.01          # falsi positivi del filtro (confermati poi sugli id esatti)
+
+# === WATCH LIST (file esterno ricaricato a caldo, vedi watchList.py) ===
+# Se il file esiste sostituisce royalty_addresses, collections_list, subscriptions, markets e markets_links.
+WATCHLIST_FILE = os.environ.get('WATCHLIST_FILE', f'{current_path}/watchlist.json')   # .json o .toml
+WATCHLIST_POLL_INTERVAL = 5       # secondi tra i controlli del file (mtime)
+
+# === HA (active/standby con lease) ===
+# Con HA_ENABLED più istanze condividono lo stesso DATA_DIR: solo chi tiene il lease rileva e invia,
+# le altre restano in standby e subentrano alla scadenza (checkpoint e alert ledger sono su disco).
+HA_ENABLED = os.environ.get('HA_ENABLED', '').lower() in ('1', 'true', 'yes')
+HA_LEASE_DB = os.environ.get('HA_LEASE_DB', f'{data_path}/lease.db')
+HA_NODE_ID = os.environ.get('HA_NODE_ID', '')        # vuoto = hostname-pid
+HA_LEASE_TTL = float(os.environ.get('HA_LEASE_TTL', 10))          # secondi di validità del lease
+HA_RENEW_INTERVAL = float(os.environ.get('HA_RENEW_INTERVAL', 2))  # rinnovo (active) e tentativi (standby)
+
 # GET methods to try
 get_methods = ['get_sale_data', 'get_offer_data']
 
@@ -102,6 +255,5 @@ def verify_addresses():
     
     return True
 
-# Esegui verifica all'importazione
-if __name__ != "__main__":
+if __name__ == "__main__":
     verify_addresses()
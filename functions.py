@@ -4,10 +4,16 @@ import asyncio
 import base64
 import json
 import re
+import time
+from functools import lru_cache
 from typing import Optional, Dict, Any, Tuple
+import metrics
+from httpPool import get_session
 from secretData import cmc_token
-from config import tonorg_price_url, cmc_url, cmc_headers
+from config import tonorg_price_url, cmc_url, cmc_headers, tonapi_rates_url
+from config import PRICE_REFRESH_INTERVAL, PRICE_RETRY_INTERVAL, PRICE_STALE_AFTER, PRICE_MAX_AGE
 from secretData import tonapi_token # Importiamo il token
+from saleRecords import Sale, FixPriceSale, AuctionSale, OfferSale
 
 
 # === TON CENTER API CONFIGURATION ===
@@ -23,46 +29,202 @@ if toncenter_api_key:
 # ✅ TONAPI CONFIG - subito dopo gli import, prima delle funzioni
 TONAPI_BASE_URL = "https://tonapi.io"
 
+PRICE_SOURCE_TIMEOUT = aiohttp.ClientTimeout(total=10)
+
+# ============= TON/USD PRICE ORACLE =============
+
+class TonPriceOracle:
+    """
+    Quotazione TON/USD in memoria, aggiornata in background.
+    Le conversioni sono sincrone e non fanno chiamate HTTP; se nessuna
+    fonte risponde da troppo tempo la conversione ritorna None (mai prezzi inventati).
+    """
+
+    def __init__(self, refresh_interval: float = PRICE_REFRESH_INTERVAL,
+                 stale_after: float = PRICE_STALE_AFTER, max_age: float = PRICE_MAX_AGE):
+        self.refresh_interval = refresh_interval
+        self.stale_after = stale_after
+        self.max_age = max_age
+        self.price_usd: Optional[float] = None
+        self.updated_at: float = 0.0
+        self.sources: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._refresh_lock: Optional[asyncio.Lock] = None
+
+    # --- sorgenti ---
+
+    async def _fetch_coingecko(self, session) -> Optional[float]:
+        async with session.get(tonorg_price_url, timeout=PRICE_SOURCE_TIMEOUT) as response:
+            if response.status == 200:
+                data = await response.json()
+                return float(data['the-open-network']['usd'])
+            print(f"[price] ⚠️ CoinGecko status {response.status}")
+        return None
+
+    async def _fetch_coinmarketcap(self, session) -> Optional[float]:
+        if not cmc_token:
+            return None
+        headers = dict(cmc_headers)
+        headers['X-CMC_PRO_API_KEY'] = cmc_token
+        async with session.get(cmc_url, params={'slug': 'toncoin', 'convert': 'USD'},
+                               headers=headers, timeout=PRICE_SOURCE_TIMEOUT) as response:
+            if response.status == 200:
+                data = await response.json()
+                for coin in data.get('data', {}).values():
+                    price = coin.get('quote', {}).get('USD', {}).get('price')
+                    if price:
+                        return float(price)
+            else:
+                print(f"[price] ⚠️ CoinMarketCap status {response.status}")
+        return None
+
+    async def _fetch_tonapi(self, session) -> Optional[float]:
+        headers = {"Accept": "application/json"}
+        if tonapi_token:
+            headers["Authorization"] = f"Bearer {tonapi_token}"
+        async with session.get(tonapi_rates_url, headers=headers, timeout=PRICE_SOURCE_TIMEOUT) as response:
+            if response.status == 200:
+                data = await response.json()
+                return float(data['rates']['TON']['prices']['USD'])
+            print(f"[price] ⚠️ TonAPI rates status {response.status}")
+        return None
+
+    # --- refresh ---
+
+    async def refresh(self) -> Optional[float]:
+        """Interroga tutte le fonti in parallelo e fonde i risultati (mediana)"""
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+
+        async with self._refresh_lock:
+            session = get_session()
+            fetchers = {
+                'coingecko': self._fetch_coingecko,
+                'coinmarketcap': self._fetch_coinmarketcap,
+                'tonapi': self._fetch_tonapi,
+            }
+            results = await asyncio.gather(*(f(session) for f in fetchers.values()),
+                                           return_exceptions=True)
+
+            sources = {}
+            for name, result in zip(fetchers, results):
+                if isinstance(result, Exception):
+                    print(f"[price] ⚠️ {name} failed: {type(result).__name__}: {str(result)[:80]}")
+                elif result and result > 0:
+                    sources[name] = result
+
+            if not sources:
+                metrics.inc('price.refresh_failed')
+                print(f"[price] ❌ No price source available (quote age: {self.age():.0f}s)")
+                return None
+
+            values = sorted(sources.values())
+            mid = len(values) // 2
+            price = values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2
+
+            self.price_usd = price
+            self.sources = sources
+            self.updated_at = time.time()
+            metrics.inc('price.refresh_ok')
+            metrics.set_gauge('price.ton_usd', price)
+            metrics.set_gauge('price.updated_at', self.updated_at)
+            print(f"[price] ✅ TON/USD {price:.4f} from {', '.join(sorted(sources))}")
+            return price
+
+    async def run(self):
+        """Loop di refresh in background"""
+        while True:
+            try:
+                ok = await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[price] ❌ Refresh error: {e}")
+                ok = None
+            await asyncio.sleep(self.refresh_interval if ok else PRICE_RETRY_INTERVAL)
+
+    def start(self) -> asyncio.Task:
+        """Avvia il refresh in background (una sola volta)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+        return self._task
+
+    # --- lettura (sincrona, solo memoria) ---
+
+    def age(self) -> float:
+        """Età della quotazione in secondi (inf se mai ottenuta)"""
+        if not self.updated_at:
+            return float('inf')
+        return time.time() - self.updated_at
+
+    def is_stale(self) -> bool:
+        return self.age() > self.stale_after
+
+    def convert(self, ton: float) -> Optional[float]:
+        """TON -> USD dalla quotazione in memoria; None se assente o troppo vecchia"""
+        if self.price_usd is None or self.age() > self.max_age:
+            return None
+        try:
+            return round(float(ton) * self.price_usd, 2)
+        except (TypeError, ValueError):
+            return None
+
+    def quote(self) -> dict:
+        return {
+            'price_usd': self.price_usd,
+            'age': self.age(),
+            'stale': self.is_stale(),
+            'sources': dict(self.sources),
+        }
+
+# Global instance
+price_oracle = TonPriceOracle()
+
+def format_usd(ton: float) -> str:
+    """Testo ' ($x.xx)' per i messaggi; '~' se la quotazione è stale, vuoto se non disponibile"""
+    usd = price_oracle.convert(ton)
+    if usd is None:
+        return ''
+    return f' (~${usd:.2f})' if price_oracle.is_stale() else f' (${usd:.2f})'
+
 async def convert_ton_to_usd(ton: float) -> Optional[float]:
-    """Convert TON to USD (async)"""
+    """Convert TON to USD (async, retrocompatibile): usa la quotazione in memoria"""
+    if price_oracle.price_usd is None:
+        # Primo utilizzo prima del refresh in background
+        await price_oracle.refresh()
+    return price_oracle.convert(ton)
+
+# ============= INDIRIZZI =============
+
+@lru_cache(maxsize=65536)
+def normalize_address(address: str) -> Optional[str]:
+    """
+    Indirizzo canonico RAW maiuscolo (es. '0:68F3...') a partire da formato
+    raw ('0:abc...') o user-friendly ('EQ...'/'UQ...'). None se non valido.
+    """
+    if not address or not isinstance(address, str):
+        return None
+    address = address.strip()
+    
     try:
-        # First try CoinGecko (free, reliable)
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                "https://api.coingecko.com/api/v3/simple/price",
-                params={'ids': 'the-open-network', 'vs_currencies': 'usd'},
-                timeout=10
-            ) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if 'the-open-network' in data and 'usd' in data['the-open-network']:
-                        usd_price = data['the-open-network']['usd']
-                        return round(float(ton) * usd_price, 2)
-        
-        # Fallback to CoinMarketCap if available
-        if cmc_token:
-            cmc_headers['X-CMC_PRO_API_KEY'] = cmc_token
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    cmc_url,
-                    params={'slug': 'toncoin', 'convert': 'USD'},
-                    headers=cmc_headers,
-                    timeout=10
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        ton_data = data.get('data', {})
-                        if ton_data:
-                            quote = ton_data.get('11419', {}).get('quote', {}).get('USD', {})
-                            usd = quote.get('price', 0)
-                            return round(float(ton) * usd, 2)
-        
-        # Final fallback: fixed approximate value
-        return round(float(ton) * 7.5, 2)
-        
-    except Exception as e:
-        print(f'[convert_ton_to_usd] Error: {e}')
+        # Formato raw: workchain:hex64
+        if ':' in address:
+            workchain, _, hex_part = address.partition(':')
+            if len(hex_part) != 64:
+                return None
+            bytes.fromhex(hex_part)
+            return f"{int(workchain)}:{hex_part.upper()}"
+        
+        # Formato user-friendly: 48 caratteri base64(url) = flag + workchain + hash32 + crc16
+        if len(address) == 48:
+            raw = base64.urlsafe_b64decode(address.replace('+', '-').replace('/', '_'))
+            if len(raw) == 36:
+                workchain = raw[1] - 256 if raw[1] > 127 else raw[1]
+                return f"{workchain}:{raw[2:34].hex().upper()}"
+    except (ValueError, TypeError):
         return None
+    
+    return None
 
 # ============= FUNZIONI DI UTILITY PER LO STACK =============
 
@@ -116,24 +278,65 @@ def hex_to_int(value):
     except:
         return 0
 
+BOC_MAGIC = b'\xb5\xee\x9c\x72'
+
+def decode_boc_address(boc: bytes) -> Optional[str]:
+    """
+    Decoder diretto dell'indirizzo all'inizio della cella root di un BOC (senza costruire le celle).
+    Gestisce addr_none e addr_std; per tutto il resto solleva ValueError (-> tonsdk).
+    """
+    if boc[:4] != BOC_MAGIC:
+        raise ValueError("not a BOC")
+    flags, offset_size = boc[4], boc[5]
+    size = flags & 7
+    pos = 6
+    cells = int.from_bytes(boc[pos:pos + size], 'big')
+    roots = int.from_bytes(boc[pos + size:pos + 2 * size], 'big')
+    # absent (size byte) + tot_cells_size (offset_size byte)
+    pos += 3 * size + offset_size
+    if roots != 1 or int.from_bytes(boc[pos:pos + size], 'big') != 0:
+        raise ValueError("root is not the first cell")
+    pos += size
+    if flags & 0x80:
+        pos += cells * offset_size   # indice delle celle
+    d1, d2 = boc[pos], boc[pos + 1]
+    if d1 & 0x18:
+        raise ValueError("exotic cell or stored hashes")
+    length = (d2 + 1) // 2
+    data = boc[pos + 2:pos + 2 + length]
+    if not data or len(data) < length:
+        raise ValueError("empty or truncated cell")
+    # d2 dispari: l'ultimo byte è completato da un bit 1 seguito da zeri
+    bits = length * 8 - ((data[-1] & -data[-1]).bit_length() if d2 & 1 else 0)
+    tag = data[0] >> 6
+    if tag == 0:
+        return None   # addr_none
+    if tag != 2 or data[0] & 0x20 or bits < 267:
+        raise ValueError("not addr_std")   # addr_extern/var, anycast o cella troppo corta
+    # 2 bit tag + 1 bit anycast + 8 bit workchain + 256 bit hash
+    bits = int.from_bytes(data[:34], 'big') >> 5
+    workchain = (bits >> 256) & 0xFF
+    if workchain > 127:
+        workchain -= 256
+    return f"{workchain}:{bits & ((1 << 256) - 1):064X}"
+
+def read_address_from_boc(boc: str) -> Optional[str]:
+    """Indirizzo (RAW maiuscolo) da una cella serializzata, BOC hex o base64. None se addr_none."""
+    from tonsdk.boc import Cell
+    boc_hex = boc if boc[:8].lower() == 'b5ee9c72' else base64.b64decode(boc).hex()
+    address = Cell.one_from_boc(boc_hex).begin_parse().read_msg_addr()
+    return normalize_address(address.to_string(False)) if address else None
+
 def parse_address_from_cell(cell_data):
-    """Estrae indirizzo da cella, gestisce dict (v3) e list (pytonlib)"""
+    """Estrae indirizzo da cella, gestisce dict (v3 / TonAPI) e list (pytonlib)"""
     try:
-        # CASO 1: API v3 - {"type": "cell", "cell": "boc_hex"}
+        # CASO 1: API v3 / TonAPI - {"type": "cell", "cell"|"value": "boc"}
         if isinstance(cell_data, dict):
             if cell_data.get('type') == 'cell':
-                cell_boc = cell_data.get('cell', '')
+                cell_boc = cell_data.get('cell') or cell_data.get('value') or ''
                 if cell_boc:
                     try:
-                        from ton.utils import read_address_from_cell
-                        from ton.boc import Cell
-                        cell = Cell.one_from_boc(cell_boc)
-                        address = read_address_from_cell(cell)
-                        if address and address != 'addr_none':
-                            return address
-                    except ImportError:
-                        # Se ton non è installato, restituisci il raw
-                        return f"0:{cell_boc[:64]}"
+                        return read_address_from_boc(cell_boc)
                     except:
                         pass
         
@@ -143,14 +346,7 @@ def parse_address_from_cell(cell_data):
                 cell_b64 = cell_data[1].get('bytes', '')
                 if cell_b64:
                     try:
-                        import base64
-                        from ton.utils import read_address_from_cell
-                        from ton.boc import Cell
-                        cell_bytes = base64.b64decode(cell_b64)
-                        cell = Cell.one_from_boc(cell_bytes)
-                        address = read_address_from_cell(cell)
-                        if address and address != 'addr_none':
-                            return address
+                        return read_address_from_boc(cell_b64)
                     except:
                         pass
         
@@ -158,117 +354,115 @@ def parse_address_from_cell(cell_data):
     except:
         return None
 
+# ============= DECODER SPECIALIZZATI PER FORMATO =============
+# Formati dello stack di get_sale_data:
+#   v2 (TON Center /api/v2, pytonlib): ['num', '0x..']             ['tvm.Cell', {'bytes': base64}]
+#   v3 (TON Center /api/v3):           {'type': 'num', 'value': ..} {'type': 'cell', 'value': base64}
+#   TonAPI:                            {'type': 'num', 'num': ..}   {'type': 'cell', 'cell': hex}
+# Il formato si riconosce una volta per stack; un item fuori formato ripiega sui parser generici.
+
+def _int(value: str) -> int:
+    return int(value, 16) if value[:2] == '0x' else hex_to_int(value)
+
+def _v2_address(item):
+    try:
+        if item[0] == 'tvm.Cell':
+            return decode_boc_address(base64.b64decode(item[1]['bytes']))
+    except Exception:
+        pass
+    return parse_address_from_cell(item)
+
+def _v3_address(item):
+    try:
+        if item['type'] == 'cell' and 'cell' not in item:
+            return decode_boc_address(base64.b64decode(item['value']))
+    except Exception:
+        pass
+    return parse_address_from_cell(item)
+
+def _tonapi_address(item):
+    try:
+        if item['type'] == 'cell':
+            return decode_boc_address(bytes.fromhex(item['cell']))
+    except Exception:
+        pass
+    return parse_address_from_cell(item)
+
+# formato -> (valore grezzo, intero, indirizzo)
+STACK_READERS = {
+    'v2': (lambda item: item[1], lambda item: _int(item[1]), _v2_address),
+    'v3': (lambda item: item['value'], lambda item: _int(item['value']), _v3_address),
+    'tonapi': (lambda item: item['num'], lambda item: _int(item['num']), _tonapi_address),
+}
+GENERIC_READERS = (lambda item: get_stack_value(item, ''), hex_to_int, parse_address_from_cell)
+
+def detect_stack_format(stack: list) -> Optional[str]:
+    """'v2', 'v3' o 'tonapi' dal primo item dello stack (None se non riconosciuto)"""
+    first = stack[0]
+    if isinstance(first, list):
+        return 'v2'
+    if isinstance(first, dict):
+        if 'value' in first:
+            return 'v3'
+        if 'num' in first:
+            return 'tonapi'
+    return None
+
 # ============= PARSING STACK VENDITA =============
 
-def parse_sale_stack(stack: list) -> Optional[tuple]:
+def parse_sale_stack(stack: list) -> Optional[Sale]:
     """
-    Parse sale stack - Supporta API v3 (dict) e pytonlib (list)
+    Parse sale stack - Supporta API v2 (list), v3 (dict) e TonAPI (dict).
+    Ritorna un record tipizzato (FixPriceSale, AuctionSale, OfferSale) o None.
     """
+    if not stack or len(stack) < 7:
+        return None
+    
+    readers = STACK_READERS.get(detect_stack_format(stack))
+    if readers:
+        try:
+            return _parse_sale(stack, *readers)
+        except Exception:
+            pass  # item con forma inattesa: percorso generico
+    
     try:
-        if not stack or len(stack) < 7:
-            print(f"[parse_sale_stack] Stack too small: {len(stack) if stack else 0}")
-            return None
-        
-        # DEBUG: mostra struttura stack
-        print(f"[parse_sale_stack] Stack size: {len(stack)}")
-        for i, item in enumerate(stack[:3]):
-            if isinstance(item, dict):
-                print(f"  [{i}] dict keys: {list(item.keys())}")
-            elif isinstance(item, list):
-                print(f"  [{i}] list len: {len(item)}")
-            else:
-                print(f"  [{i}] type: {type(item)}")
-        
-        # Determina tipo vendita dal primo elemento
-        sale_type_value = get_stack_value(stack[0], '')
-        sale_type = str(sale_type_value).upper()
-        
-        if 'AUC' in sale_type or '415543' in sale_type:
-            return parse_auction_stack(stack)
-        elif 'OFFER' in sale_type or '4f46464552' in sale_type:
-            return parse_offer_stack(stack)
-        else:
-            return parse_fixprice_stack(stack)
-            
+        return _parse_sale(stack, *GENERIC_READERS)
     except Exception as e:
         print(f'[parse_sale_stack] Error: {e}')
-        import traceback
-        traceback.print_exc()
         return None
 
-def parse_fixprice_stack(stack: list) -> Optional[tuple]:
+def sale_type_of(value) -> type:
+    """Tipo di vendita dal primo item dello stack (magic 'AUC' / 'OFFER', altrimenti fix price)"""
+    sale_type = str(value).upper()
+    if 'AUC' in sale_type or '415543' in sale_type:
+        return AuctionSale
+    if 'OFFER' in sale_type or '4F46464552' in sale_type:
+        return OfferSale
+    return FixPriceSale
+
+def _parse_sale(stack: list, raw, num, address) -> Optional[Sale]:
+    return sale_type_of(raw(stack[0])).from_stack(stack, num, address)
+
+def parse_fixprice_stack(stack: list) -> Optional[Sale]:
     """Parse fixprice sale stack - Supporta dict e list"""
     try:
-        if len(stack) < 7:
-            return None
-        
-        action = 'SaleFixPrice'
-        
-        # Estrai valori gestendo dict/list
-        is_complete = bool(hex_to_int(stack[1]))
-        created_at = hex_to_int(stack[2])
-        marketplace_address = parse_address_from_cell(stack[3])
-        nft_address = parse_address_from_cell(stack[4])
-        nft_owner_address = parse_address_from_cell(stack[5]) if len(stack) > 5 else None
-        full_price = hex_to_int(stack[6]) / 1_000_000_000
-        
-        return (action, is_complete, created_at, marketplace_address,
-                nft_address, nft_owner_address, full_price)
-        
+        return FixPriceSale.from_stack(stack, *GENERIC_READERS[1:])
     except Exception as e:
         print(f'[parse_fixprice_stack] Error: {e}')
         return None
 
-def parse_auction_stack(stack: list) -> Optional[tuple]:
+def parse_auction_stack(stack: list) -> Optional[Sale]:
     """Parse auction sale stack - Supporta dict e list"""
     try:
-        if len(stack) < 20:
-            return None
-        
-        action = 'SaleAuction'
-        
-        # Estrai valori
-        is_end = bool(hex_to_int(stack[1]))
-        end_time = hex_to_int(stack[2])
-        marketplace_address = parse_address_from_cell(stack[3])
-        nft_address = parse_address_from_cell(stack[4])
-        nft_owner_address = parse_address_from_cell(stack[5])
-        last_bid = hex_to_int(stack[6]) / 1_000_000_000
-        last_member = parse_address_from_cell(stack[7])
-        min_step = hex_to_int(stack[8]) / 1_000_000_000
-        max_bid = hex_to_int(stack[15]) / 1_000_000_000
-        min_bid = hex_to_int(stack[16]) / 1_000_000_000
-        created_at = hex_to_int(stack[17])
-        last_bid_at = hex_to_int(stack[18])
-        is_canceled = bool(hex_to_int(stack[19]))
-        
-        return (action, is_end, created_at, marketplace_address, nft_address,
-                nft_owner_address, min_bid, max_bid, min_step, last_bid_at,
-                last_member, last_bid, is_canceled, end_time)
-        
+        return AuctionSale.from_stack(stack, *GENERIC_READERS[1:])
     except Exception as e:
         print(f'[parse_auction_stack] Error: {e}')
         return None
 
-def parse_offer_stack(stack: list) -> Optional[tuple]:
+def parse_offer_stack(stack: list) -> Optional[Sale]:
     """Parse offer sale stack - Supporta dict e list"""
     try:
-        if len(stack) < 8:
-            return None
-        
-        action = 'SaleOffer'
-        
-        # Estrai valori
-        is_complete = bool(hex_to_int(stack[1]))
-        created_at = hex_to_int(stack[2])
-        marketplace_address = parse_address_from_cell(stack[4])
-        nft_address = parse_address_from_cell(stack[5])
-        offer_owner_address = parse_address_from_cell(stack[6])
-        full_price = hex_to_int(stack[7]) / 1_000_000_000
-        
-        return (action, is_complete, created_at, marketplace_address,
-                nft_address, offer_owner_address, full_price)
-        
+        return OfferSale.from_stack(stack, *GENERIC_READERS[1:])
     except Exception as e:
         print(f'[parse_offer_stack] Error: {e}')
         return None
@@ -292,16 +486,16 @@ async def get_nft_from_sale_contract(sale_address: str) -> Optional[str]:
             "Content-Type": "application/json"
         }
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    transfers = data.get('nft_transfers', [])
-                    if transfers:
-                        nft_address = transfers[0].get('nft_address')
-                        if nft_address:
-                            print(f"[get_nft] ✅ Trovato via nft/transfers: {nft_address[-12:]}")
-                            return nft_address
+        session = get_session()
+        async with session.get(url, headers=headers, params=params) as response:
+            if response.status == 200:
+                data = await response.json()
+                transfers = data.get('nft_transfers', [])
+                if transfers:
+                    nft_address = transfers[0].get('nft_address')
+                    if nft_address:
+                        print(f"[get_nft] ✅ Trovato via nft/transfers: {nft_address[-12:]}")
+                        return nft_address
     except Exception as e:
         print(f"[get_nft] Error: {e}")
     
@@ -352,18 +546,18 @@ async def get_nft_from_transaction_hash(tx_hash_hex: str) -> Optional[str]:
             "limit": 10
         }
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=TONCENTER_HEADERS, params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    actions = data.get('actions', [])
-                    
-                    for action in actions:
-                        if action.get('type') == 'nft_transfer':
-                            nft_address = action.get('details', {}).get('nft_address')
-                            if nft_address:
-                                print(f"[get_nft] ✅ NFT found via transaction hash: {nft_address[-12:]}")
-                                return nft_address
+        session = get_session()
+        async with session.get(url, headers=TONCENTER_HEADERS, params=params) as response:
+            if response.status == 200:
+                data = await response.json()
+                actions = data.get('actions', [])
+                
+                for action in actions:
+                    if action.get('type') == 'nft_transfer':
+                        nft_address = action.get('details', {}).get('nft_address')
+                        if nft_address:
+                            print(f"[get_nft] ✅ NFT found via transaction hash: {nft_address[-12:]}")
+                            return nft_address
         return None
     except Exception as e:
         print(f"[get_nft] ❌ Error: {e}")
@@ -489,27 +683,27 @@ async def get_nft_from_sale_contract_v2(sale_address: str) -> Optional[str]:
             "limit": 10
         }
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    txs = data.get('transactions', [])
-                    
-                    # Cerca l'NFT transfer nella history del contratto
-                    for tx in txs:
-                        out_msgs = tx.get('out_msgs', [])
-                        for msg in out_msgs:
-                            # Cerca opcode nft_transfer (0x5fcc3d14)
-                            if msg.get('opcode') == '0x5fcc3d14':
-                                # In v2, l'NFT address è nel destination o nel commento
-                                nft_address = msg.get('destination')
-                                if nft_address:
-                                    # Converti in formato RAW se necessario
-                                    if nft_address.startswith('EQ') or nft_address.startswith('UQ'):
-                                        from ton.utils import to_raw
-                                        nft_address = to_raw(nft_address)
-                                    print(f"[get_nft_v2] ✅ NFT found: {nft_address[-12:]}")
-                                    return nft_address
+        session = get_session()
+        async with session.get(url, headers=headers, params=params) as response:
+            if response.status == 200:
+                data = await response.json()
+                txs = data.get('transactions', [])
+                
+                # Cerca l'NFT transfer nella history del contratto
+                for tx in txs:
+                    out_msgs = tx.get('out_msgs', [])
+                    for msg in out_msgs:
+                        # Cerca opcode nft_transfer (0x5fcc3d14)
+                        if msg.get('opcode') == '0x5fcc3d14':
+                            # In v2, l'NFT address è nel destination o nel commento
+                            nft_address = msg.get('destination')
+                            if nft_address:
+                                # Converti in formato RAW se necessario
+                                if nft_address.startswith('EQ') or nft_address.startswith('UQ'):
+                                    from ton.utils import to_raw
+                                    nft_address = to_raw(nft_address)
+                                print(f"[get_nft_v2] ✅ NFT found: {nft_address[-12:]}")
+                                return nft_address
         return None
     except Exception as e:
         print(f"[get_nft_v2] ❌ Error: {e}")
@@ -554,64 +748,64 @@ async def get_nft_from_trace_via_tonapi(trace_id: str) -> Optional[str]:
     print(f"[TonAPI] 🔍 Cerco trace: {trace_id[:30]}...")
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                if response.status == 429:
-                    print("[TonAPI] ❌ Rate limit. Aspetto...")
-                    await asyncio.sleep(2)
-                    return await get_nft_from_trace_via_tonapi(trace_id)
-                
-                if response.status != 200:
-                    print(f"[TonAPI] ❌ Errore {response.status}")
-                    error_text = await response.text()
-                    print(f"[TonAPI] 📄 Risposta errore: {error_text[:500]}")
-                    return None
+        session = get_session()
+        async with session.get(url, headers=headers) as response:
+            if response.status == 429:
+                print("[TonAPI] ❌ Rate limit. Aspetto...")
+                await asyncio.sleep(2)
+                return await get_nft_from_trace_via_tonapi(trace_id)
+            
+            if response.status != 200:
+                print(f"[TonAPI] ❌ Errore {response.status}")
+                error_text = await response.text()
+                print(f"[TonAPI] 📄 Risposta errore: {error_text[:500]}")
+                return None
 
-                data = await response.json()
-                
-                # 🔥 DEBUG: STRUTTURA COMPLETA DELLA RISPOSTA
-                print(f"[TonAPI] 📊 STRUTTURA RISPOSTA:")
-                print(f"[TonAPI]   Chiavi principali: {list(data.keys())}")
-                
-                # Se c'è 'actions' al primo livello
-                if 'actions' in data:
-                    print(f"[TonAPI]   Numero azioni top-level: {len(data['actions'])}")
-                    for i, action in enumerate(data['actions'][:3]):  # Prime 3
-                        print(f"[TonAPI]   Azione {i}: type={action.get('type')}, keys={list(action.keys())}")
+            data = await response.json()
+            
+            # 🔥 DEBUG: STRUTTURA COMPLETA DELLA RISPOSTA
+            print(f"[TonAPI] 📊 STRUTTURA RISPOSTA:")
+            print(f"[TonAPI]   Chiavi principali: {list(data.keys())}")
+            
+            # Se c'è 'actions' al primo livello
+            if 'actions' in data:
+                print(f"[TonAPI]   Numero azioni top-level: {len(data['actions'])}")
+                for i, action in enumerate(data['actions'][:3]):  # Prime 3
+                    print(f"[TonAPI]   Azione {i}: type={action.get('type')}, keys={list(action.keys())}")
+            
+            # Se ci sono 'children'
+            if 'children' in data:
+                print(f"[TonAPI]   Numero children: {len(data['children'])}")
+            
+            def find_nft_transfer_action(node):
+                """
+                Cerca ricorsivamente NFT transfer in un nodo e nei suoi children
+                """
+                # 1. CERCA NEL NODO CORRENTE!
+                if node.get('type') in ['NftTransfer', 'nft_transfer']:
+                    nft_addr = (node.get('nft_transfer', {}).get('nft_address') or 
+                               node.get('NFTTransfer', {}).get('nft_address') or
+                               node.get('details', {}).get('nft_address'))
+                    if nft_addr:
+                        return nft_addr
                 
-                # Se ci sono 'children'
-                if 'children' in data:
-                    print(f"[TonAPI]   Numero children: {len(data['children'])}")
+                # 2. CERCA NEI CHILDREN DEL NODO CORRENTE
+                for child in node.get('children', []):
+                    result = find_nft_transfer_action(child)
+                    if result:
+                        return result
                 
-                def find_nft_transfer_action(node):
-                    """
-                    Cerca ricorsivamente NFT transfer in un nodo e nei suoi children
-                    """
-                    # 1. CERCA NEL NODO CORRENTE!
-                    if node.get('type') in ['NftTransfer', 'nft_transfer']:
-                        nft_addr = (node.get('nft_transfer', {}).get('nft_address') or 
-                                   node.get('NFTTransfer', {}).get('nft_address') or
-                                   node.get('details', {}).get('nft_address'))
-                        if nft_addr:
-                            return nft_addr
-                    
-                    # 2. CERCA NEI CHILDREN DEL NODO CORRENTE
-                    for child in node.get('children', []):
-                        result = find_nft_transfer_action(child)
-                        if result:
-                            return result
-                    
-                    return None
+                return None
 
-                nft_address = find_nft_transfer_action(data)
-                
-                if nft_address:
-                    print(f"[TonAPI] ✅ NFT trovato: {nft_address[-12:]}")
-                else:
-                    print(f"[TonAPI] ⚠️ NESSUN NFT TRANSFER TROVATO")
-                    print(f"[TonAPI] 💡 Suggerimento: Prova a cercare manualmente su https://tonviewer.com/trace/{trace_id}")
-                
-                return nft_address
+            nft_address = find_nft_transfer_action(data)
+            
+            if nft_address:
+                print(f"[TonAPI] ✅ NFT trovato: {nft_address[-12:]}")
+            else:
+                print(f"[TonAPI] ⚠️ NESSUN NFT TRANSFER TROVATO")
+                print(f"[TonAPI] 💡 Suggerimento: Prova a cercare manualmente su https://tonviewer.com/trace/{trace_id}")
+            
+            return nft_address
 
     except Exception as e:
         print(f"[TonAPI] ❌ Errore: {e}")
@@ -631,30 +825,30 @@ async def get_nft_from_transaction_actions(tx_hash_b64: str) -> Optional[str]:
             "limit": 20  # Per prendere tutte le azioni
         }
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=TONCENTER_HEADERS, params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    actions = data.get('actions', [])
-                    
-                    print(f"[get_nft] 🔍 Trovate {len(actions)} azioni in questa transazione")
-                    
-                    for i, action in enumerate(actions):
-                        action_type = action.get('type', '')
-                        print(f"[get_nft]   Azione {i}: {action_type}")
-                        
-                        # Cerca NFT transfer in QUALSIASI azione
-                        if action_type in ['nft_transfer', 'NFTTransfer', 'NftItemTransfer']:
-                            # I dettagli possono essere in posti diversi
-                            details = action.get('details', {})
-                            nft_addr = details.get('nft_address') or details.get('nft')
-                            if nft_addr:
-                                print(f"[get_nft] ✅ NFT trovato nell'azione {i}!")
-                                return nft_addr
+        session = get_session()
+        async with session.get(url, headers=TONCENTER_HEADERS, params=params) as response:
+            if response.status == 200:
+                data = await response.json()
+                actions = data.get('actions', [])
+                
+                print(f"[get_nft] 🔍 Trovate {len(actions)} azioni in questa transazione")
+                
+                for i, action in enumerate(actions):
+                    action_type = action.get('type', '')
+                    print(f"[get_nft]   Azione {i}: {action_type}")
                     
-                    print(f"[get_nft] ⚠️ Nessuna azione NFT in questa transazione")
-                else:
-                    print(f"[get_nft] ❌ Actions API error: {response.status}")
+                    # Cerca NFT transfer in QUALSIASI azione
+                    if action_type in ['nft_transfer', 'NFTTransfer', 'NftItemTransfer']:
+                        # I dettagli possono essere in posti diversi
+                        details = action.get('details', {})
+                        nft_addr = details.get('nft_address') or details.get('nft')
+                        if nft_addr:
+                            print(f"[get_nft] ✅ NFT trovato nell'azione {i}!")
+                            return nft_addr
+                
+                print(f"[get_nft] ⚠️ Nessuna azione NFT in questa transazione")
+            else:
+                print(f"[get_nft] ❌ Actions API error: {response.status}")
         
         return None
     except Exception as e:
@@ -662,7 +856,11 @@ async def get_nft_from_transaction_actions(tx_hash_b64: str) -> Optional[str]:
         return None
 
 async def get_sale_data_v2(address: str) -> Optional[list]:
-    """Chiama get_sale_data usando API v2 (dati SEMPRE presenti!)"""
+    """
+    Chiama get_sale_data usando API v2 (dati SEMPRE presenti!).
+    Ritorna lo stack, [] se il contratto ha risposto ma non è una vendita, None se la richiesta
+    è fallita (429, 5xx, rete): in quel caso la transazione va ritentata, non scartata.
+    """
     try:
         # Endpoint v2
         url = "https://toncenter.com/api/v2/runGetMethod"
@@ -676,14 +874,17 @@ async def get_sale_data_v2(address: str) -> Optional[list]:
         if toncenter_api_key:
             headers["X-API-Key"] = toncenter_api_key
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=payload) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    if data.get('success') and data.get('exit_code') == 0:
-                        stack = data.get('stack', [])
-                        print(f"[get_sale_data_v2] ✅ Stack size: {len(stack)}")
-                        return stack
+        session = get_session()
+        async with session.post(url, headers=headers, json=payload) as resp:
+            if resp.status == 200:
+                data = await resp.json()
+                if data.get('success') and data.get('exit_code') == 0:
+                    stack = data.get('stack', [])
+                    print(f"[get_sale_data_v2] ✅ Stack size: {len(stack)}")
+                    return stack
+                # Get-method eseguito con exit code != 0: non è un contratto di vendita
+                return []
+            print(f"[get_sale_data_v2] ⚠️ HTTP {resp.status}")
         return None
     except Exception as e:
         print(f"[get_sale_data_v2] ❌ Error: {e}")
@@ -691,7 +892,8 @@ async def get_sale_data_v2(address: str) -> Optional[list]:
 
 async def get_sale_data_via_tonapi(address: str) -> Optional[list]:
     """
-    Recupera i dati di vendita usando TonAPI (fallback quando v2 fallisce)
+    Recupera i dati di vendita usando TonAPI (fallback quando v2 fallisce).
+    Come get_sale_data_v2: [] se non è una vendita, None se la richiesta è fallita.
     """
     try:
         from secretData import tonapi_token
@@ -705,17 +907,17 @@ async def get_sale_data_via_tonapi(address: str) -> Optional[list]:
         # TonAPI endpoint per get method
         url = f"{TONAPI_BASE_URL}/v2/blockchain/accounts/{address}/methods/get_sale_data"
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    stack = data.get('stack', [])
-                    if stack:
-                        print(f"[TonAPI] ✅ get_sale_data success! Stack size: {len(stack)}")
-                        return stack
-                else:
-                    print(f"[TonAPI] ❌ Error {response.status}")
-                    return None
+        session = get_session()
+        async with session.get(url, headers=headers) as response:
+            if response.status == 200:
+                data = await response.json()
+                stack = data.get('stack', [])
+                if stack:
+                    print(f"[TonAPI] ✅ get_sale_data success! Stack size: {len(stack)}")
+                return stack
+            print(f"[TonAPI] ❌ Error {response.status}")
+            # 4xx: account o metodo non validi (non è una vendita); 429 e 5xx: da ritentare
+            return [] if 400 <= response.status < 500 and response.status != 429 else None
     except Exception as e:
         print(f"[TonAPI] ❌ Error: {e}")
         return None
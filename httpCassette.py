@@ -0,0 +1,230 @@
+# httpCassette.py - Registrazione e replay del traffico HTTP verso i provider (TON Center, TonAPI, Getgems, ...)
+#
+#   HTTP_CASSETTE_MODE=record  python main.py        -> cattura richieste/risposte in HTTP_CASSETTE
+#   HTTP_CASSETTE_MODE=replay  python main.py        -> le stesse risposte, senza rete
+#   HTTP_CASSETTE_LATENCY=1                          -> in replay attende la latenza registrata (0.5 = metà, ...)
+#
+# Il file è JSON lines compresso con gzip, una riga per scambio. Le chiavi API e il token del bot
+# vengono rimossi da URL e body prima di salvare, gli header non vengono salvati.
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import os
+import time
+from collections import defaultdict
+from typing import Optional
+from urllib.parse import urlencode, urlsplit, urlunsplit, parse_qsl
+
+import aiohttp
+
+import metrics
+from secretData import bot_token, toncenter_api_key, tonapi_token, cmc_token
+
+# Traffico che non passa dalla cassetta (comandi Telegram, self-ping)
+PASSTHROUGH_HOSTS = ('api.telegram.org', 'localhost', '127.0.0.1')
+SECRETS = [secret for secret in (bot_token, toncenter_api_key, tonapi_token, cmc_token) if secret]
+
+
+def redact(text: str) -> str:
+    for secret in SECRETS:
+        text = text.replace(secret, '<secret>')
+    return text
+
+
+def request_key(method: str, url: str, params=None, json_body=None, data=None) -> str:
+    """Chiave stabile di una richiesta: metodo + URL con query ordinata + hash del body (senza segreti)"""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if params:
+        items = params.items() if isinstance(params, dict) else params
+        query += [(str(k), json.dumps(v) if isinstance(v, (list, dict)) else str(v)) for k, v in items]
+    normalized = urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(sorted(query)), ''))
+
+    body = ''
+    if json_body is not None:
+        body = json.dumps(json_body, sort_keys=True)
+    elif data is not None:
+        body = data.decode(errors='replace') if isinstance(data, bytes) else str(data)
+    body_hash = hashlib.sha1(redact(body).encode()).hexdigest()[:16] if body else ''
+    return f"{method.upper()} {redact(normalized)} {body_hash}".rstrip()
+
+
+class CassetteResponse:
+    """Risposta servita dalla cassetta: stessa interfaccia usata nel repo (status, read, text, json)"""
+
+    def __init__(self, status: int, headers: dict, body: bytes, url: str):
+        self.status = status
+        self.headers = headers
+        self.url = url
+        self._body = body
+
+    @property
+    def content_type(self) -> str:
+        return self.headers.get('Content-Type', '').split(';')[0]
+
+    async def read(self) -> bytes:
+        return self._body
+
+    async def text(self, encoding: Optional[str] = None, errors: str = 'strict') -> str:
+        return self._body.decode(encoding or 'utf-8', errors)
+
+    async def json(self, content_type: Optional[str] = 'application/json', loads=json.loads, **kwargs):
+        text = self._body.decode('utf-8').strip()
+        return loads(text) if text else None
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise aiohttp.ClientResponseError(None, (), status=self.status, message=f"HTTP {self.status}")
+
+    def release(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class CassetteRequest:
+    """Come aiohttp: `async with session.get(...) as response` oppure `response = await session.get(...)`"""
+
+    def __init__(self, coro):
+        self._coro = coro
+        self._response = None
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    async def __aenter__(self):
+        self._response = await self._coro
+        return await self._response.__aenter__()
+
+    async def __aexit__(self, *exc):
+        return await self._response.__aexit__(*exc)
+
+
+class Cassette:
+    """
+    Sta davanti alla sessione condivisa di httpPool. In record esegue la richiesta vera e ne salva
+    l'esito (anche timeout ed errori di rete); in replay serve gli scambi registrati per chiave,
+    nell'ordine in cui sono stati catturati (l'ultimo viene ripetuto se le richieste sono di più).
+    """
+
+    def __init__(self, mode: str, path: str, latency: float = 0.0):
+        self.mode = mode
+        self.path = path
+        self.latency = latency
+        self.session: Optional[aiohttp.ClientSession] = None   # sessione reale (record / passthrough)
+        self._entries = defaultdict(list)
+        self._served = defaultdict(int)
+        self._file = None
+        if mode == 'replay':
+            self._load()
+
+    # --- file ---
+
+    def _load(self):
+        count = 0
+        try:
+            with gzip.open(self.path, 'rt') as f:
+                try:
+                    for line in f:
+                        if line.strip():
+                            entry = json.loads(line)
+                            self._entries[entry['key']].append(entry)
+                            count += 1
+                except EOFError:
+                    # Registrazione interrotta: le righe complete restano valide
+                    pass
+        except FileNotFoundError:
+            print(f"[cassette] ⚠️ {self.path} not found, every request will miss", flush=True)
+        print(f"[cassette] ▶️ Replay: {count} exchanges ({len(self._entries)} distinct requests)", flush=True)
+
+    def _append(self, entry: dict):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._file = gzip.open(self.path, 'at')
+            print(f"[cassette] ⏺️ Recording to {self.path}", flush=True)
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()   # sync flush: il file resta leggibile anche dopo un crash
+
+    # --- interfaccia della sessione ---
+
+    @property
+    def closed(self) -> bool:
+        return self.session is None or self.session.closed
+
+    def get(self, url, **kwargs) -> CassetteRequest:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs) -> CassetteRequest:
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method: str, url, **kwargs):
+        url = str(url)
+        if urlsplit(url).hostname in PASSTHROUGH_HOSTS:
+            return self.session.request(method, url, **kwargs)
+        key = request_key(method, url, kwargs.get('params'), kwargs.get('json'), kwargs.get('data'))
+        if self.mode == 'record':
+            return CassetteRequest(self._record(key, method, url, kwargs))
+        return CassetteRequest(self._replay(key, url))
+
+    async def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # --- record / replay ---
+
+    async def _record(self, key: str, method: str, url: str, kwargs: dict) -> CassetteResponse:
+        started = time.monotonic()
+        entry = {'key': key, 'method': method, 'url': redact(url)}
+        try:
+            async with self.session.request(method, url, **kwargs) as response:
+                body = await response.read()
+                status = response.status
+                headers = {'Content-Type': response.headers.get('Content-Type', '')}
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            entry.update(error=type(e).__name__, message=str(e)[:200],
+                         elapsed=round(time.monotonic() - started, 4))
+            self._append(entry)
+            metrics.inc('cassette.recorded')
+            raise
+
+        try:
+            entry['body'] = redact(body.decode('utf-8'))
+        except UnicodeDecodeError:
+            entry['body_b64'] = base64.b64encode(body).decode()
+        entry.update(status=status, headers=headers, elapsed=round(time.monotonic() - started, 4))
+        self._append(entry)
+        metrics.inc('cassette.recorded')
+        return CassetteResponse(status, headers, body, url)
+
+    async def _replay(self, key: str, url: str) -> CassetteResponse:
+        entries = self._entries.get(key)
+        if not entries:
+            metrics.inc('cassette.miss')
+            print(f"[cassette] ❌ Miss: {key[:160]}", flush=True)
+            raise aiohttp.ClientConnectionError(f"cassette miss: {key[:160]}")
+
+        index = self._served[key]
+        self._served[key] = index + 1
+        entry = entries[min(index, len(entries) - 1)]
+        metrics.inc('cassette.hit')
+
+        if self.latency > 0:
+            await asyncio.sleep(entry.get('elapsed', 0) * self.latency)
+
+        if 'error' in entry:
+            if entry['error'] == 'TimeoutError':
+                raise asyncio.TimeoutError()
+            raise aiohttp.ClientConnectionError(entry.get('message', entry['error']))
+
+        if 'body_b64' in entry:
+            body = base64.b64decode(entry['body_b64'])
+        else:
+            body = entry.get('body', '').encode()
+        return CassetteResponse(entry['status'], entry.get('headers', {}), body, url)
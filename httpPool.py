@@ -0,0 +1,64 @@
+# httpPool.py - Shared aiohttp session (one connection pool for the whole bot)
+import asyncio
+from typing import Optional
+
+import aiohttp
+
+from config import HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST, HTTP_DEFAULT_TIMEOUT
+from config import HTTP_CASSETTE_MODE, HTTP_CASSETTE_PATH, HTTP_CASSETTE_LATENCY
+
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=HTTP_DEFAULT_TIMEOUT)
+
+_session: Optional[aiohttp.ClientSession] = None
+_session_loop: Optional[asyncio.AbstractEventLoop] = None
+_cassette = None   # httpCassette.Cassette se HTTP_CASSETTE_MODE è record/replay
+_override = None   # sessione installata con use_session (provider finti)
+
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Ritorna la sessione condivisa, creandola al primo uso.
+    Va chiamata dentro una coroutine: la sessione è legata al loop corrente,
+    se il loop cambia (es. asyncio.run diversi) ne viene creata una nuova.
+    Con HTTP_CASSETTE_MODE=record/replay ritorna la cassetta, che ha la stessa interfaccia.
+    """
+    global _session, _session_loop, _cassette
+    if _override is not None:
+        return _override
+    loop = asyncio.get_running_loop()
+
+    if _session is None or _session.closed or _session_loop is not loop:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=300
+        )
+        _session = aiohttp.ClientSession(connector=connector, timeout=DEFAULT_TIMEOUT)
+        _session_loop = loop
+        print(f"[httpPool] ✅ Shared session created (limit={HTTP_POOL_LIMIT})", flush=True)
+
+    if HTTP_CASSETTE_MODE in ('record', 'replay'):
+        if _cassette is None:
+            from httpCassette import Cassette
+            _cassette = Cassette(HTTP_CASSETTE_MODE, HTTP_CASSETTE_PATH, HTTP_CASSETTE_LATENCY)
+        _cassette.session = _session
+        return _cassette
+
+    return _session
+
+
+def use_session(session):
+    """Sostituisce la sessione condivisa (benchmark e test con provider finti); None = torna al pool"""
+    global _override
+    _override = session
+
+
+async def close_session():
+    """Chiude la sessione condivisa (shutdown)"""
+    global _session, _session_loop
+    if _cassette is not None:
+        await _cassette.close()
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+    _session_loop = None
@@ -0,0 +1,198 @@
+# leaderLease.py - Active/standby: leader election con un lease rinnovato su un file SQLite condiviso
+#
+#   HA_ENABLED=1 python web_server.py    (su due nodi/processi con lo stesso DATA_DIR)
+#   python leaderLease.py                -> chi tiene il lease adesso
+#
+# Il lease è una riga (holder, scadenza, token) aggiornata con un solo statement atomico: lo prende
+# chi lo trova scaduto, lo rinnova solo chi lo tiene già. L'active lo rinnova ogni HA_RENEW_INTERVAL,
+# lo standby ritenta con la stessa cadenza e subentra entro HA_LEASE_TTL + HA_RENEW_INTERVAL dalla
+# morte dell'active, ripartendo dai checkpoint lastUtime e dall'alert ledger. Il token aumenta a ogni
+# cambio di holder e identifica il mandato (log, /metrics), ma non protegge le scritture: un active
+# bloccato (GC, disco lento) oltre il TTL può completare un invio che aveva già passato is_leader(),
+# con lo stesso effetto di un crash a metà invio (al più un messaggio doppio). Le scadenze sono in
+# tempo di sistema: tra nodi diversi servono orologi sincronizzati (NTP) e un TTL molto più grande
+# dello scarto.
+import asyncio
+import atexit
+import os
+import socket
+import sqlite3
+import time
+from typing import Optional
+
+import metrics
+from config import HA_LEASE_DB, HA_NODE_ID, HA_LEASE_TTL, HA_RENEW_INTERVAL
+
+LEASE_NAME = 'ton-nft-sold-alerts'
+LEASE_LOST_EXIT_CODE = 75   # il processo esce: Render / systemd lo riavvia come standby
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    token INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    renewed_at REAL NOT NULL
+);
+"""
+
+# Inserisce o rinnova: l'UPDATE scatta solo se il lease è nostro o è scaduto
+ACQUIRE = """
+INSERT INTO leases (name, holder, token, expires_at, renewed_at) VALUES (?, ?, 1, ?, ?)
+ON CONFLICT (name) DO UPDATE SET
+    token = CASE WHEN leases.holder = excluded.holder THEN leases.token ELSE leases.token + 1 END,
+    holder = excluded.holder,
+    expires_at = excluded.expires_at,
+    renewed_at = excluded.renewed_at
+WHERE leases.holder = excluded.holder OR leases.expires_at < excluded.renewed_at
+"""
+
+
+class LeaderLease:
+    """Lease di leadership: acquire/renew/release su SQLite, stato locale con scadenza monotonic"""
+
+    def __init__(self, db_path: str = HA_LEASE_DB, node_id: str = None,
+                 ttl: float = HA_LEASE_TTL, renew_interval: float = HA_RENEW_INTERVAL, name: str = LEASE_NAME):
+        self.db_path = db_path
+        self.node_id = node_id or HA_NODE_ID or f"{socket.gethostname()}-{os.getpid()}"
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.name = name
+        self.token: Optional[int] = None
+        self._deadline = 0.0      # time.monotonic() oltre il quale non siamo più sicuri di essere leader
+        self._leader: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.on_lost = self._exit
+        self._lost_handlers = []   # chiamati prima di uscire (es. stop dei worker shard)
+
+    def _db(self) -> sqlite3.Connection:
+        # Journal classico (niente WAL): il file può stare su un disco condiviso tra macchine
+        conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+        conn.executescript(SCHEMA)
+        return conn
+
+    # --- operazioni sul lease ---
+
+    def try_acquire(self) -> bool:
+        """Prende o rinnova il lease; True se adesso è nostro"""
+        started = time.monotonic()
+        now = time.time()
+        conn = self._db()
+        try:
+            updated = conn.execute(ACQUIRE, (self.name, self.node_id, now + self.ttl, now)).rowcount
+            if not updated:
+                return False
+            self.token = conn.execute("SELECT token FROM leases WHERE name = ?", (self.name,)).fetchone()[0]
+        finally:
+            conn.close()
+        # La scadenza locale parte da prima della scrittura: non sopravvaluta mai il lease
+        self._deadline = started + self.ttl
+        return True
+
+    def release(self):
+        """Cede il lease (uscita pulita): lo standby subentra al tentativo successivo"""
+        if self.token is None:
+            return
+        try:
+            conn = self._db()
+            try:
+                conn.execute("UPDATE leases SET expires_at = 0 WHERE name = ? AND holder = ?",
+                             (self.name, self.node_id))
+            finally:
+                conn.close()
+            print(f"[lease] ⏹️ Lease released by {self.node_id}", flush=True)
+        except Exception as e:
+            print(f"[lease] ⚠️ Release failed: {e}", flush=True)
+        self.token = None
+        self._deadline = 0.0
+
+    def current(self) -> Optional[dict]:
+        conn = self._db()
+        try:
+            row = conn.execute("SELECT holder, token, expires_at, renewed_at FROM leases WHERE name = ?",
+                               (self.name,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return {'holder': row[0], 'token': row[1], 'expires_at': row[2], 'renewed_at': row[3],
+                'valid': row[2] > time.time()}
+
+    def is_leader(self) -> bool:
+        """Controllo locale (nessun accesso al file): usato prima di ogni invio"""
+        return self.token is not None and time.monotonic() < self._deadline
+
+    def add_lost_handler(self, handler):
+        """handler() viene chiamato quando il lease è perso, prima che il processo esca"""
+        self._lost_handlers.append(handler)
+
+    # --- ciclo di vita ---
+
+    async def acquire(self):
+        """Attende la leadership (lo standby resta qui); idempotente, avvia il rinnovo in background"""
+        if self._task is None or self._task.done():
+            self._leader = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self.run())
+        await self._leader.wait()
+
+    async def run(self):
+        standby_logged = False
+        while True:
+            try:
+                held = await asyncio.to_thread(self.try_acquire)
+            except Exception as e:
+                print(f"[lease] ❌ Lease store error: {e}", flush=True)
+                metrics.inc('ha.lease_errors')
+                held = False
+
+            if held and not self._leader.is_set():
+                self._leader.set()
+                atexit.register(self.release)
+                metrics.inc('ha.takeovers')
+                print(f"[lease] ✅ {self.node_id} is now ACTIVE (token {self.token})", flush=True)
+            elif not held and self._leader.is_set():
+                if self.is_leader():
+                    print(f"[lease] ⚠️ Renew failed, lease valid for "
+                          f"{self._deadline - time.monotonic():.1f}s more", flush=True)
+                else:
+                    # Rinnovo non riuscito entro il TTL: un altro nodo può già essere active
+                    metrics.inc('ha.lease_lost')
+                    print(f"[lease] ❌ {self.node_id} lost the lease (token {self.token})", flush=True)
+                    self.token = None
+                    self.on_lost()
+                    return
+            elif not held and not standby_logged:
+                standby_logged = True
+                holder = await asyncio.to_thread(self.current)
+                print(f"[lease] ⏸️ {self.node_id} is STANDBY (active: "
+                      f"{holder['holder'] if holder else 'none'})", flush=True)
+
+            metrics.set_gauge('ha.active', 1 if self.is_leader() else 0)
+            await asyncio.sleep(self.renew_interval)
+
+    def _exit(self):
+        """Senza lease il processo non deve più rilevare né inviare: esce e riparte come standby"""
+        # os._exit salta atexit e la pulizia di multiprocessing: i processi figli vanno fermati qui
+        for handler in self._lost_handlers:
+            try:
+                handler()
+            except Exception as e:
+                print(f"[lease] ⚠️ Lost-lease handler failed: {e}", flush=True)
+        print(f"[lease] ⏹️ Exiting with code {LEASE_LOST_EXIT_CODE} to restart as standby", flush=True)
+        os._exit(LEASE_LOST_EXIT_CODE)
+
+
+# Global instance (il file SQLite viene aperto a ogni operazione)
+leader_lease = LeaderLease()
+
+
+if __name__ == '__main__':
+    lease = leader_lease.current()
+    if lease is None:
+        print("No lease yet")
+    else:
+        if lease['valid']:
+            state = f"valid, expires in {lease['expires_at'] - time.time():.1f}s"
+        else:
+            state = 'released' if lease['expires_at'] == 0 else 'expired'
+        print(f"holder={lease['holder']} token={lease['token']} ({state})")
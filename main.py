@@ -8,67 +8,35 @@ import traceback
 import aiohttp
 import json
 from pathlib import Path
-from config import TONCENTER_RATE_LIMIT, TONCENTER_API_V3
-import sys
-
-# === DEBUG LOGGING ===
-print("=" * 60, flush=True)
-print("[DEBUG] Starting TON NFT Bot (TON Center Version)...", flush=True)
-print("=" * 60, flush=True)
-
-try:
-    from web_server import run_in_background
-    print("[DEBUG] ✅ web_server imported", flush=True)
-except Exception as e:
-    print(f"[DEBUG] ❌ web_server import failed: {e}", flush=True)
-    # Continue anyway, web server is optional
-
-try:
-    from config import current_path, royalty_addresses, collections_list
-    from secretData import toncenter_api_key, bot_token as telegram_bot_token, notify_chat as telegram_chat_id
-    print("[DEBUG] ✅ config imported", flush=True)
-    print(f"[DEBUG] royalty_addresses: {len(royalty_addresses)}", flush=True)
-    print(f"[DEBUG] collections_list: {len(collections_list)}", flush=True)
-except Exception as e:
-    print(f"[DEBUG] ❌ config import failed: {e}", flush=True)
-    traceback.print_exc()
-    sys.exit(1)
-
-try:
-    from nftData import get_nft_data, get_collection_floor
-    print("[DEBUG] ✅ nftData imported", flush=True)
-except Exception as e:
-    print(f"[DEBUG] ❌ nftData import failed: {e}", flush=True)
-    traceback.print_exc()
-    sys.exit(1)
-
-try:
-    from tgMessage import tg_message_async, send_telegram_message
-    print("[DEBUG] ✅ tgMessage imported", flush=True)
-except Exception as e:
-    print(f"[DEBUG] ❌ tgMessage import failed: {e}", flush=True)
-    traceback.print_exc()
-    sys.exit(1)
-
-try:
-    from functions import parse_sale_stack, convert_ton_to_usd
-    from functions import get_nft_from_sale_contract, extract_nft_from_comment
-    from functions import get_nft_from_transaction_hash
-    from functions import get_nft_from_transaction_messages # FIX: recupero NFT da messaggi
-    from functions import get_nft_from_sale_contract_v2
-    from functions import get_trace_id_from_tx
-    from functions import get_nft_from_trace_via_tonapi
-    from functions import get_nft_from_transaction_actions
-    from functions import get_sale_data_v2
-    from functions import get_sale_data_via_tonapi
-    print("[DEBUG] ✅ functions imported", flush=True)
-except Exception as e:
-    print(f"[DEBUG] ❌ functions import failed: {e}", flush=True)
-    traceback.print_exc()
-    sys.exit(1)
-
-print("[DEBUG] All imports successful!", flush=True)
-print("=" * 60, flush=True)
+from config import TONCENTER_RATE_LIMIT, TONCENTER_API_V3, SHARD_WORKERS, HA_ENABLED, INGESTION_MODE
+import metrics
+from httpPool import get_session
+
+from config import data_path
+from secretData import toncenter_api_key, bot_token as telegram_bot_token, notify_chat as telegram_chat_id
+
+# Solo moduli leggeri all'import: telegram (python-telegram-bot) e tonsdk vengono caricati al primo
+# uso, il web server dagli entry point. L'inizializzazione esplicita è startup().
+from nftData import get_nft_data, get_collection_floor, floor_service
+from tgMessage import tg_message_async, send_telegram_message, start_outbox, tg_notifier
+from mediaCache import media_cache
+from subscriptions import subscription_registry
+from watchList import watch_list
+from tgCommands import run_commands
+
+from functions import parse_sale_stack, convert_ton_to_usd, price_oracle
+from functions import get_nft_from_sale_contract, extract_nft_from_comment
+from functions import get_nft_from_transaction_hash
+from functions import get_nft_from_transaction_messages # FIX: recupero NFT da messaggi
+from functions import get_nft_from_sale_contract_v2
+from functions import get_trace_id_from_tx
+from functions import get_nft_from_trace_via_tonapi
+from functions import get_nft_from_transaction_actions
+from functions import get_sale_data_v2
+from functions import get_sale_data_via_tonapi
+from salesLedger import sales_ledger, sale_record
+from salesAnalytics import sales_analytics
+from alertLedger import alert_ledger
 
 # === TON CENTER API CONFIGURATION ===
 TONCENTER_HEADERS = {
@@ -115,18 +83,31 @@ class TonCenterAPI:
         self.timeout = HTTP_TIMEOUT
         self.min_request_interval = TONCENTER_RATE_LIMIT
         self.last_request_time = 0
-        
-        print(f"[DEBUG] Using API: {self.base_url}")
-        print(f"[DEBUG] API Key present: {'Yes' if toncenter_api_key else 'No (rate limited)'}")
 
     async def _rate_limit(self):
-        """Assicura almeno 1 secondo tra le richieste"""
+        """Assicura almeno TONCENTER_RATE_LIMIT secondi tra le richieste"""
         now = time.time()
         time_since_last = now - self.last_request_time
-        if time_since_last < 1.0:
-            await asyncio.sleep(1.0 - time_since_last)
+        if time_since_last < self.min_request_interval:
+            await asyncio.sleep(self.min_request_interval - time_since_last)
         self.last_request_time = time.time()
-    
+
+    async def get_json(self, endpoint: str, params) -> dict:
+        """GET generico sull'API v3 (rate limit condiviso); None se la risposta non è 200 o non è JSON"""
+        await self._rate_limit()
+        try:
+            session = get_session()
+            async with session.get(f"{self.base_url}{endpoint}", headers=self.headers,
+                                   params=params, timeout=self.timeout) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    print(f"[TON Center] ❌ {endpoint} error {response.status}: {error_text[:200]}", flush=True)
+                    return None
+                return await response.json()
+        except (asyncio.TimeoutError, aiohttp.ClientError, ValueError) as e:
+            print(f"[TON Center] ❌ {endpoint} failed: {type(e).__name__}: {str(e)[:100]}", flush=True)
+            return None
+
     async def get_transactions(self, address: str, limit: int = 25) -> list:
         await self._rate_limit()
         """Fetch transactions using correct TON Center API v3 endpoint and parameters - FIXED VERSION"""
@@ -166,117 +147,117 @@ class TonCenterAPI:
                 print(f"[DEBUG] Request URL: {url}")
                 print(f"[DEBUG] Request params: {test_case['params']}")
                 
-                async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                    async with session.get(
-                        url, 
-                        headers=self.headers, 
-                        params=test_case['params']
-                    ) as response:
-                        
-                        status = response.status
-                        print(f"[DEBUG] Response status: {status}")
+                session = get_session()
+                async with session.get(
+                    url, 
+                    headers=self.headers, 
+                    params=test_case['params']
+                ) as response:
+                    
+                    status = response.status
+                    print(f"[DEBUG] Response status: {status}")
+                    
+                    if status == 200:
+                        # PRIMA: Leggi la risposta RAW per debug
+                        raw_response = await response.text()
+                        print(f"[DEBUG] Raw response length: {len(raw_response)} chars")
+                        print(f"[DEBUG] First 500 chars of response: {raw_response[:500]}")
                         
-                        if status == 200:
-                            # PRIMA: Leggi la risposta RAW per debug
-                            raw_response = await response.text()
-                            print(f"[DEBUG] Raw response length: {len(raw_response)} chars")
-                            print(f"[DEBUG] First 500 chars of response: {raw_response[:500]}")
+                        try:
+                            data = await response.json()
+                            print(f"[DEBUG] Successfully parsed JSON")
                             
-                            try:
-                                data = await response.json()
-                                print(f"[DEBUG] Successfully parsed JSON")
-                                
-                                # ANALISI DELLA STRUTTURA DELLA RISPOSTA
-                                print(f"[DEBUG] Response keys: {list(data.keys())}")
-                                
-                                # CERCA LE TRANSAZIONI IN VARI PUNTI POSSIBILI
-                                txs = []
-                                
-                                # Caso 1: direttamente in "transactions"
-                                if "transactions" in data:
-                                    txs = data["transactions"]
-                                    print(f"[DEBUG] Found {len(txs)} transactions in 'transactions' key")
-                                
-                                # Caso 2: in "result" -> "transactions"
-                                elif "result" in data and isinstance(data["result"], dict):
-                                    if "transactions" in data["result"]:
-                                        txs = data["result"]["transactions"]
-                                        print(f"[DEBUG] Found {len(txs)} transactions in 'result.transactions'")
-                                
-                                # Caso 3: la risposta è direttamente un array
-                                elif isinstance(data, list):
-                                    txs = data
-                                    print(f"[DEBUG] Response is direct array with {len(txs)} items")
-                                
-                                print(f"[TON Center] ✅ Got {len(txs)} transactions with {test_case['name']}")
+                            # ANALISI DELLA STRUTTURA DELLA RISPOSTA
+                            print(f"[DEBUG] Response keys: {list(data.keys())}")
+                            
+                            # CERCA LE TRANSAZIONI IN VARI PUNTI POSSIBILI
+                            txs = []
+                            
+                            # Caso 1: direttamente in "transactions"
+                            if "transactions" in data:
+                                txs = data["transactions"]
+                                print(f"[DEBUG] Found {len(txs)} transactions in 'transactions' key")
+                            
+                            # Caso 2: in "result" -> "transactions"
+                            elif "result" in data and isinstance(data["result"], dict):
+                                if "transactions" in data["result"]:
+                                    txs = data["result"]["transactions"]
+                                    print(f"[DEBUG] Found {len(txs)} transactions in 'result.transactions'")
+                            
+                            # Caso 3: la risposta è direttamente un array
+                            elif isinstance(data, list):
+                                txs = data
+                                print(f"[DEBUG] Response is direct array with {len(txs)} items")
+                            
+                            print(f"[TON Center] ✅ Got {len(txs)} transactions with {test_case['name']}")
+                            
+                            if txs:
+                                # DEBUG DETTAGLIATO DELLA PRIMA TRANSAZIONE
+                                print(f"[DEBUG] Analyzing first transaction structure:")
                                 
-                                if txs:
-                                    # DEBUG DETTAGLIATO DELLA PRIMA TRANSAZIONE
-                                    print(f"[DEBUG] Analyzing first transaction structure:")
+                                if isinstance(txs[0], dict):
+                                    print(f"[DEBUG] First TX is a dict with keys: {list(txs[0].keys())}")
                                     
-                                    if isinstance(txs[0], dict):
-                                        print(f"[DEBUG] First TX is a dict with keys: {list(txs[0].keys())}")
-                                        
-                                        # Stampa i valori chiave
-                                        important_keys = ["now", "hash", "lt", "account", "in_msg", "out_msgs"]
-                                        for key in important_keys:
-                                            if key in txs[0]:
-                                                value = txs[0][key]
-                                                print(f"  {key}: {type(value)} = {str(value)[:100]}")
-                                        
-                                        # Analisi speciale per 'account'
-                                        if "account" in txs[0]:
-                                            account_data = txs[0]["account"]
-                                            print(f"  account type: {type(account_data)}")
-                                            if isinstance(account_data, dict):
-                                                print(f"  account keys: {list(account_data.keys())}")
-                                                if "address" in account_data:
-                                                    print(f"  account.address: {account_data['address'][-8:]}")
-                                        
-                                        # Analisi speciale per 'in_msg'
-                                        if "in_msg" in txs[0]:
-                                            in_msg = txs[0]["in_msg"]
-                                            print(f"  in_msg type: {type(in_msg)}")
-                                            if isinstance(in_msg, dict):
-                                                print(f"  in_msg keys: {list(in_msg.keys())}")
-                                                if "source" in in_msg:
-                                                    source = in_msg["source"]
-                                                    print(f"  source type: {type(source)}")
-                                                    if isinstance(source, dict) and "address" in source:
-                                                        print(f"  source.address: {source['address'][-8:]}")
+                                    # Stampa i valori chiave
+                                    important_keys = ["now", "hash", "lt", "account", "in_msg", "out_msgs"]
+                                    for key in important_keys:
+                                        if key in txs[0]:
+                                            value = txs[0][key]
+                                            print(f"  {key}: {type(value)} = {str(value)[:100]}")
                                     
-                                    elif isinstance(txs[0], list):
-                                        print(f"[DEBUG] First TX is a list with {len(txs[0])} items")
-                                        for i, item in enumerate(txs[0][:5]):
-                                            print(f"  [{i}] type: {type(item)}, value: {str(item)[:50]}")
+                                    # Analisi speciale per 'account'
+                                    if "account" in txs[0]:
+                                        account_data = txs[0]["account"]
+                                        print(f"  account type: {type(account_data)}")
+                                        if isinstance(account_data, dict):
+                                            print(f"  account keys: {list(account_data.keys())}")
+                                            if "address" in account_data:
+                                                print(f"  account.address: {account_data['address'][-8:]}")
                                     
-                                    elif isinstance(txs[0], str):
-                                        print(f"[DEBUG] First TX is a string: {txs[0][:100]}")
-                                    
-                                    return txs
-                                else:
-                                    print(f"[TON Center] ⚠️ 0 transactions in parsed data")
-                                    # Mostra cosa c'è nella risposta
-                                    print(f"[DEBUG] Full response structure:")
-                                    print(json.dumps(data, indent=2)[:1000])
-                                    continue
-                            
-                            except json.JSONDecodeError as e:
-                                print(f"[DEBUG] ❌ JSON decode error: {e}")
-                                print(f"[DEBUG] Raw response that failed to parse: {raw_response[:200]}")
-                                continue
-                            except Exception as e:
-                                print(f"[DEBUG] ❌ Error parsing response: {e}")
+                                    # Analisi speciale per 'in_msg'
+                                    if "in_msg" in txs[0]:
+                                        in_msg = txs[0]["in_msg"]
+                                        print(f"  in_msg type: {type(in_msg)}")
+                                        if isinstance(in_msg, dict):
+                                            print(f"  in_msg keys: {list(in_msg.keys())}")
+                                            if "source" in in_msg:
+                                                source = in_msg["source"]
+                                                print(f"  source type: {type(source)}")
+                                                if isinstance(source, dict) and "address" in source:
+                                                    print(f"  source.address: {source['address'][-8:]}")
+                                
+                                elif isinstance(txs[0], list):
+                                    print(f"[DEBUG] First TX is a list with {len(txs[0])} items")
+                                    for i, item in enumerate(txs[0][:5]):
+                                        print(f"  [{i}] type: {type(item)}, value: {str(item)[:50]}")
+                                
+                                elif isinstance(txs[0], str):
+                                    print(f"[DEBUG] First TX is a string: {txs[0][:100]}")
+                                
+                                return txs
+                            else:
+                                print(f"[TON Center] ⚠️ 0 transactions in parsed data")
+                                # Mostra cosa c'è nella risposta
+                                print(f"[DEBUG] Full response structure:")
+                                print(json.dumps(data, indent=2)[:1000])
                                 continue
                         
-                        elif status == 429:
-                            print(f"[TON Center] ⛔ Rate limit hit with {test_case['name']}")
-                            await asyncio.sleep(2)
+                        except json.JSONDecodeError as e:
+                            print(f"[DEBUG] ❌ JSON decode error: {e}")
+                            print(f"[DEBUG] Raw response that failed to parse: {raw_response[:200]}")
                             continue
-                        else:
-                            error_text = await response.text()
-                            print(f"[DEBUG] API Error {status}: {error_text[:200]}")
+                        except Exception as e:
+                            print(f"[DEBUG] ❌ Error parsing response: {e}")
                             continue
+                    
+                    elif status == 429:
+                        print(f"[TON Center] ⛔ Rate limit hit with {test_case['name']}")
+                        await asyncio.sleep(2)
+                        continue
+                    else:
+                        error_text = await response.text()
+                        print(f"[DEBUG] API Error {status}: {error_text[:200]}")
+                        continue
             
             except asyncio.TimeoutError:
                 print(f"[DEBUG] Timeout with {test_case['name']}")
@@ -297,67 +278,67 @@ class TonCenterAPI:
         try:
             print(f"[DEBUG] run_get_method called: address={address[-8:]}, method={method}")
             
-            async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                # ✅ Endpoint corretto per v3
-                url = f"{self.base_url}/runGetMethod"
-                
-                # ✅ Payload corretto per v3
-                payload = {
-                    "address": address,
-                    "method": method,
-                    "stack": stack if stack is not None else []
-                }
+            session = get_session()
+            # ✅ Endpoint corretto per v3
+            url = f"{self.base_url}/runGetMethod"
+            
+            # ✅ Payload corretto per v3
+            payload = {
+                "address": address,
+                "method": method,
+                "stack": stack if stack is not None else []
+            }
+            
+            print(f"[DEBUG] run_get_method payload: {json.dumps(payload, indent=2)[:200]}...")
+            
+            async with session.post(url, headers=self.headers, json=payload) as response:
                 
-                print(f"[DEBUG] run_get_method payload: {json.dumps(payload, indent=2)[:200]}...")
+                status = response.status
+                print(f"[DEBUG] run_get_method status: {status}")
                 
-                async with session.post(url, headers=self.headers, json=payload) as response:
-                    
-                    status = response.status
-                    print(f"[DEBUG] run_get_method status: {status}")
-                    
-                    if status == 429:
-                        print(f"[TON Center] ⛔ Rate limit in get_method {method}", flush=True)
-                        return None
-                    
-                    if status != 200:
-                        error_text = await response.text()
-                        print(f"[DEBUG] run_get_method error {status}: {error_text[:200]}")
+                if status == 429:
+                    print(f"[TON Center] ⛔ Rate limit in get_method {method}", flush=True)
+                    return None
+                
+                if status != 200:
+                    error_text = await response.text()
+                    print(f"[DEBUG] run_get_method error {status}: {error_text[:200]}")
+                    return None
+                
+                data = await response.json()
+                print(f"[DEBUG] run_get_method raw response keys: {list(data.keys())}")
+                
+                # ✅ Controlla il formato di risposta della v3
+                if "ok" in data:
+                    # Formato v3: {"ok": true, "result": {"stack": [...]}}
+                    if data.get("ok") and "result" in data:
+                        result_stack = data["result"].get("stack", [])
+                        print(f"[TON Center] ✅ get_method {method} succeeded (v3 format), stack size: {len(result_stack)}")
+                        return result_stack
+                    else:
+                        print(f"[TON Center] ❌ get_method {method} failed (v3 format), ok={data.get('ok')}")
                         return None
-                    
-                    data = await response.json()
-                    print(f"[DEBUG] run_get_method raw response keys: {list(data.keys())}")
-                    
-                    # ✅ Controlla il formato di risposta della v3
-                    if "ok" in data:
-                        # Formato v3: {"ok": true, "result": {"stack": [...]}}
-                        if data.get("ok") and "result" in data:
-                            result_stack = data["result"].get("stack", [])
-                            print(f"[TON Center] ✅ get_method {method} succeeded (v3 format), stack size: {len(result_stack)}")
-                            return result_stack
-                        else:
-                            print(f"[TON Center] ❌ get_method {method} failed (v3 format), ok={data.get('ok')}")
-                            return None
-                    
-                    # Fallback: formato v2 legacy
-                    elif "success" in data:
-                        if data.get("success", False):
-                            stack_data = data.get("stack", [])
-                            print(f"[TON Center] ✅ get_method {method} succeeded (v2 legacy), stack size: {len(stack_data)}")
-                            return stack_data
-                        else:
-                            print(f"[TON Center] ❌ get_method {method} failed (v2 legacy)")
-                            return None
-                    
-                    # Altri formati possibili
-                    elif "stack" in data:
+                
+                # Fallback: formato v2 legacy
+                elif "success" in data:
+                    if data.get("success", False):
                         stack_data = data.get("stack", [])
-                        print(f"[TON Center] ✅ get_method {method} succeeded (direct stack), stack size: {len(stack_data)}")
+                        print(f"[TON Center] ✅ get_method {method} succeeded (v2 legacy), stack size: {len(stack_data)}")
                         return stack_data
-                    
                     else:
-                        print(f"[TON Center] ❌ Unknown response format for {method}")
-                        print(f"[DEBUG] Full response: {json.dumps(data, indent=2)[:500]}")
+                        print(f"[TON Center] ❌ get_method {method} failed (v2 legacy)")
                         return None
+                
+                # Altri formati possibili
+                elif "stack" in data:
+                    stack_data = data.get("stack", [])
+                    print(f"[TON Center] ✅ get_method {method} succeeded (direct stack), stack size: {len(stack_data)}")
+                    return stack_data
+                
+                else:
+                    print(f"[TON Center] ❌ Unknown response format for {method}")
+                    print(f"[DEBUG] Full response: {json.dumps(data, indent=2)[:500]}")
+                    return None
         
         except asyncio.TimeoutError:
             print(f"[TON Center] Timeout in get_method {method}", flush=True)
@@ -411,23 +392,30 @@ class TonCenterAPI:
 # Global API instance
 toncenter_api = TonCenterAPI()
 
-# Debug verification
-print("[DEBUG] ✅ TonCenterAPI class structure verified")
-print(f"[DEBUG] Methods available: {[m for m in dir(toncenter_api) if not m.startswith('_')]}")
+def last_utime_path(royalty_address: str = None) -> str:
+    """Checkpoint globale (lastUtime.txt) o di un indirizzo royalty (lastUtime.0_HEX.txt)"""
+    if not royalty_address:
+        return f'{data_path}/lastUtime.txt'
+    return f'{data_path}/lastUtime.{royalty_address.replace(":", "_")}.txt'
 
-def read_last_utime() -> int:
-    """Read last processed timestamp"""
-    try:
-        with open(f'{current_path}/lastUtime.txt', 'r') as f:
-            return int(f.read().strip())
-    except (FileNotFoundError, ValueError):
-        print(f"[lastUtime] File not found. Starting from 0.", flush=True)
-        return 0
+def read_last_utime(royalty_address: str = None) -> int:
+    """Read last processed timestamp (per indirizzo: al primo avvio eredita quello globale)"""
+    paths = [last_utime_path(royalty_address)]
+    if royalty_address:
+        paths.append(last_utime_path())
+    for path in paths:
+        try:
+            with open(path, 'r') as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            continue
+    print(f"[lastUtime] File not found. Starting from 0.", flush=True)
+    return 0
 
-def write_last_utime(utime: int):
+def write_last_utime(utime: int, royalty_address: str = None):
     """Write last processed timestamp"""
     try:
-        with open(f'{current_path}/lastUtime.txt', 'w') as f:
+        with open(last_utime_path(royalty_address), 'w') as f:
             f.write(str(utime))
     except Exception as e:
         print(f"[lastUtime] Error saving: {e}", flush=True)
@@ -435,6 +423,14 @@ def write_last_utime(utime: int):
 # Bot start time for uptime calculation
 BOT_START_TIME = time.time()
 
+def start_new_checkpoints(change, addresses=None):
+    """Watch list: un indirizzo royalty aggiunto parte da adesso (lo storico si recupera con backfill.py)"""
+    now = int(time.time())
+    for address in change.added_addresses:
+        if addresses is None or address in addresses:
+            write_last_utime(now, address)
+            print(f"[lastUtime] ✅ New checkpoint for {address[-8:]}: {now}", flush=True)
+
 def get_bot_uptime() -> str:
     """Calculate bot uptime in human readable format"""
     uptime = time.time() - BOT_START_TIME
@@ -516,6 +512,7 @@ async def handle_telegram_command(command: str, chat_id: str, message_id: str =
             message += "• /example - Example NFT sale notification\n"
             message += "• /addresses - Show monitored royalty addresses\n"
             message += "• /collections - Show monitored collections\n"
+            message += "• /stats - Sales stats per collection (1h/24h/7d)\n"
             message += "• /ping - Check if bot is alive\n\n"
             message += "🔔 I'll automatically notify you when NFT sales occur!\n"
             message += "Bot is powered by TON Center API v3."
@@ -528,6 +525,7 @@ async def handle_telegram_command(command: str, chat_id: str, message_id: str =
             message += "• /example - Send example NFT sale notification\n"
             message += "• /addresses - List monitored royalty addresses\n"
             message += "• /collections - List monitored NFT collections\n"
+            message += "• /stats - Volume, sales and median price per collection\n"
             message += "• /ping - Check if the bot is responsive\n\n"
             message += "🔄 *Bot cycles every 3 minutes*\n"
             message += "Checking for new NFT sales automatically!"
@@ -540,10 +538,24 @@ async def handle_telegram_command(command: str, chat_id: str, message_id: str =
             message = "📊 *Bot Status Report*\n\n"
             message += f"⏱️ *Uptime:* {uptime_str}\n"
             message += f"🕒 *Last Check:* {last_time_str}\n"
-            message += f"📍 *Royalty Addresses:* {len(royalty_addresses)}\n"
-            message += f"🎨 *Collections Monitored:* {len(collections_list)}\n"
+            message += f"📍 *Royalty Addresses:* {len(watch_list.royalty_addresses)}\n"
+            message += f"🎨 *Collections Monitored:* {len(subscription_registry.collections())}\n"
             message += f"🌐 *API:* TON Center v3\n"
             message += f"🔑 *API Key:* {'✅ Present' if toncenter_api_key else '⚠️ Not set (rate limited)'}\n"
+            quote = price_oracle.quote()
+            if quote['price_usd'] is not None:
+                stale_note = " ⚠️ stale" if quote['stale'] else ""
+                message += f"💵 *TON/USD:* {quote['price_usd']:.4f} ({int(quote['age'])}s old{stale_note})\n"
+            else:
+                message += f"💵 *TON/USD:* not available\n"
+            totals = sales_ledger.totals()
+            message += f"💾 *Sales recorded:* {totals['count']} ({totals['volume']:.2f} TON)\n"
+            if totals['last_sale']:
+                message += f"🛒 *Last sale:* {time.ctime(totals['last_sale'])}\n"
+            alert_counts = alert_ledger.counts()
+            message += f"🔔 *Alerts:* {alert_counts.get('sent', 0)} sent, {alert_counts.get('failed', 0)} failed\n"
+            send_latency = metrics.snapshot()['timings'].get('outbox.send_latency', {})
+            message += f"📮 *Outbox:* {metrics.get_gauge('outbox.queue_depth', 0)} queued, p95 {send_latency.get('p95', 0):.1f}s\n"
             message += f"⏳ *Next Check:* Every 3 minutes\n\n"
             message += "✅ *Bot is running normally*"
             
@@ -556,6 +568,7 @@ async def handle_telegram_command(command: str, chat_id: str, message_id: str =
                 message = "❌ Could not send example notification. Please try again later."
                 
         elif command == "/addresses" or command == "/addresses@ton_nft_bot":
+            royalty_addresses = watch_list.royalty_addresses
             if not royalty_addresses:
                 message = "📭 No royalty addresses are currently being monitored."
             else:
@@ -569,19 +582,47 @@ async def handle_telegram_command(command: str, chat_id: str, message_id: str =
                 message += "\n\n👑 These addresses receive royalty payments from NFT sales."
                 
         elif command == "/collections" or command == "/collections@ton_nft_bot":
-            if not collections_list:
+            monitored = subscription_registry.collections()
+            if not monitored:
                 message = "🎨 No NFT collections are currently being monitored."
             else:
-                message = f"🎨 *Monitored NFT Collections* ({len(collections_list)}):\n\n"
-                for i, addr in enumerate(collections_list[:10]):  # Show max 10
+                message = f"🎨 *Monitored NFT Collections* ({len(monitored)}):\n\n"
+                for i, addr in enumerate(monitored[:10]):  # Show max 10
                     short_addr = addr[:8] + "..." + addr[-8:] if len(addr) > 16 else addr
-                    message += f"{i+1}. `{short_addr}`\n"
+                    chats = len(subscription_registry.subscriptions_for(addr))
+                    message += f"{i+1}. `{short_addr}` → {chats} chat{'s' if chats != 1 else ''}\n"
                 
-                if len(collections_list) > 10:
-                    message += f"\n... and {len(collections_list) - 10} more collections"
+                if len(monitored) > 10:
+                    message += f"\n... and {len(monitored) - 10} more collections"
                 
                 message += "\n\n🔔 I'll notify you when NFTs from these collections are sold!"
                 
+        elif command == "/stats" or command == "/stats@ton_nft_bot":
+            # Ring buffer in memoria: nessuna query sul ledger oltre alle vendite nuove
+            sales_analytics.sync()
+            summary = sales_analytics.summary(list(watch_list.collections))
+            if not summary:
+                message = "📈 No NFT collections are currently being monitored."
+            else:
+                message = f"📈 *Collection Stats* ({len(summary)}):\n"
+                for item in summary[:10]:  # Show max 10
+                    addr = item['collection']
+                    short_addr = addr[:8] + "..." + addr[-8:] if len(addr) > 16 else addr
+                    message += f"\n🎨 `{short_addr}`\n"
+                    for name, w in item['windows'].items():
+                        if w['count']:
+                            message += (f"• {name}: {w['count']} sales, {w['volume']:.2f} TON, "
+                                        f"median {w['median']:.2f}, avg {w['avg']:.2f}\n")
+                        else:
+                            message += f"• {name}: no sales\n"
+                    floor = item['windows']['24h']
+                    if floor['floor'] is not None:
+                        trend = f" ({floor['floor_change_pct']:+.1f}% 24h)" if floor['floor_change_pct'] is not None else ""
+                        message += f"🏷️ Floor: {floor['floor']:.2f} TON{trend}\n"
+                
+                if len(summary) > 10:
+                    message += f"\n... and {len(summary) - 10} more collections"
+                
         elif command == "/ping" or command == "/ping@ton_nft_bot":
             message = "🏓 *Pong!*\n\n"
             message += f"✅ Bot is alive and responding\n"
@@ -601,92 +642,157 @@ async def handle_telegram_command(command: str, chat_id: str, message_id: str =
         except:
             pass
 
+async def wait_for_leadership():
+    """HA: lo standby resta qui finché non ottiene il lease, poi riparte da checkpoint e alert ledger"""
+    if not HA_ENABLED:
+        return
+    from leaderLease import leader_lease
+    from tgOutbox import outbox
+    outbox.gate = leader_lease.is_leader
+    await leader_lease.acquire()
+
 async def telegram_polling_handler():
-    """Handle Telegram commands via polling"""
+    """Handle Telegram commands (polling o webhook, vedi TELEGRAM_MODE) con worker concorrenti per chat"""
     try:
-        if not telegram_bot_token:
-            print("[TELEGRAM] No bot token configured, polling disabled", flush=True)
-            return
-        
-        print(f"[TELEGRAM] Starting polling handler for bot", flush=True)
-        
-        # Bot info
-        bot_username = None
-        try:
-            # Get bot info
-            bot_info_url = f"https://api.telegram.org/bot{telegram_bot_token}/getMe"
-            async with aiohttp.ClientSession(timeout=HTTP_TIMEOUT) as session:
-                async with session.get(bot_info_url) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        if data.get("ok"):
-                            bot_username = data["result"].get("username")
-                            print(f"[TELEGRAM] Bot username: @{bot_username}", flush=True)
-        except Exception as e:
-            print(f"[TELEGRAM] Error getting bot info: {e}", flush=True)
-        
-        last_update_id = 0
-        
-        while True:
-            try:
-                # Get updates from Telegram
-                updates_url = f"https://api.telegram.org/bot{telegram_bot_token}/getUpdates"
-                params = {
-                    "offset": last_update_id + 1,
-                    "timeout": 30,
-                    "allowed_updates": ["message"]
-                }
-                
-                async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=35)) as session:
-                    async with session.get(updates_url, params=params) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            
-                            if data.get("ok") and data.get("result"):
-                                updates = data["result"]
-                                
-                                for update in updates:
-                                    last_update_id = update["update_id"]
-                                    
-                                    if "message" in update and "text" in update["message"]:
-                                        message = update["message"]
-                                        chat_id = str(message["chat"]["id"])
-                                        text = message["text"].strip()
-                                        message_id = message.get("message_id")
-                                        
-                                        # Check if message is a command
-                                        if text.startswith("/"):
-                                            print(f"[TELEGRAM] Received command: {text} from chat {chat_id}", flush=True)
-                                            await handle_telegram_command(text, chat_id, message_id)
-                                        
-                
-                # Small delay between polling
-                await asyncio.sleep(1)
-                
-            except asyncio.TimeoutError:
-                # Timeout is normal for long polling
-                continue
-            except aiohttp.ClientError as e:
-                print(f"[TELEGRAM] HTTP error in polling: {e}", flush=True)
-                await asyncio.sleep(5)
-            except Exception as e:
-                print(f"[TELEGRAM] Error in polling handler: {e}", flush=True)
-                await asyncio.sleep(5)
-                
+        # Un solo getUpdates per bot: i comandi li serve il nodo active
+        await wait_for_leadership()
+        await run_commands(handle_telegram_command)
     except Exception as e:
-        print(f"[TELEGRAM] Fatal error in polling handler: {e}", flush=True)
+        print(f"[TELEGRAM] Fatal error in command handler: {e}", flush=True)
         traceback.print_exc()
 
-async def royalty_trs(royalty_address: str):
+async def deliver_alert(alert_key: str, nft_address: str, payload: dict, deliveries: list) -> int:
+    """
+    Passa al notifier un alert registrato nel ledger, una consegna per chat: deliveries = [(chat_id, template)].
+    L'outbox segna ogni consegna 'sending' quando la accoda (se trattenuta per un digest resta 'detected')
+    e poi sent/failed. Ritorna il numero di chat servite.
+    """
+    # chat_id '' = alert registrato prima del routing per chat: va a NOTIFY_CHAT
+    jobs = [(chat_id or telegram_chat_id, template, (alert_key, nft_address, chat_id))
+            for chat_id, template in deliveries]
+    try:
+        results = tg_notifier.fan_out(payload, jobs)
+    except Exception as e:
+        print(f"[ALERT] ❌ Enqueue error for {nft_address[-12:]}: {e}", flush=True)
+        results = [False] * len(jobs)
+    
+    for (chat_id, _), queued in zip(deliveries, results):
+        if not queued:
+            alert_ledger.mark_failed(alert_key, nft_address, chat_id, "telegram enqueue failed")
+    return sum(results)
+
+async def retry_pending_alerts():
+    """Riaccoda gli alert mai accodati (crash) o scartati dall'outbox - chiamata a ogni ciclo"""
+    try:
+        pending = alert_ledger.pending()
+    except Exception as e:
+        print(f"[ALERT] ❌ Cannot read alert ledger: {e}", flush=True)
+        return
+    
+    for alert in pending:
+        print(f"[ALERT] 🔁 Retrying {alert['state']} alert for {alert['nft'][-12:]} (attempt {alert['attempts'] + 1})", flush=True)
+        payload = alert['payload']
+        template = payload.get('template', 'full')
+        await deliver_alert(alert['trace_id'], alert['nft'], payload, [(alert['chat_id'], template)])
+
+def flush_sale_records(sale_records: list):
+    """Scrive nel ledger le vendite raccolte durante il ciclo (un solo lotto)"""
     try:
-        last_utime = read_last_utime()
+        sales_ledger.record_sales(sale_records)
+    except Exception as e:
+        print(f"[ledger] ❌ Error recording sales: {e}", flush=True)
+    try:
+        if sale_records:
+            sales_analytics.sync()
+    except Exception as e:
+        print(f"[analytics] ❌ Error updating stats: {e}", flush=True)
+    sale_records.clear()
+
+# Esiti di dispatch_sale dopo i quali il checkpoint può avanzare (vendita gestita in modo durevole)
+CHECKPOINT_OUTCOMES = ('queued', 'not_queued', 'filtered')
+
+async def dispatch_sale(tx: dict, sale, nft_address: str, nft_info, deliver) -> str:
+    """
+    Alert di una vendita già risolta (qualunque sia la sorgente: royalty, feed di collezione):
+    floor dalla cache, registrazione nel ledger per chat iscritta e consegna.
+    tx = transazione o dict con trace_id / hash / now. Ritorna l'esito (vedi CHECKPOINT_OUTCOMES).
+    """
+    collection_address = nft_info.collection
+    tx_time = tx.get('now', 0)
+    if subscription_registry.is_monitored(collection_address):
+        print(f"[DEBUG] ✅✅✅ COLLECTION MONITORED! {collection_address[-12:]}")
+
+        # 🟢 6. GET FLOOR PRICE (dalla cache, poi refresh in background)
+        floor_price, floor_link = floor_service.get_floor(collection_address)
+        floor_service.mark_sale(collection_address)
+        # Preview scaricata mentre l'alert viene registrato e accodato
+        media_cache.prefetch(nft_info.image)
+        print(f"[DEBUG]    Floor: {floor_price} TON" if floor_price else "[DEBUG]    Floor: None (not cached or stale)")
+
+        # 🟢 7. SEND NOTIFICATION (una sola volta per chat: chiave trace_id + NFT + chat)
+        payload = {
+            'action': sale.action,
+            'market_address': sale.marketplace,
+            'nft_address': nft_address,
+            'prew_owner': sale.seller,
+            'real_owner': sale.buyer or nft_info.owner,
+            'price_ton': sale.price_ton or 0,
+            'nft_name': nft_info.name or "Unknown NFT",
+            'nft_preview': nft_info.image or "",
+            'floor_ton': floor_price,
+            'floor_link': floor_link,
+            'collection': collection_address,
+        }
+        alert_key = tx.get('trace_id') or tx.get('hash', '')
+        subscribers = subscription_registry.match(collection_address, payload['price_ton'], payload['action'])
+
+        deliveries = []
+        for sub in subscribers:
+            if alert_ledger.record_detected(alert_key, nft_address, dict(payload, template=sub.template),
+                                            tx_time, chat_id=sub.chat_id, tx_hash=tx.get('hash', '')):
+                deliveries.append((sub.chat_id, sub.template))
+
+        if not subscribers:
+            print(f"[DEBUG] ⏭️ Sale filtered out by every subscription")
+            return 'filtered'
+        elif deliveries:
+            # Vendita registrata in modo durevole: il checkpoint può avanzare,
+            # un invio fallito verrà ritentato dal ledger
+            print(f"[DEBUG] 📨 QUEUEING TELEGRAM NOTIFICATION ({len(deliveries)} chats)...")
+            if await deliver(alert_key, nft_address, payload, deliveries):
+                print(f"[DEBUG] ✅✅✅ NOTIFICATION QUEUED!")
+                return 'queued'
+            print(f"[DEBUG] ❌❌❌ NOTIFICATION NOT QUEUED (will retry from ledger)")
+            return 'not_queued'
+        else:
+            print(f"[DEBUG] ⏭️ Alert already in ledger for every subscribed chat")
+            return 'duplicate'
+    else:
+        print(f"[DEBUG] ⚠️ Collection NOT monitored: {collection_address[-12:] if collection_address else 'None'}")
+        print(f"[DEBUG]    Monitored collections: {[c[-12:] for c in subscription_registry.collections()]}")
+        return 'unmonitored'
+
+async def royalty_trs(royalty_address: str, deliver=None, transactions: list = None, unresolved: list = None):
+    """
+    Un ciclo di rilevamento su un indirizzo royalty (checkpoint per indirizzo).
+    deliver(alert_key, nft, payload, deliveries) consegna gli alert registrati: di default
+    deliver_alert in questo processo, nei worker degli shard l'invio al notifier.
+    transactions = transazioni già lette (dalla più recente, come get_transactions), es. da un blocco.
+    unresolved = lista che riceve le tx non risolte per errore del provider (da ritentare).
+    """
+    deliver = deliver or deliver_alert
+    sale_records = []  # vendite del ciclo, scritte nel ledger in un solo lotto
+    failed = []        # tx non risolte per errore del provider: il checkpoint non le supera
+    try:
+        last_utime = read_last_utime(royalty_address)
         print(f"\n[DEBUG] 🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴")
         print(f"[DEBUG] 🔴 ROYALTY TRS START - {time.strftime('%H:%M:%S')}")
         print(f"[DEBUG] 🔴 Address: {royalty_address[-12:]}")
         print(f"[DEBUG] 🔴 Last utime: {last_utime} ({time.ctime(last_utime)})")
         print(f"[DEBUG] 🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴\n")
         
-        transactions = await toncenter_api.get_transactions(royalty_address, limit=25)
+        if transactions is None:
+            transactions = await toncenter_api.get_transactions(royalty_address, limit=25)
         
         if not transactions:
             print(f"[DEBUG] ⚠️ No transactions found")
@@ -710,10 +816,17 @@ async def royalty_trs(royalty_address: str):
             source_address = in_msg.get('source')
             
             # 🟢 SINGLE CONTINUE - LIKE PYTONLIB!
-            if tx_time <= last_utime or not source_address:
+            # tx dello stesso secondo di lastUtime vengono riesaminate: i doppioni li ferma l'alert ledger
+            if tx_time < last_utime or not source_address:
                 print(f"[DEBUG] ⏭️ TX {idx}: Skipped (timestamp or empty source)")
                 continue
             
+            # Tx già nel registro alert: vendita già gestita, nessuna chiamata API
+            # (per hash: le altre vendite della stessa trace, es. un acquisto multiplo, vanno risolte)
+            if alert_ledger.has_tx(tx_hash_full):
+                print(f"[DEBUG] ⏭️ TX {idx}: Already in alert ledger")
+                continue
+            
             print(f"[DEBUG] ✅ Source address: {source_address[-12:] if source_address else 'None'}")
             print(f"[DEBUG]    Value: {int(in_msg.get('value', 0)) / 1e9:.4f} TON")
 
@@ -747,18 +860,24 @@ async def royalty_trs(royalty_address: str):
             if not stack:
                 # Se v2 fallisce, prova con TonAPI come fallback
                 print(f"[DEBUG] ⏭️ v2 failed, trying TonAPI...")
+                v2_error = stack is None
                 stack = await get_sale_data_via_tonapi(source_address)
+                if stack is None and v2_error:
+                    # Nessun provider ha risposto (429, rete): non è una non-vendita
+                    print(f"[DEBUG] ⚠️ get_sale_data unavailable, will retry")
+                    failed.append(tx)
+                    continue
             
             if stack:
                 print(f"[DEBUG] ✅ get_sale_data() success! Stack size: {len(stack)}")
                 
                 # 🟢 2. PARSE SALE STACK
-                sale_data = parse_sale_stack(stack)
+                sale = parse_sale_stack(stack)
                 
-                if sale_data and sale_data[1]:  # is_complete = True (SOLD!)
-                    print(f"[DEBUG] ✅ Sale completed! Type: {sale_data[0]}, Price: {sale_data[6] if len(sale_data) > 6 else 0} TON")
+                if sale and sale.is_complete:  # SOLD!
+                    print(f"[DEBUG] ✅ Sale completed! Type: {sale.action}, Price: {sale.price_ton} TON")
                     
-                    nft_address = sale_data[4] if len(sale_data) > 4 else None
+                    nft_address = sale.nft
                     
                     if nft_address:
                         print(f"[DEBUG] ✅ NFT address found in stack: {nft_address[-12:]}")
@@ -772,56 +891,32 @@ async def royalty_trs(royalty_address: str):
                             print(f"[DEBUG] ✅ NFT address from source: {nft_address[-12:]}")
                     
                     if nft_address:
+                        # Aste e offerte hanno il buyer nello stack (sale.buyer): nessuna chiamata per l'owner
                         print(f"[DEBUG] 📥 Fetching NFT data for {nft_address[-12:]}...")
-                        nft_data = await get_nft_data(nft_address)
+                        nft_info = await get_nft_data(nft_address, owner=sale.buyer)
                         
-                        if nft_data and nft_data[0] and nft_data[1]:
-                            collection_address = nft_data[1]
+                        if nft_info and nft_info.ok:
+                            collection_address = nft_info.collection
                             print(f"[DEBUG] ✅ NFT data retrieved! Collection: {collection_address[-12:] if collection_address else 'None'}")
                             
-                            # 🟢 5. CHECK MONITORED COLLECTION
-                            if collection_address in collections_list:
-                                print(f"[DEBUG] ✅✅✅ COLLECTION MONITORED! {collection_address[-12:]}")
-                                
-                                # 🟢 6. GET FLOOR PRICE
-                                print(f"[DEBUG] 📊 Fetching floor price...")
-                                floor_price, floor_link = await get_collection_floor(collection_address)
-                                print(f"[DEBUG]    Floor: {floor_price} TON" if floor_price else "[DEBUG]    Floor: None")
-                                
-                                # 🟢 7. SEND NOTIFICATION
-                                try:
-                                    print(f"[DEBUG] 📨 SENDING TELEGRAM NOTIFICATION...")
-                                    await tg_message_async(
-                                        sale_data[0],
-                                        sale_data[3] if len(sale_data) > 3 else None,
-                                        nft_address,
-                                        sale_data[5] if len(sale_data) > 5 else None,
-                                        nft_data[2],
-                                        sale_data[6] if len(sale_data) > 6 else 0,
-                                        nft_data[3] if len(nft_data) > 3 else "Unknown NFT",
-                                        nft_data[4] if len(nft_data) > 4 else "",
-                                        floor_price,
-                                        floor_link
-                                    )
-                                    print(f"[DEBUG] ✅✅✅ NOTIFICATION SENT SUCCESSFULLY!")
-                                    utimes.append(tx_time)
-                                    processed_count += 1
-                                    
-                                except Exception as e:
-                                    print(f"[DEBUG] ❌❌❌ NOTIFICATION FAILED: {e}")
-                                    import traceback
-                                    traceback.print_exc()
-                            else:
-                                print(f"[DEBUG] ⚠️ Collection NOT monitored: {collection_address[-12:] if collection_address else 'None'}")
-                                print(f"[DEBUG]    Monitored collections: {[c[-12:] for c in collections_list]}")
+                            # 🟢 4. RECORD SALE (ledger locale, indipendente dalla notifica)
+                            sale_records.append(sale_record(tx, sale, nft_address, nft_info, royalty_address))
+                            
+                            # 🟢 5-7. ALERT PER LE CHAT ISCRITTE ALLA COLLEZIONE
+                            outcome = await dispatch_sale(tx, sale, nft_address, nft_info, deliver)
+                            if outcome in CHECKPOINT_OUTCOMES:
+                                utimes.append(tx_time)
+                            if outcome == 'queued':
+                                processed_count += 1
                         else:
                             print(f"[DEBUG] ❌ Failed to get NFT data")
-                            if not nft_data:
-                                print(f"[DEBUG]    nft_data is None")
+                            if not nft_info:
+                                print(f"[DEBUG]    nft_info is None (provider error, will retry)")
+                                failed.append(tx)
                             else:
-                                if not nft_data[0]:
+                                if not nft_info.initialized:
                                     print(f"[DEBUG]    init flag is False")
-                                if not nft_data[1]:
+                                if not nft_info.collection:
                                     print(f"[DEBUG]    collection address is missing")
                     else:
                         print(f"[DEBUG] ❌ No NFT address available - skipping transaction")
@@ -830,16 +925,24 @@ async def royalty_trs(royalty_address: str):
             else:
                 print(f"[DEBUG] ⏭️ Not a sale contract (get_sale_data returned None)")
         
+        flush_sale_records(sale_records)
+        
         # 🟢 FINAL REPORT
         print(f"\n[DEBUG] 🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴")
         print(f"[DEBUG] 🔴 CYCLE COMPLETE - {time.strftime('%H:%M:%S')}")
         print(f"[DEBUG] 🔴 Processed: {processed_count}")
         print(f"[DEBUG] 🔴 Utimes: {utimes}")
+        print(f"[DEBUG] 🔴 Unresolved: {len(failed)}")
         print(f"[DEBUG] 🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴🔴\n")
+        if unresolved is not None:
+            unresolved.extend(failed)
         
         if utimes:
             new_utime = max(utimes)
-            write_last_utime(new_utime)
+            if failed:
+                # Non oltre la prima tx da ritentare (quelle dello stesso secondo vengono riesaminate)
+                new_utime = min(new_utime, min(tx.get('now', 0) for tx in failed))
+            write_last_utime(new_utime, royalty_address)
             print(f"[DEBUG] 💾 Saved lastUtime: {new_utime} ({time.ctime(new_utime)})")
             return new_utime
         
@@ -849,6 +952,10 @@ async def royalty_trs(royalty_address: str):
         print(f"[royalty_trs] ❌ CRITICAL ERROR: {e}")
         import traceback
         traceback.print_exc()
+        flush_sale_records(sale_records)
+        if unresolved is not None:
+            # Ciclo interrotto: tutte le tx vanno ritentate (i doppioni li ferma l'alert ledger)
+            unresolved.extend(transactions or [])
         return None
         
 async def test_direct_api_call(address: str):
@@ -863,80 +970,111 @@ async def test_direct_api_call(address: str):
             "sort": "desc"
         }
         
-        async with aiohttp.ClientSession(timeout=HTTP_TIMEOUT) as session:
-            async with session.get(test_url, headers=TONCENTER_HEADERS, params=params) as response:
-                print(f"[DIRECT TEST] Status: {response.status}")
+        session = get_session()
+        async with session.get(test_url, headers=TONCENTER_HEADERS, params=params) as response:
+            print(f"[DIRECT TEST] Status: {response.status}")
+            
+            if response.status == 200:
+                data = await response.json()
+                print(f"[DIRECT TEST] Response keys: {list(data.keys())}")
                 
-                if response.status == 200:
-                    data = await response.json()
-                    print(f"[DIRECT TEST] Response keys: {list(data.keys())}")
-                    
-                    # CERCA TRANSAZIONI IN VARI PUNTI
-                    txs = []
-                    
-                    # Caso 1: direttamente in "transactions"
-                    if "transactions" in data:
-                        txs = data["transactions"]
-                        print(f"[DIRECT TEST] Found {len(txs)} transactions in 'transactions' key")
-                    
-                    # Caso 2: in "result" -> "transactions"
-                    elif "result" in data and isinstance(data["result"], dict):
-                        if "transactions" in data["result"]:
-                            txs = data["result"]["transactions"]
-                            print(f"[DIRECT TEST] Found {len(txs)} transactions in 'result.transactions'")
+                # CERCA TRANSAZIONI IN VARI PUNTI
+                txs = []
+                
+                # Caso 1: direttamente in "transactions"
+                if "transactions" in data:
+                    txs = data["transactions"]
+                    print(f"[DIRECT TEST] Found {len(txs)} transactions in 'transactions' key")
+                
+                # Caso 2: in "result" -> "transactions"
+                elif "result" in data and isinstance(data["result"], dict):
+                    if "transactions" in data["result"]:
+                        txs = data["result"]["transactions"]
+                        print(f"[DIRECT TEST] Found {len(txs)} transactions in 'result.transactions'")
+                
+                print(f"[DIRECT TEST] Total transactions found: {len(txs)}")
+                
+                if txs:
+                    print(f"[DIRECT TEST] Sample transaction structure:")
                     
-                    print(f"[DIRECT TEST] Total transactions found: {len(txs)}")
+                    # VERIFICA IL TIPO DELLA PRIMA TRANSAZIONE
+                    first_tx = txs[0]
+                    print(f"  Type of first TX: {type(first_tx)}")
                     
-                    if txs:
-                        print(f"[DIRECT TEST] Sample transaction structure:")
+                    if isinstance(first_tx, dict):
+                        print(f"  Keys in first TX: {list(first_tx.keys())}")
                         
-                        # VERIFICA IL TIPO DELLA PRIMA TRANSAZIONE
-                        first_tx = txs[0]
-                        print(f"  Type of first TX: {type(first_tx)}")
+                        # Stampa sicura dei valori (usa get solo se è dict)
+                        safe_get = lambda obj, key: obj.get(key, 'N/A') if isinstance(obj, dict) else f'Not a dict: {type(obj)}'
                         
-                        if isinstance(first_tx, dict):
-                            print(f"  Keys in first TX: {list(first_tx.keys())}")
-                            
-                            # Stampa sicura dei valori (usa get solo se è dict)
-                            safe_get = lambda obj, key: obj.get(key, 'N/A') if isinstance(obj, dict) else f'Not a dict: {type(obj)}'
-                            
-                            print(f"  Hash: {safe_get(first_tx, 'hash')[:15]}...")
-                            print(f"  Time (now): {safe_get(first_tx, 'now')}")
-                            
-                            # Gestione sicura dell'account
-                            account_data = safe_get(first_tx, 'account')
-                            if isinstance(account_data, dict):
-                                print(f"  Account address: {account_data.get('address', 'N/A')[-10:]}")
-                            else:
-                                print(f"  Account: {account_data}")
+                        print(f"  Hash: {safe_get(first_tx, 'hash')[:15]}...")
+                        print(f"  Time (now): {safe_get(first_tx, 'now')}")
                         
-                        elif isinstance(first_tx, list):
-                            print(f"  First TX is a list with {len(first_tx)} items")
-                            for i, item in enumerate(first_tx[:3]):
-                                print(f"    [{i}]: type={type(item)}, value={str(item)[:50]}")
-                        
-                        elif isinstance(first_tx, str):
-                            print(f"  First TX is a string: {first_tx[:100]}")
+                        # Gestione sicura dell'account
+                        account_data = safe_get(first_tx, 'account')
+                        if isinstance(account_data, dict):
+                            print(f"  Account address: {account_data.get('address', 'N/A')[-10:]}")
+                        else:
+                            print(f"  Account: {account_data}")
                     
-                    else:
-                        print(f"[DIRECT TEST] API returned success but empty transactions array")
-                        print(f"[DIRECT TEST] Full response structure:")
-                        print(json.dumps(data, indent=2)[:1000])
-                        
-                        # Stampa altri campi utili
-                        if "total" in data:
-                            print(f"[DIRECT TEST] Total count in response: {data['total']}")
+                    elif isinstance(first_tx, list):
+                        print(f"  First TX is a list with {len(first_tx)} items")
+                        for i, item in enumerate(first_tx[:3]):
+                            print(f"    [{i}]: type={type(item)}, value={str(item)[:50]}")
+                    
+                    elif isinstance(first_tx, str):
+                        print(f"  First TX is a string: {first_tx[:100]}")
                 
                 else:
-                    error_text = await response.text()
-                    print(f"[DIRECT TEST] Error: {error_text[:200]}")
+                    print(f"[DIRECT TEST] API returned success but empty transactions array")
+                    print(f"[DIRECT TEST] Full response structure:")
+                    print(json.dumps(data, indent=2)[:1000])
+                    
+                    # Stampa altri campi utili
+                    if "total" in data:
+                        print(f"[DIRECT TEST] Total count in response: {data['total']}")
+            
+            else:
+                error_text = await response.text()
+                print(f"[DIRECT TEST] Error: {error_text[:200]}")
     
     except Exception as e:
         print(f"[DIRECT TEST] Exception: {e}")
         traceback.print_exc()
 
+_started = False
+
+def startup():
+    """Inizializzazione esplicita (una volta, dagli entry point): controlli di configurazione e riepilogo"""
+    global _started
+    if _started:
+        return
+    _started = True
+    from secretData import validate_secrets
+    validate_secrets()
+    watch_list.load()
+    collections = subscription_registry.collections()
+    total = sum(len(subscription_registry.subscriptions_for(c)) for c in collections)
+    print(f"[subscriptions] ✅ {total} subscriptions on {len(collections)} collections", flush=True)
+    sales_analytics.rebuild()
+    print(f"[MAIN] API: {TONCENTER_API_V3} (key: {'yes' if toncenter_api_key else 'no, rate limited'})", flush=True)
+
+def start_background_services():
+    """Task di background condivisi da tutti gli entry point (idempotente)"""
+    # TON/USD quotazione e floor delle collezioni aggiornati in background
+    price_oracle.start()
+    floor_service.start()
+    # Sender Telegram: gli alert vengono solo accodati dal ciclo di rilevamento
+    start_outbox()
+    # Ricarica a caldo di watchlist.json / .toml
+    watch_list.start()
+
 async def scheduler():
     """Main bot loop - UPDATED LOG MESSAGES"""
+    startup()
+    await wait_for_leadership()
+    start_background_services()
+    
     print("\n" + "=" * 60, flush=True)
     print("=== [SCHEDULER] Started (TON Center API v3 - Consistent) ===", flush=True)
     print(f"✅ API Version: v3 ({TONCENTER_API_V3})", flush=True)
@@ -944,6 +1082,21 @@ async def scheduler():
     print("✅ Telegram commands enabled", flush=True)
     print("=" * 60 + "\n", flush=True)
     
+    if INGESTION_MODE == 'collections':
+        await collection_scheduler()
+        return
+    if INGESTION_MODE == 'blocks':
+        await block_scheduler()
+        return
+    
+    if SHARD_WORKERS > 1:
+        # Polling nei processi worker, qui solo consegna degli alert (notifier)
+        from shards import ShardSupervisor
+        print(f"[SCHEDULER] Sharded mode: {SHARD_WORKERS} worker processes", flush=True)
+        await ShardSupervisor(SHARD_WORKERS).run(deliver_alert, retry_pending_alerts)
+        return
+    
+    watch_list.on_change(start_new_checkpoints)
     cycle_count = 0
     
     try:
@@ -954,8 +1107,12 @@ async def scheduler():
                 print(f"\n[CYCLE #{cycle_count}] Start at {time.strftime('%H:%M:%S')}", flush=True)
                 print(f"[CYCLE #{cycle_count}] Using TON Center API v3", flush=True)
                 
+                # Alert rimasti in sospeso (anche da un'esecuzione precedente)
+                await retry_pending_alerts()
+                
                 results = []
-                for addr in royalty_addresses:
+                # Snapshot della watch list: una ricarica durante il ciclo vale dal ciclo successivo
+                for addr in watch_list.royalty_addresses:
                     print(f"[CYCLE #{cycle_count}] Processing address: {addr[-8:]}", flush=True)
                     result = await royalty_trs(addr)
                     if result:
@@ -986,6 +1143,50 @@ async def scheduler():
         print(f"[SCHEDULER] Fatal error: {e}", flush=True)
         traceback.print_exc()
 
+async def collection_scheduler():
+    """Ciclo del modo INGESTION_MODE=collections: un feed per collezione monitorata (collectionFeed.py)"""
+    from collectionFeed import collection_trs, start_collection_checkpoints
+    print(f"[SCHEDULER] Collection feed mode: {len(subscription_registry.collections())} collections", flush=True)
+    watch_list.on_change(start_collection_checkpoints)
+    cycle_count = 0
+    
+    while True:
+        cycle_count += 1
+        try:
+            print(f"\n[CYCLE #{cycle_count}] Start at {time.strftime('%H:%M:%S')} (collection feeds)", flush=True)
+            await retry_pending_alerts()
+            # Collezioni di 'collections' e di 'subscriptions' (copia: una ricarica vale dal ciclo successivo)
+            for collection in subscription_registry.collections():
+                await collection_trs(collection)
+            print(f"[CYCLE #{cycle_count}] Finished. Sleeping 180s (3min)...", flush=True)
+            await asyncio.sleep(180)
+        except Exception as cycle_error:
+            print(f"[CYCLE #{cycle_count}] ❌ Error in cycle: {cycle_error}", flush=True)
+            traceback.print_exc()
+            await asyncio.sleep(5)
+
+async def block_scheduler():
+    """Ciclo del modo INGESTION_MODE=blocks: segue la masterchain blocco per blocco (blockFollower.py)"""
+    from blockFollower import block_follower
+    from config import BLOCKS_POLL_INTERVAL
+    print(f"[SCHEDULER] Block follower mode: {len(watch_list.royalty_addresses)} royalty addresses", flush=True)
+    last_retry = 0.0
+    
+    while True:
+        try:
+            if time.time() - last_retry >= 60:
+                last_retry = time.time()
+                await retry_pending_alerts()
+            read = await block_follower.step()
+        except Exception as e:
+            print(f"[blocks] ❌ Error in step: {e}", flush=True)
+            traceback.print_exc()
+            await asyncio.sleep(5)
+            continue
+        # In ritardo: si continua subito, altrimenti (o se il blocco non è leggibile) si aspetta
+        if not read or block_follower.lag == 0:
+            await asyncio.sleep(BLOCKS_POLL_INTERVAL)
+
 async def main():
     """Main async entry point"""
     print("\n[MAIN] TON NFT Bot starting (TON Center API v3)...", flush=True)
@@ -998,9 +1199,10 @@ async def main():
         print("[MAIN] ⚠️ Telegram bot token not configured, commands disabled", flush=True)
     
     try:
+        from web_server import run_in_background, start_self_pinger
         run_in_background()
+        start_self_pinger()
         print("[MAIN] ✅ Web server started", flush=True)
-        await asyncio.sleep(2)
     except Exception as e:
         print(f"[MAIN] ⚠️ Web server failed: {e}", flush=True)
     
@@ -0,0 +1,284 @@
+# mediaCache.py - Immagini degli alert: prefetch + resize in background e cache dei file_id di Telegram
+#
+#   python mediaCache.py     -> stato della cache (immagini pronte, caricate, fallite)
+#
+# Quando una vendita di una collezione monitorata è risolta, la preview viene scaricata subito
+# (timeout MEDIA_FETCH_TIMEOUT), ridimensionata a MEDIA_MAX_SIDE px se Pillow è installato e salvata
+# in MEDIA_DIR. Il sender dell'outbox carica il file invece di passare l'URL (Telegram non deve più
+# scaricare da IPFS o dal CDN) e registra il file_id restituito: gli invii successivi della stessa
+# immagine, anche ad altre chat, riusano il file_id senza upload. Un'immagine non scaricabile manda
+# l'alert solo testo subito, invece di aspettare che Telegram la rifiuti.
+import asyncio
+import hashlib
+import io
+import os
+import sqlite3
+import time
+from typing import Dict, Optional
+
+import aiohttp
+
+import metrics
+from httpPool import get_session
+from config import MEDIA_DB, MEDIA_DIR, MEDIA_FETCH_TIMEOUT, MEDIA_WAIT, MEDIA_MAX_BYTES, MEDIA_MAX_SIDE
+from config import MEDIA_CONCURRENCY, MEDIA_KEEP, MEDIA_RETRY_AFTER, MEDIA_IPFS_GATEWAY
+
+READY = 'ready'         # scaricata, file locale in attesa del primo upload
+UPLOADED = 'uploaded'   # file_id noto, file locale eliminato
+FAILED = 'failed'       # non scaricabile o non un'immagine: alert solo testo
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    url TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    path TEXT,
+    size INTEGER,
+    file_id TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL
+);
+"""
+
+PRUNE_INTERVAL = 3600
+
+
+class MediaError(Exception):
+    """Immagine non utilizzabile (HTTP, tipo, dimensione)"""
+
+
+def fetch_url(url: str) -> str:
+    """URL scaricabile via HTTP (ipfs:// passa dal gateway)"""
+    if url.startswith('ipfs://'):
+        return MEDIA_IPFS_GATEWAY + url[len('ipfs://'):].lstrip('/').removeprefix('ipfs/')
+    return url
+
+
+def shrink(data: bytes) -> bytes:
+    """JPEG di max MEDIA_MAX_SIDE px per lato (Pillow opzionale: senza, l'immagine resta com'è)"""
+    try:
+        from PIL import Image
+    except ImportError:
+        if len(data) > MEDIA_MAX_BYTES:
+            raise MediaError(f"{len(data)} bytes, too large without Pillow")
+        return data
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if (image.format in ('JPEG', 'PNG') and max(image.size) <= MEDIA_MAX_SIDE
+                    and len(data) <= MEDIA_MAX_BYTES):
+                return data
+            image.seek(0)   # GIF / WebP animate: primo frame
+            picture = image.convert('RGB')
+        picture.thumbnail((MEDIA_MAX_SIDE, MEDIA_MAX_SIDE))
+        output = io.BytesIO()
+        picture.save(output, 'JPEG', quality=85, optimize=True)
+        return output.getvalue()
+    except MediaError:
+        raise
+    except Exception as e:
+        raise MediaError(f"not a valid image: {e}")
+
+
+class MediaCache:
+    """Stato delle preview per URL (SQLite, condiviso tra i processi degli shard) + download in corso"""
+
+    def __init__(self, db_path: str = MEDIA_DB, media_dir: str = MEDIA_DIR):
+        self.db_path = db_path
+        self.media_dir = media_dir
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._lock_users: Dict[str, int] = {}   # chi ha chiamato lock(url) e non ancora release_lock(url)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._last_prune = 0.0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            self._conn.commit()
+        return self._conn
+
+    def _row(self, url: str) -> Optional[tuple]:
+        return self._db().execute("SELECT state, path, file_id, updated_at FROM media WHERE url = ?",
+                                  (url,)).fetchone()
+
+    def _set(self, url: str, state: str, path: str = None, size: int = None,
+             file_id: str = None, error: str = None):
+        db = self._db()
+        with db:
+            db.execute("INSERT OR REPLACE INTO media (url, state, path, size, file_id, error, updated_at) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (url, state, path, size, file_id, error[:300] if error else None, time.time()))
+
+    # --- prefetch ---
+
+    def prefetch(self, url: str) -> Optional[asyncio.Task]:
+        """Scarica la preview in background (idempotente); niente se già pronta, caricata o fallita di recente"""
+        if not url:
+            return None
+        task = self._pending.get(url)
+        if task is not None:
+            return task
+        row = self._row(url)
+        if row is not None and (row[0] in (READY, UPLOADED) or time.time() - row[3] < MEDIA_RETRY_AFTER):
+            return None
+        task = self._pending[url] = asyncio.get_running_loop().create_task(self._fetch(url))
+        task.add_done_callback(lambda _: self._pending.pop(url, None))
+        if time.time() - self._last_prune > PRUNE_INTERVAL:
+            self.prune()
+        return task
+
+    async def _fetch(self, url: str) -> bool:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(MEDIA_CONCURRENCY)
+        started = time.time()
+        try:
+            async with self._semaphore:
+                session = get_session()
+                timeout = aiohttp.ClientTimeout(total=MEDIA_FETCH_TIMEOUT)
+                async with session.get(fetch_url(url), timeout=timeout) as response:
+                    if response.status != 200:
+                        raise MediaError(f"HTTP {response.status}")
+                    content_type = response.headers.get('Content-Type', '')
+                    if content_type and not content_type.startswith(('image/', 'application/octet-stream')):
+                        raise MediaError(f"content type {content_type}")
+                    length = int(response.headers.get('Content-Length') or 0)
+                    if length > 4 * MEDIA_MAX_BYTES:
+                        raise MediaError(f"{length} bytes")
+                    data = await response.read()
+            data = await asyncio.to_thread(shrink, data)
+            path = os.path.join(self.media_dir, hashlib.sha1(url.encode()).hexdigest() + '.img')
+            await asyncio.to_thread(self._write, path, data)
+        except asyncio.CancelledError:
+            raise
+        except (MediaError, aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError) as e:
+            error = str(e) or type(e).__name__
+            self._set(url, FAILED, error=error)
+            metrics.inc('media.prefetch_failed')
+            print(f"[media] ⚠️ Prefetch failed for {url[-40:]}: {error}", flush=True)
+            return False
+        self._set(url, READY, path=path, size=len(data))
+        metrics.inc('media.prefetch_ok')
+        metrics.observe('media.fetch_latency', time.time() - started)
+        return True
+
+    def _write(self, path: str, data: bytes):
+        os.makedirs(self.media_dir, exist_ok=True)
+        temp = path + '.tmp'
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.replace(temp, path)
+
+    # --- invio ---
+
+    def file_id(self, url: str) -> Optional[str]:
+        row = self._row(url)
+        if row is not None and row[2]:
+            metrics.inc('media.file_id_hits')
+            return row[2]
+        return None
+
+    async def photo(self, url: str):
+        """
+        Cosa passare a send_photo: file_id, bytes del file scaricato, l'URL (download ancora in corso
+        dopo MEDIA_WAIT secondi: ci prova Telegram) o None (immagine non utilizzabile: solo testo).
+        """
+        row = self._row(url)
+        if row is None or (row[0] == FAILED and time.time() - row[3] >= MEDIA_RETRY_AFTER):
+            task = self.prefetch(url)
+        else:
+            task = self._pending.get(url)
+        if task is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(task), timeout=MEDIA_WAIT)
+            except asyncio.TimeoutError:
+                metrics.inc('media.wait_timeouts')
+                return url
+            row = self._row(url)
+
+        if row is None:
+            return url
+        state, path, file_id, _ = row
+        if file_id:
+            return file_id
+        if state == FAILED:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            # File rimosso (prune / altro nodo): Telegram scarica dall'URL
+            return url
+
+    def lock(self, url: str) -> asyncio.Lock:
+        """Un solo upload per immagine: le altre chat aspettano e riusano il file_id (poi release_lock)"""
+        lock = self._locks.get(url)
+        if lock is None:
+            lock = self._locks[url] = asyncio.Lock()
+        self._lock_users[url] = self._lock_users.get(url, 0) + 1
+        return lock
+
+    def release_lock(self, url: str):
+        # Il lock sparisce solo quando nessuno lo tiene né lo aspetta: un nuovo arrivato non ne crea un secondo
+        users = self._lock_users.get(url, 0) - 1
+        if users > 0:
+            self._lock_users[url] = users
+        else:
+            self._lock_users.pop(url, None)
+            self._locks.pop(url, None)
+
+    def remember(self, url: str, message) -> Optional[str]:
+        """Registra il file_id del messaggio inviato (foto più grande) ed elimina il file locale"""
+        sizes = getattr(message, 'photo', None)
+        if not sizes:
+            return None
+        file_id = sizes[-1].file_id
+        row = self._row(url)
+        if row is not None and row[1]:
+            try:
+                os.remove(row[1])
+            except OSError:
+                pass
+        self._set(url, UPLOADED, file_id=file_id)
+        metrics.inc('media.uploads')
+        return file_id
+
+    def forget(self, url: str):
+        """file_id rifiutato da Telegram: al prossimo invio si riparte dal download"""
+        db = self._db()
+        with db:
+            db.execute("DELETE FROM media WHERE url = ?", (url,))
+        metrics.inc('media.file_id_rejected')
+
+    # --- manutenzione ---
+
+    def prune(self):
+        """Elimina file e righe non caricati più vecchi di MEDIA_KEEP (i file_id restano)"""
+        self._last_prune = time.time()
+        db = self._db()
+        cutoff = time.time() - MEDIA_KEEP
+        rows = db.execute("SELECT url, path FROM media WHERE state != ? AND updated_at < ?",
+                          (UPLOADED, cutoff)).fetchall()
+        for url, path in rows:
+            if path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        with db:
+            db.execute("DELETE FROM media WHERE state != ? AND updated_at < ?", (UPLOADED, cutoff))
+        return len(rows)
+
+    def counts(self) -> dict:
+        return dict(self._db().execute("SELECT state, COUNT(*) FROM media GROUP BY state").fetchall())
+
+
+# Global instance (il file SQLite viene aperto al primo utilizzo)
+media_cache = MediaCache()
+
+
+if __name__ == '__main__':
+    counts = media_cache.counts()
+    print(f"{counts.get(UPLOADED, 0)} file_id cached, {counts.get(READY, 0)} images ready, "
+          f"{counts.get(FAILED, 0)} failed")
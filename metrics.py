@@ -0,0 +1,78 @@
+# metrics.py - In-process metrics (counters, gauges, timings) shown by web_server
+import threading
+import time
+from collections import deque
+
+TIMING_WINDOW = 512  # campioni recenti tenuti per ogni timing
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_timings = {}
+
+
+def inc(name: str, value: int = 1):
+    """Incrementa un contatore"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value):
+    """Imposta un valore istantaneo (numero o stringa)"""
+    with _lock:
+        _gauges[name] = value
+
+
+def get_gauge(name: str, default=None):
+    with _lock:
+        return _gauges.get(name, default)
+
+
+def get_counter(name: str) -> int:
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def observe(name: str, seconds: float):
+    """Registra una durata (secondi)"""
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None:
+            timing = {'count': 0, 'sum': 0.0, 'max': 0.0, 'last': 0.0,
+                      'samples': deque(maxlen=TIMING_WINDOW)}
+            _timings[name] = timing
+        timing['count'] += 1
+        timing['sum'] += seconds
+        timing['last'] = seconds
+        if seconds > timing['max']:
+            timing['max'] = seconds
+        timing['samples'].append(seconds)
+
+
+def _percentile(sorted_samples: list, pct: float) -> float:
+    if not sorted_samples:
+        return 0.0
+    idx = min(len(sorted_samples) - 1, int(round(pct / 100 * (len(sorted_samples) - 1))))
+    return sorted_samples[idx]
+
+
+def snapshot() -> dict:
+    """Copia coerente di tutte le metriche (per /metrics e /status)"""
+    with _lock:
+        timings = {}
+        for name, timing in _timings.items():
+            samples = sorted(timing['samples'])
+            timings[name] = {
+                'count': timing['count'],
+                'avg': round(timing['sum'] / timing['count'], 6) if timing['count'] else 0.0,
+                'p50': round(_percentile(samples, 50), 6),
+                'p95': round(_percentile(samples, 95), 6),
+                'max': round(timing['max'], 6),
+                'last': round(timing['last'], 6),
+            }
+        return {
+            'time': time.time(),
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+            'timings': timings,
+        }
@@ -0,0 +1,127 @@
+# nftCache.py - Cache a due livelli dei metadati NFT (LRU in memoria + SQLite su disco)
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import metrics
+from config import NFT_CACHE_DB, NFT_CACHE_MEMORY_SIZE, NFT_OWNER_TTL
+from functions import normalize_address
+
+# name, image e collection non cambiano mai per un item: restano in cache per sempre.
+# owner invece cambia a ogni vendita: vale solo NFT_OWNER_TTL secondi (o arriva dalla vendita stessa).
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nft_metadata (
+    address TEXT PRIMARY KEY,
+    collection TEXT NOT NULL,
+    name TEXT NOT NULL,
+    image TEXT NOT NULL,
+    owner TEXT,
+    owner_updated_at REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+)
+"""
+
+
+class NftMetadataCache:
+    """LRU in memoria davanti a una tabella SQLite, chiave = indirizzo NFT canonico"""
+
+    def __init__(self, db_path: str = NFT_CACHE_DB, memory_size: int = NFT_CACHE_MEMORY_SIZE,
+                 owner_ttl: float = NFT_OWNER_TTL):
+        self.db_path = db_path
+        self.memory_size = memory_size
+        self.owner_ttl = owner_ttl
+        self._memory: "OrderedDict[str, dict]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(SCHEMA)
+            self._conn.commit()
+        return self._conn
+
+    def _remember(self, key: str, entry: dict):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get(self, nft_address: str) -> Optional[dict]:
+        """Voce in cache (memoria, poi disco) o None"""
+        key = normalize_address(nft_address)
+        if key is None:
+            return None
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                metrics.inc('nft_cache.memory_hit')
+                return entry
+
+            row = self._db().execute(
+                "SELECT collection, name, image, owner, owner_updated_at FROM nft_metadata WHERE address = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                metrics.inc('nft_cache.miss')
+                return None
+
+            entry = {'collection': row[0], 'name': row[1], 'image': row[2],
+                     'owner': row[3], 'owner_updated_at': row[4]}
+            self._remember(key, entry)
+            metrics.inc('nft_cache.disk_hit')
+            return entry
+
+    def put(self, nft_address: str, collection: str, name: str, image: str, owner: Optional[str]):
+        key = normalize_address(nft_address)
+        if key is None or not collection:
+            return
+        now = time.time()
+        entry = {'collection': collection, 'name': name, 'image': image or '',
+                 'owner': owner, 'owner_updated_at': now if owner else 0}
+        with self._lock:
+            self._remember(key, entry)
+            db = self._db()
+            db.execute(
+                "INSERT INTO nft_metadata (address, collection, name, image, owner, owner_updated_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(address) DO UPDATE SET owner = excluded.owner, owner_updated_at = excluded.owner_updated_at",
+                (key, collection, name, entry['image'], owner, entry['owner_updated_at'], now)
+            )
+            db.commit()
+
+    def set_owner(self, nft_address: str, owner: str):
+        """Aggiorna solo l'owner (es. buyer noto dalla vendita)"""
+        key = normalize_address(nft_address)
+        if key is None or not owner:
+            return
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                entry['owner'] = owner
+                entry['owner_updated_at'] = now
+            db = self._db()
+            db.execute("UPDATE nft_metadata SET owner = ?, owner_updated_at = ? WHERE address = ?",
+                       (owner, now, key))
+            db.commit()
+
+    def owner_is_fresh(self, entry: dict) -> bool:
+        return bool(entry.get('owner')) and time.time() - entry.get('owner_updated_at', 0) <= self.owner_ttl
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# Global instance (il file SQLite viene aperto al primo utilizzo)
+nft_cache = NftMetadataCache()
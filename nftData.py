@@ -3,9 +3,18 @@ import aiohttp
 import asyncio
 import json
 import re
-from typing import Optional, Tuple
+import time
+import traceback
+from typing import Optional, Tuple, Dict
+import metrics
+from httpPool import get_session
 from config import getgems_api_url, getgems_query
+from config import FLOOR_REFRESH_INTERVAL, FLOOR_MAX_AGE, FLOOR_SALE_REFRESH_DELAY
 from secretData import toncenter_api_key
+from nftCache import nft_cache
+from saleRecords import NftInfo
+from subscriptions import subscription_registry
+from salesAnalytics import sales_analytics
 
 # TON Center API configuration - CONSISTENTE CON main.py
 TONCENTER_API = "https://toncenter.com/api/v3"
@@ -16,60 +25,90 @@ TONCENTER_HEADERS = {
 if toncenter_api_key:
     TONCENTER_HEADERS["X-API-Key"] = toncenter_api_key
 
-async def get_nft_data(nft_address: str) -> Optional[tuple]:
-    """Get NFT data using TON Center API v3 (async) - PRIMA PRIORITÀ"""
+async def get_nft_data(nft_address: str, owner: Optional[str] = None) -> Optional[NftInfo]:
+    """
+    Get NFT data (NftInfo: initialized, collection, owner, name, image) - prima dalla cache metadati.
+    Se l'owner è già noto (es. buyer dalla vendita) un item in cache non costa nessuna chiamata.
+    """
+    cached = nft_cache.get(nft_address)
+    if cached is not None:
+        if owner:
+            nft_cache.set_owner(nft_address, owner)
+            print(f"[nftData] ✅ Cache hit for {nft_address[-8:]} (owner from sale)")
+            return NftInfo(True, cached['collection'], owner, cached['name'], cached['image'])
+        if nft_cache.owner_is_fresh(cached):
+            print(f"[nftData] ✅ Cache hit for {nft_address[-8:]}")
+            return NftInfo(True, cached['collection'], cached['owner'], cached['name'], cached['image'])
+        print(f"[nftData] Cache hit for {nft_address[-8:]} but owner expired, refreshing")
+    
+    nft_data = await fetch_nft_data(nft_address)
+    if not nft_data:
+        return None
+    nft_info = NftInfo(*nft_data[:5])
+    
+    if nft_info.ok:
+        # Il nome segnaposto indica metadati non disponibili: non salvarlo per sempre
+        if nft_info.name and nft_info.name != f"NFT {nft_address[-8:]}":
+            nft_cache.put(nft_address, nft_info.collection, nft_info.name, nft_info.image or '', owner or nft_info.owner)
+        if owner:
+            nft_info = nft_info.with_owner(owner)
+    
+    return nft_info
+
+async def fetch_nft_data(nft_address: str) -> Optional[tuple]:
+    """Get NFT data using TON Center API v3 (async) - PRIMA PRIORITÀ (sempre dalla rete)"""
     try:
         print(f"[nftData] Fetching NFT data for {nft_address[-8:]}")
         
-        async with aiohttp.ClientSession() as session:
-            # METHOD 1: Usa l'endpoint dedicato /nft/getItems (API v3)
-            url = f"{TONCENTER_API}/nft/getItems"
-            
-            # ✅ FORMATO CORRETTO per API v3
-            payload = {
-                "addresses": [nft_address]
-            }
+        session = get_session()
+        # METHOD 1: Usa l'endpoint dedicato /nft/getItems (API v3)
+        url = f"{TONCENTER_API}/nft/getItems"
+        
+        # ✅ FORMATO CORRETTO per API v3
+        payload = {
+            "addresses": [nft_address]
+        }
+        
+        print(f"[nftData] Calling /nft/getItems for {nft_address[-8:]}")
+        
+        async with session.post(url, headers=TONCENTER_HEADERS, 
+                              json=payload, timeout=15) as response:
             
-            print(f"[nftData] Calling /nft/getItems for {nft_address[-8:]}")
+            status = response.status
+            print(f"[nftData] /nft/getItems status: {status}")
             
-            async with session.post(url, headers=TONCENTER_HEADERS, 
-                                  json=payload, timeout=15) as response:
-                
-                status = response.status
-                print(f"[nftData] /nft/getItems status: {status}")
+            if status == 200:
+                data = await response.json()
+                print(f"[nftData] Response keys: {list(data.keys())}")
                 
-                if status == 200:
-                    data = await response.json()
-                    print(f"[nftData] Response keys: {list(data.keys())}")
+                if data.get('nft_items') and len(data['nft_items']) > 0:
+                    nft_item = data['nft_items'][0]
                     
-                    if data.get('nft_items') and len(data['nft_items']) > 0:
-                        nft_item = data['nft_items'][0]
-                        
-                        # Estrai dati correttamente
-                        collection_address = nft_item.get('collection', {}).get('address', '')
-                        owner_address = nft_item.get('owner', {}).get('address', '')
-                        nft_name = nft_item.get('metadata', {}).get('name', f'NFT {nft_address[-8:]}')
-                        
-                        # Get image from previews (API v3 format)
-                        nft_image = ''
-                        previews = nft_item.get('previews', [])
-                        if previews:
-                            # Prendi l'immagine più grande disponibile
-                            nft_image = previews[-1].get('url', '')
-                        
-                        print(f"[nftData] ✅ Got NFT data via /nft/getItems:")
-                        print(f"  Name: {nft_name}")
-                        print(f"  Collection: {collection_address[-8:] if collection_address else 'None'}")
-                        print(f"  Owner: {owner_address[-8:] if owner_address else 'None'}")
-                        print(f"  Has image: {'Yes' if nft_image else 'No'}")
-                        
-                        return (True, collection_address, owner_address, 
-                                nft_name, nft_image)
-                    else:
-                        print(f"[nftData] ⚠️ No nft_items in response")
+                    # Estrai dati correttamente
+                    collection_address = nft_item.get('collection', {}).get('address', '')
+                    owner_address = nft_item.get('owner', {}).get('address', '')
+                    nft_name = nft_item.get('metadata', {}).get('name', f'NFT {nft_address[-8:]}')
+                    
+                    # Get image from previews (API v3 format)
+                    nft_image = ''
+                    previews = nft_item.get('previews', [])
+                    if previews:
+                        # Prendi l'immagine più grande disponibile
+                        nft_image = previews[-1].get('url', '')
+                    
+                    print(f"[nftData] ✅ Got NFT data via /nft/getItems:")
+                    print(f"  Name: {nft_name}")
+                    print(f"  Collection: {collection_address[-8:] if collection_address else 'None'}")
+                    print(f"  Owner: {owner_address[-8:] if owner_address else 'None'}")
+                    print(f"  Has image: {'Yes' if nft_image else 'No'}")
+                    
+                    return (True, collection_address, owner_address, 
+                            nft_name, nft_image)
                 else:
-                    error_text = await response.text()
-                    print(f"[nftData] ❌ /nft/getItems error: {error_text[:200]}")
+                    print(f"[nftData] ⚠️ No nft_items in response")
+            else:
+                error_text = await response.text()
+                print(f"[nftData] ❌ /nft/getItems error: {error_text[:200]}")
         
         # METHOD 2: Fallback to runGetMethod
         print(f"[nftData] Falling back to runGetMethod for {nft_address[-8:]}")
@@ -85,107 +124,107 @@ async def get_nft_data_via_getmethod(nft_address: str) -> Optional[tuple]:
     try:
         print(f"[nftData] Trying runGetMethod for {nft_address[-8:]}")
         
-        async with aiohttp.ClientSession() as session:
-            url = f"{TONCENTER_API}/runGetMethod"
-            payload = {
-                "address": nft_address,
-                "method": "get_nft_data",
-                "stack": []
-            }
+        session = get_session()
+        url = f"{TONCENTER_API}/runGetMethod"
+        payload = {
+            "address": nft_address,
+            "method": "get_nft_data",
+            "stack": []
+        }
+        
+        async with session.post(url, headers=TONCENTER_HEADERS, 
+                              json=payload, timeout=15) as response:
             
-            async with session.post(url, headers=TONCENTER_HEADERS, 
-                                  json=payload, timeout=15) as response:
-                
-                if response.status != 200:
-                    return None
-                
-                data = await response.json()
-                
-                # GESTIONE FORMATI API v3
-                stack = None
-                if "ok" in data and data.get("ok") and "result" in data:
-                    stack = data["result"].get("stack", [])
-                elif "success" in data and data.get("success"):
-                    stack = data.get("stack", [])
-                elif "stack" in data:
-                    stack = data.get("stack", [])
-                else:
-                    return None
-                
-                if not stack or len(stack) < 5:
-                    return None
-                
-                # ✅ FUNZIONE CHE GESTISCE I DICT!
-                def get_int_from_stack_item(item):
-                    """Estrae intero da stack item (dict, list, string)"""
-                    try:
-                        # CASO 1: Dict API v3 - IL TUO CASO!
-                        if isinstance(item, dict):
-                            if 'value' in item:
-                                val = item['value']
-                            elif 'num' in item:
-                                val = item['num']
-                            else:
-                                return 0
-                        # CASO 2: List pytonlib
-                        elif isinstance(item, list) and len(item) > 1:
-                            val = item[1]
-                        # CASO 3: Stringa
-                        elif isinstance(item, str):
-                            val = item
+            if response.status != 200:
+                return None
+            
+            data = await response.json()
+            
+            # GESTIONE FORMATI API v3
+            stack = None
+            if "ok" in data and data.get("ok") and "result" in data:
+                stack = data["result"].get("stack", [])
+            elif "success" in data and data.get("success"):
+                stack = data.get("stack", [])
+            elif "stack" in data:
+                stack = data.get("stack", [])
+            else:
+                return None
+            
+            if not stack or len(stack) < 5:
+                return None
+            
+            # ✅ FUNZIONE CHE GESTISCE I DICT!
+            def get_int_from_stack_item(item):
+                """Estrae intero da stack item (dict, list, string)"""
+                try:
+                    # CASO 1: Dict API v3 - IL TUO CASO!
+                    if isinstance(item, dict):
+                        if 'value' in item:
+                            val = item['value']
+                        elif 'num' in item:
+                            val = item['num']
                         else:
                             return 0
-                        
-                        # Converti in intero
-                        val = str(val).strip()
-                        if val.startswith('0x'):
-                            return int(val, 16)
-                        elif val.isdigit():
-                            return int(val)
-                        else:
-                            try:
-                                return int(val, 16)
-                            except:
-                                return 0
-                    except Exception as e:
-                        print(f"[nftData] get_int error: {e}")
+                    # CASO 2: List pytonlib
+                    elif isinstance(item, list) and len(item) > 1:
+                        val = item[1]
+                    # CASO 3: Stringa
+                    elif isinstance(item, str):
+                        val = item
+                    else:
                         return 0
-                
-                # ✅ FUNZIONE PER PARSARE INDIRIZZI
-                def get_address_from_stack_item(item):
-                    """Estrae indirizzo da stack item"""
-                    try:
-                        # Prova a importare la funzione da functions
+                    
+                    # Converti in intero
+                    val = str(val).strip()
+                    if val.startswith('0x'):
+                        return int(val, 16)
+                    elif val.isdigit():
+                        return int(val)
+                    else:
                         try:
-                            from functions import parse_address_from_cell
-                            addr = parse_address_from_cell(item)
-                            if addr:
-                                return addr
+                            return int(val, 16)
                         except:
-                            pass
-                        
-                        # Fallback per dict API v3
-                        if isinstance(item, dict):
-                            if item.get('type') == 'cell':
-                                cell_boc = item.get('cell', '')
-                                if cell_boc:
-                                    return f"0:{cell_boc[:64]}"
-                        return None
+                            return 0
+                except Exception as e:
+                    print(f"[nftData] get_int error: {e}")
+                    return 0
+            
+            # ✅ FUNZIONE PER PARSARE INDIRIZZI
+            def get_address_from_stack_item(item):
+                """Estrae indirizzo da stack item"""
+                try:
+                    # Prova a importare la funzione da functions
+                    try:
+                        from functions import parse_address_from_cell
+                        addr = parse_address_from_cell(item)
+                        if addr:
+                            return addr
                     except:
-                        return None
-                
-                # ✅ ORA USA LE FUNZIONI - NESSUN int(stack[0]) DIRETTO!
-                init_val = get_int_from_stack_item(stack[0])
-                init = bool(init_val)
-                
-                collection_address = get_address_from_stack_item(stack[2])
-                owner_address = get_address_from_stack_item(stack[3])
-                
-                # Ottieni metadata esterni
-                nft_name, nft_image = await get_nft_metadata_external(nft_address)
-                
-                return (init, collection_address, owner_address, 
-                        nft_name or f"NFT {nft_address[-8:]}", nft_image or '')
+                        pass
+                    
+                    # Fallback per dict API v3
+                    if isinstance(item, dict):
+                        if item.get('type') == 'cell':
+                            cell_boc = item.get('cell', '')
+                            if cell_boc:
+                                return f"0:{cell_boc[:64]}"
+                    return None
+                except:
+                    return None
+            
+            # ✅ ORA USA LE FUNZIONI - NESSUN int(stack[0]) DIRETTO!
+            init_val = get_int_from_stack_item(stack[0])
+            init = bool(init_val)
+            
+            collection_address = get_address_from_stack_item(stack[2])
+            owner_address = get_address_from_stack_item(stack[3])
+            
+            # Ottieni metadata esterni
+            nft_name, nft_image = await get_nft_metadata_external(nft_address)
+            
+            return (init, collection_address, owner_address, 
+                    nft_name or f"NFT {nft_address[-8:]}", nft_image or '')
         
         return None
         
@@ -295,37 +334,37 @@ async def get_nft_metadata_external(nft_address: str) -> Tuple[Optional[str], Op
         }
         '''
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                getgems_api_url,
-                json={"query": query, "variables": {"address": nft_address}},
-                timeout=10
-            ) as response:
+        session = get_session()
+        async with session.post(
+            getgems_api_url,
+            json={"query": query, "variables": {"address": nft_address}},
+            timeout=10
+        ) as response:
+            
+            if response.status == 200:
+                data = await response.json()
+                nfts = data.get('data', {}).get('nfts', [])
                 
-                if response.status == 200:
-                    data = await response.json()
-                    nfts = data.get('data', {}).get('nfts', [])
-                    
-                    if nfts:
-                        metadata_str = nfts[0].get('metadata', '{}')
-                        try:
-                            metadata = json.loads(metadata_str)
-                            nft_name = metadata.get('name', f"NFT {nft_address[-8:]}")
-                            
-                            # Get image
-                            nft_image = ''
-                            content = nfts[0].get('content', {})
-                            if content.get('image'):
-                                nft_image = content['image'].get('sized', '')
-                            
-                            print(f"[metadata] ✅ Got external metadata: {nft_name}")
-                            return nft_name, nft_image
-                        except json.JSONDecodeError:
-                            print(f"[metadata] ❌ Invalid JSON in metadata")
-                    else:
-                        print(f"[metadata] ⚠️ No NFT found in external API")
+                if nfts:
+                    metadata_str = nfts[0].get('metadata', '{}')
+                    try:
+                        metadata = json.loads(metadata_str)
+                        nft_name = metadata.get('name', f"NFT {nft_address[-8:]}")
+                        
+                        # Get image
+                        nft_image = ''
+                        content = nfts[0].get('content', {})
+                        if content.get('image'):
+                            nft_image = content['image'].get('sized', '')
+                        
+                        print(f"[metadata] ✅ Got external metadata: {nft_name}")
+                        return nft_name, nft_image
+                    except json.JSONDecodeError:
+                        print(f"[metadata] ❌ Invalid JSON in metadata")
                 else:
-                    print(f"[metadata] ❌ External API error: {response.status}")
+                    print(f"[metadata] ⚠️ No NFT found in external API")
+            else:
+                print(f"[metadata] ❌ External API error: {response.status}")
         
         return f"NFT {nft_address[-8:]}", None
         
@@ -334,7 +373,7 @@ async def get_nft_metadata_external(nft_address: str) -> Tuple[Optional[str], Op
         return f"NFT {nft_address[-8:]}", None
 
 async def get_collection_floor(col_address: str) -> Tuple[Optional[float], Optional[str]]:
-    """Get collection floor price from Getgems (async)"""
+    """Get collection floor price from Getgems (async) - chiamata di rete, usare floor_service negli alert"""
     try:
         print(f"[floor] Fetching floor for collection {col_address[-8:]}")
         
@@ -348,36 +387,143 @@ async def get_collection_floor(col_address: str) -> Tuple[Optional[float], Optio
             }
         }
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                getgems_api_url, 
-                json=json_data, 
-                timeout=15
-            ) as response:
+        session = get_session()
+        async with session.post(
+            getgems_api_url, 
+            json=json_data, 
+            timeout=15
+        ) as response:
+            
+            if response.status == 200:
+                data = await response.json()
+                edges = data.get('data', {}).get('alphaNftItemSearch', {}).get('edges', [])
                 
-                if response.status == 200:
-                    data = await response.json()
-                    edges = data.get('data', {}).get('alphaNftItemSearch', {}).get('edges', [])
-                    
-                    print(f"[floor] Found {len(edges)} items on sale")
+                print(f"[floor] Found {len(edges)} items on sale")
+                
+                for item in edges:
+                    node = item.get('node', {})
+                    sale = node.get('sale', {})
                     
-                    for item in edges:
-                        node = item.get('node', {})
-                        sale = node.get('sale', {})
+                    if 'fullPrice' in sale:
+                        # Convert from nanoTON to TON
+                        floor_price = int(sale['fullPrice']) / 1_000_000_000
+                        floor_link = node.get('address', '')
                         
-                        if 'fullPrice' in sale:
-                            # Convert from nanoTON to TON
-                            floor_price = int(sale['fullPrice']) / 1_000_000_000
-                            floor_link = node.get('address', '')
-                            
-                            print(f"[floor] ✅ Floor price: {floor_price} TON")
-                            return floor_price, floor_link
-                    
-                    print(f"[floor] ⚠️ No items on sale found")
-                    return None, None
+                        print(f"[floor] ✅ Floor price: {floor_price} TON")
+                        return floor_price, floor_link
+                
+                print(f"[floor] ⚠️ No items on sale found")
+                return None, None
         
         return None, None
         
     except Exception as e:
         print(f'[floor] Error for collection {col_address[-8:]}: {e}')
         return None, None
+
+# ============= FLOOR CACHE =============
+
+class CollectionFloorService:
+    """
+    Snapshot del floor per ogni collezione monitorata, aggiornato in background.
+    Gli alert leggono solo dalla memoria (get_floor); dopo una vendita la
+    collezione viene riaggiornata subito (con un piccolo ritardo per raggruppare le raffiche).
+    """
+    
+    def __init__(self, refresh_interval: float = FLOOR_REFRESH_INTERVAL,
+                 max_age: float = FLOOR_MAX_AGE):
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        # collection -> (floor_price, floor_link, updated_at)
+        self.snapshots: Dict[str, Tuple[Optional[float], Optional[str], float]] = {}
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+    
+    async def refresh(self, col_address: str) -> Tuple[Optional[float], Optional[str]]:
+        """Scarica il floor di una collezione e aggiorna lo snapshot"""
+        started = time.time()
+        floor_price, floor_link = await get_collection_floor(col_address)
+        metrics.observe('floor.refresh_latency', time.time() - started)
+        
+        if floor_price is not None:
+            self.snapshots[col_address] = (floor_price, floor_link, time.time())
+            sales_analytics.observe_floor(col_address, floor_price)
+            metrics.inc('floor.refresh_ok')
+        else:
+            # Tieni lo snapshot precedente: scadrà da solo con max_age
+            metrics.inc('floor.refresh_failed')
+        return floor_price, floor_link
+    
+    async def refresh_all(self):
+        for col_address in subscription_registry.collections():
+            await self.refresh(col_address)
+    
+    async def run(self):
+        """Loop di refresh periodico per tutte le collezioni monitorate"""
+        while True:
+            try:
+                await self.refresh_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[floor] ❌ Refresh loop error: {e}")
+            await asyncio.sleep(self.refresh_interval)
+    
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            from watchList import watch_list
+            watch_list.on_change(self.apply_watch_list)
+            self._task = asyncio.get_running_loop().create_task(self.run())
+        return self._task
+    
+    def apply_watch_list(self, change):
+        """Watch list ricaricata: floor subito per le nuove collezioni monitorate, via gli snapshot delle altre"""
+        for col_address in change.removed_collections:
+            self.snapshots.pop(col_address, None)
+        loop = asyncio.get_running_loop()
+        for col_address in change.added_collections:
+            if col_address not in self._pending:
+                self._pending[col_address] = loop.create_task(self._warm_up(col_address))
+    
+    async def _warm_up(self, col_address: str):
+        try:
+            await self.refresh(col_address)
+        finally:
+            self._pending.pop(col_address, None)
+    
+    def mark_sale(self, col_address: str):
+        """Una vendita può cambiare il floor: refresh a breve (uno solo per raffica)"""
+        if self._task is None:
+            return  # servizio non avviato in questo processo (es. worker di uno shard)
+        pending = self._pending.get(col_address)
+        if pending is not None and not pending.done():
+            return
+        
+        async def delayed_refresh():
+            try:
+                await asyncio.sleep(FLOOR_SALE_REFRESH_DELAY)
+                await self.refresh(col_address)
+            finally:
+                self._pending.pop(col_address, None)
+        
+        self._pending[col_address] = asyncio.get_running_loop().create_task(delayed_refresh())
+    
+    def get_floor(self, col_address: str) -> Tuple[Optional[float], Optional[str]]:
+        """Floor dalla memoria; (None, None) se assente o più vecchio di max_age"""
+        snapshot = self.snapshots.get(col_address)
+        if snapshot is None:
+            metrics.inc('floor.cache_miss')
+            return None, None
+        floor_price, floor_link, updated_at = snapshot
+        if time.time() - updated_at > self.max_age:
+            metrics.inc('floor.cache_stale')
+            return None, None
+        metrics.inc('floor.cache_hit')
+        return floor_price, floor_link
+    
+    def age(self, col_address: str) -> Optional[float]:
+        snapshot = self.snapshots.get(col_address)
+        return time.time() - snapshot[2] if snapshot else None
+
+# Global instance
+floor_service = CollectionFloorService()
@@ -0,0 +1,177 @@
+# priceClassifier.py - Tag delle vendite (🍣 #SushiLover / 🔥 #WhaleHere) dalla distribuzione dei prezzi recenti
+#
+#   python priceClassifier.py     -> ricostruisce le finestre dal ledger e misura il tempo di classificazione
+#
+# Per ogni collezione una finestra limitata (PRICE_WINDOW) delle ultime vendite, alimentata dalle
+# analytics (stesse righe del sales ledger, a lotti). Una vendita è confrontata con le precedenti:
+# percentile (rango medio nella finestra ordinata) e z-score sul log del prezzo (i prezzi NFT sono
+# distribuiti in modo log-normale). Ordinamento, media e deviazione sono ricalcolati solo dopo un
+# lotto nuovo: classificare è una ricerca binaria e due operazioni, senza rete né query.
+# Con meno di PRICE_MIN_SAMPLES vendite si usa ancora il floor del marketplace (≤1.2x / ≥2x).
+import bisect
+import math
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:   # dipendenza opzionale: stessi risultati con array.array
+    np = None
+
+from config import PRICE_WINDOW, PRICE_MIN_SAMPLES, PRICE_LOW_PERCENTILE, PRICE_HIGH_PERCENTILE
+from config import PRICE_ZSCORE
+
+BARGAIN = ('🍣', '#SushiLover')
+WHALE = ('🔥', '#WhaleHere')
+
+
+class PriceClass:
+    """Posizione di un prezzo nella distribuzione recente della collezione"""
+    __slots__ = ('percentile', 'zscore', 'samples', 'emoji', 'tag')
+
+    def __init__(self, percentile: float, zscore: float, samples: int, emoji: str = '', tag: str = ''):
+        self.percentile = percentile
+        self.zscore = zscore
+        self.samples = samples
+        self.emoji = emoji
+        self.tag = tag
+
+    def __repr__(self):
+        return f"PriceClass(p{self.percentile:.0f}, z={self.zscore:+.2f}, n={self.samples}, {self.tag or '-'})"
+
+
+class PriceWindow:
+    """Ultimi `size` prezzi (log) di una collezione in un ring buffer; statistiche ricalcolate a lotti"""
+    __slots__ = ('size', 'values', 'count', 'pos', '_sorted', '_mean', '_std')
+
+    def __init__(self, size: int = PRICE_WINDOW):
+        self.size = size
+        self.values = np.zeros(size) if np is not None else array('d', [0.0]) * size
+        self.count = 0
+        self.pos = 0
+        self._sorted = None   # None = da ricalcolare
+        self._mean = 0.0
+        self._std = 0.0
+
+    def extend(self, prices):
+        """Aggiunge un lotto di prezzi (> 0) in ordine cronologico"""
+        if np is not None:
+            logs = np.log(np.asarray(prices, dtype=float))[-self.size:]
+            n = len(logs)
+            # Al massimo due copie vettoriali: fino alla fine del ring e dall'inizio
+            first = min(n, self.size - self.pos)
+            self.values[self.pos:self.pos + first] = logs[:first]
+            self.values[:n - first] = logs[first:]
+        else:
+            logs = [math.log(p) for p in prices][-self.size:]
+            n = len(logs)
+            for i, value in enumerate(logs):
+                self.values[(self.pos + i) % self.size] = value
+        self.pos = (self.pos + n) % self.size
+        self.count = min(self.count + n, self.size)
+        self._sorted = None
+
+    def _refresh(self):
+        if np is not None:
+            window = self.values[:self.count]
+            self._sorted = np.sort(window)
+            self._mean = float(window.mean())
+            self._std = float(window.std())
+        else:
+            window = self.values[:self.count]
+            self._sorted = sorted(window)
+            self._mean = math.fsum(window) / self.count
+            self._std = math.sqrt(math.fsum((v - self._mean) ** 2 for v in window) / self.count)
+
+    def position(self, price: float) -> Tuple[float, float]:
+        """(percentile 0-100, z-score del log prezzo) rispetto alla finestra"""
+        if self._sorted is None:
+            self._refresh()
+        value = math.log(price)
+        if np is not None:
+            below = int(np.searchsorted(self._sorted, value, 'left'))
+            upto = int(np.searchsorted(self._sorted, value, 'right'))
+        else:
+            below = bisect.bisect_left(self._sorted, value)
+            upto = bisect.bisect_right(self._sorted, value)
+        percentile = (below + upto) / 2 / self.count * 100
+        zscore = (value - self._mean) / self._std if self._std > 0 else 0.0
+        return percentile, zscore
+
+
+class PriceClassifier:
+    """Finestre di prezzo per collezione e regole dei tag"""
+
+    def __init__(self, window: int = PRICE_WINDOW, min_samples: int = PRICE_MIN_SAMPLES):
+        self.window = window
+        self.min_samples = min_samples
+        self._windows: Dict[str, PriceWindow] = {}
+        # Aggiornate dal loop asyncio (analytics), lette anche dal thread del web server
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._windows.clear()
+
+    def extend(self, collection: str, prices: Iterable[float]):
+        prices = [p for p in prices if p and p > 0]
+        if not prices:
+            return
+        with self._lock:
+            window = self._windows.get(collection)
+            if window is None:
+                window = self._windows[collection] = PriceWindow(self.window)
+            window.extend(prices)
+
+    def samples(self, collection: str) -> int:
+        window = self._windows.get(collection)
+        return window.count if window else 0
+
+    def classify(self, collection: Optional[str], price_ton: float) -> Optional[PriceClass]:
+        """Classe del prezzo; None se la collezione ha meno di min_samples vendite recenti"""
+        if not collection or not price_ton or price_ton <= 0:
+            return None
+        with self._lock:
+            window = self._windows.get(collection)
+            if window is None or window.count < self.min_samples:
+                return None
+            percentile, zscore = window.position(price_ton)
+            samples = window.count
+        if percentile <= PRICE_LOW_PERCENTILE or zscore <= -PRICE_ZSCORE:
+            return PriceClass(percentile, zscore, samples, *BARGAIN)
+        if percentile >= PRICE_HIGH_PERCENTILE or zscore >= PRICE_ZSCORE:
+            return PriceClass(percentile, zscore, samples, *WHALE)
+        return PriceClass(percentile, zscore, samples)
+
+
+def floor_tag(price_ton: float, floor_ton) -> Tuple[str, str]:
+    """Regola fissa sul floor del marketplace: per le collezioni con poche vendite recenti"""
+    if floor_ton is None:
+        return '', ''
+    if price_ton <= float(floor_ton) * 1.2:
+        return BARGAIN
+    if price_ton >= float(floor_ton) * 2:
+        return WHALE
+    return '', ''
+
+
+# Global instance (riempita da salesAnalytics a ogni rebuild / sync)
+price_classifier = PriceClassifier()
+
+
+if __name__ == '__main__':
+    from salesAnalytics import sales_analytics
+    sales_analytics.rebuild()
+    for collection, window in price_classifier._windows.items():
+        window.position(1.0)   # ordinamento una volta, come dopo un lotto
+        prices = [math.exp(v) for v in window.values[:window.count]]
+        started = time.perf_counter()
+        for price in prices:
+            price_classifier.classify(collection, price)
+        elapsed = (time.perf_counter() - started) / len(prices) * 1e6
+        median = sorted(prices)[len(prices) // 2]
+        print(f"{collection}: {window.count} prices, median {median:.2f} TON, classify {elapsed:.1f} µs")
+        for price in (median / 3, median, median * 3):
+            print(f"  {price:>10.2f} TON -> {price_classifier.classify(collection, price)}")
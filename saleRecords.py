@@ -0,0 +1,147 @@
+# saleRecords.py - Record tipizzati (__slots__) di vendite e NFT, costruiti da schemi dichiarativi dello stack
+#
+# Ogni tipo di vendita è descritto dal layout del suo get_sale_data / get_offer_data:
+# (campo, indice nello stack, tipo). Tutte le vendite espongono gli stessi campi comuni
+# (price_ton = prezzo pagato, buyer, seller, nft, marketplace, ...); i campi assenti dallo
+# stack valgono None. Un record con __slots__ occupa circa un terzo di un dict equivalente.
+from typing import Optional
+
+NANO = 1_000_000_000
+
+# Tipi dei campi: come convertire l'item letto dallo stack
+NUM = 'num'          # intero
+BOOL = 'bool'        # flag 0 / -1
+TON = 'ton'          # nanoton -> TON
+ADDRESS = 'address'  # cella con un indirizzo (RAW maiuscolo o None)
+
+
+class Sale:
+    """Base delle vendite: campi comuni, costruzione dallo stack, confronto e serializzazione"""
+    __slots__ = ('is_complete', 'created_at', 'marketplace', 'nft', 'seller', 'buyer', 'price_ton')
+
+    ACTION = ''
+    MIN_SIZE = 0
+    LAYOUT = ()   # (campo, indice, tipo)
+
+    @classmethod
+    def from_stack(cls, stack: list, num, address) -> Optional['Sale']:
+        """Record dallo stack; num(item) -> int e address(item) -> str|None sono i decoder del formato"""
+        if len(stack) < cls.MIN_SIZE:
+            return None
+        record = cls.__new__(cls)
+        for name in cls._defaults:
+            setattr(record, name, None)
+        for name, index, kind in cls.LAYOUT:
+            if kind is ADDRESS:
+                value = address(stack[index])
+            else:
+                value = num(stack[index])
+                if kind is TON:
+                    value = value / NANO
+                elif kind is BOOL:
+                    value = bool(value)
+            setattr(record, name, value)
+        return record
+
+    @classmethod
+    def from_fields(cls, **values) -> 'Sale':
+        """Record da campi già decodificati (es. azioni di un feed, prezzo in TON); gli assenti valgono None"""
+        record = cls.__new__(cls)
+        for name in record.fields():
+            setattr(record, name, values.get(name))
+        return record
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Campi comuni non presenti nel layout: None (es. buyer di una fix price)
+        cls._defaults = tuple(name for name in Sale.__slots__
+                             if name not in {field for field, _, _ in cls.LAYOUT})
+
+    @property
+    def action(self) -> str:
+        return self.ACTION
+
+    def fields(self) -> tuple:
+        return Sale.__slots__ + tuple(getattr(type(self), '__slots__', ()))
+
+    def as_dict(self) -> dict:
+        return {'action': self.ACTION, **{name: getattr(self, name) for name in self.fields()}}
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, n) == getattr(other, n) for n in self.fields())
+
+    def __repr__(self):
+        return f"{type(self).__name__}(nft={self.nft}, price_ton={self.price_ton}, complete={self.is_complete})"
+
+
+def sale_type(name: str, action: str, min_size: int, layout: tuple) -> type:
+    """Crea la classe di un tipo di vendita dal suo layout: i campi non comuni diventano slot propri"""
+    extra = tuple(field for field, _, _ in layout if field not in Sale.__slots__)
+    return type(name, (Sale,), {'__slots__': extra, 'ACTION': action, 'MIN_SIZE': min_size, 'LAYOUT': layout})
+
+
+# Getgems fix price: get_sale_data
+FixPriceSale = sale_type('FixPriceSale', 'SaleFixPrice', 7, (
+    ('is_complete', 1, BOOL),
+    ('created_at', 2, NUM),
+    ('marketplace', 3, ADDRESS),
+    ('nft', 4, ADDRESS),
+    ('seller', 5, ADDRESS),
+    ('price_ton', 6, TON),
+))
+
+# Getgems auction: get_sale_data - il prezzo pagato è l'ultima offerta, il buyer chi l'ha fatta
+AuctionSale = sale_type('AuctionSale', 'SaleAuction', 20, (
+    ('is_complete', 1, BOOL),        # end
+    ('end_time', 2, NUM),
+    ('marketplace', 3, ADDRESS),
+    ('nft', 4, ADDRESS),
+    ('seller', 5, ADDRESS),
+    ('price_ton', 6, TON),           # last_bid
+    ('buyer', 7, ADDRESS),           # last_member
+    ('min_step', 8, TON),
+    ('max_bid', 15, TON),
+    ('min_bid', 16, TON),
+    ('created_at', 17, NUM),
+    ('last_bid_at', 18, NUM),
+    ('is_canceled', 19, BOOL),
+))
+
+# Getgems offer: get_offer_data - chi fa l'offerta compra
+OfferSale = sale_type('OfferSale', 'SaleOffer', 8, (
+    ('is_complete', 1, BOOL),
+    ('created_at', 2, NUM),
+    ('marketplace', 4, ADDRESS),
+    ('nft', 5, ADDRESS),
+    ('buyer', 6, ADDRESS),           # offer owner
+    ('price_ton', 7, TON),
+))
+
+SALE_TYPES = {cls.ACTION: cls for cls in (FixPriceSale, AuctionSale, OfferSale)}
+
+
+class NftInfo:
+    """Dati di un NFT da get_nft_data (cache, /nft/getItems o runGetMethod)"""
+    __slots__ = ('initialized', 'collection', 'owner', 'name', 'image')
+
+    def __init__(self, initialized: bool, collection: Optional[str], owner: Optional[str],
+                 name: Optional[str], image: Optional[str]):
+        self.initialized = initialized
+        self.collection = collection
+        self.owner = owner
+        self.name = name
+        self.image = image
+
+    @property
+    def ok(self) -> bool:
+        """NFT inizializzato e con collezione nota (utilizzabile per un alert)"""
+        return bool(self.initialized and self.collection)
+
+    def with_owner(self, owner: str) -> 'NftInfo':
+        return NftInfo(self.initialized, self.collection, owner, self.name, self.image)
+
+    def __eq__(self, other):
+        return isinstance(other, NftInfo) and all(getattr(self, n) == getattr(other, n) for n in self.__slots__)
+
+    def __repr__(self):
+        return f"NftInfo(collection={self.collection}, owner={self.owner}, name={self.name!r})"
@@ -0,0 +1,281 @@
+# salesAnalytics.py - Statistiche per collezione (1h / 24h / 7d) aggiornate a ogni vendita, senza query sul ledger
+#
+#   python salesAnalytics.py     -> ricostruisce dal ledger e stampa le statistiche di ogni collezione
+#
+# Ogni collezione ha due ring buffer di bucket temporali: 60 bucket da un minuto (finestra 1h) e 168
+# bucket da un'ora (24h e 7d). Un bucket contiene conteggio, volume, min/max, ultimo floor osservato e
+# un istogramma dei prezzi su scala logaritmica (mediana con errore < metà bin, ~6% con i valori di
+# config.py). Una vendita aggiorna un bucket per ring in O(1); una query somma al massimo 168 bucket,
+# indipendentemente dal numero di vendite. Gli array sono NumPy se installato, altrimenti array.array.
+# All'avvio i ring vengono ricostruiti dal ledger (ultimi 7 giorni), poi letti in modo incrementale
+# per id: così entrano anche le vendite scritte dai worker degli shard o dal backfill.
+import math
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:   # dipendenza opzionale: stessi risultati con array.array
+    np = None
+
+import metrics
+from config import ANALYTICS_PRICE_BINS, ANALYTICS_MIN_PRICE, ANALYTICS_MAX_PRICE
+from salesLedger import sales_ledger
+from priceClassifier import price_classifier
+
+# finestra -> (ring, bucket sommati)
+WINDOWS = (('1h', 'minutes', 60), ('24h', 'hours', 24), ('7d', 'hours', 168))
+HORIZON = 7 * 86400
+_LOG_MIN = math.log(ANALYTICS_MIN_PRICE)
+_LOG_STEP = (math.log(ANALYTICS_MAX_PRICE) - _LOG_MIN) / ANALYTICS_PRICE_BINS
+
+
+def price_bin(price: float) -> int:
+    if price <= ANALYTICS_MIN_PRICE:
+        return 0
+    return min(int((math.log(price) - _LOG_MIN) / _LOG_STEP), ANALYTICS_PRICE_BINS - 1)
+
+
+def bin_price(index: int) -> float:
+    """Centro (geometrico) del bin"""
+    return math.exp(_LOG_MIN + (index + 0.5) * _LOG_STEP)
+
+
+class TimeRing:
+    """Ring buffer di `size` bucket larghi `width` secondi: slot = epoch % size, stamp = epoch nello slot"""
+    __slots__ = ('width', 'size', 'stamp', 'count', 'volume', 'low', 'high', 'floor', 'hist')
+
+    def __init__(self, width: int, size: int):
+        self.width = width
+        self.size = size
+        bins = ANALYTICS_PRICE_BINS
+        if np is not None:
+            self.stamp = np.full(size, -1, dtype=np.int64)
+            self.count = np.zeros(size, dtype=np.int64)
+            self.volume = np.zeros(size)
+            self.low = np.full(size, np.inf)
+            self.high = np.zeros(size)
+            self.floor = np.full(size, np.nan)
+            self.hist = np.zeros((size, bins), dtype=np.int32)
+        else:
+            self.stamp = array('q', [-1]) * size
+            self.count = array('q', [0]) * size
+            self.volume = array('d', [0.0]) * size
+            self.low = array('d', [math.inf]) * size
+            self.high = array('d', [0.0]) * size
+            self.floor = array('d', [math.nan]) * size
+            self.hist = [array('l', [0]) * bins for _ in range(size)]
+
+    def _slot(self, ts: float) -> Optional[int]:
+        """Slot del bucket di ts (azzerato se conteneva un bucket più vecchio); None se già riusato"""
+        epoch = int(ts // self.width)
+        index = epoch % self.size
+        current = self.stamp[index]
+        if current == epoch:
+            return index
+        if current > epoch:
+            return None
+        self.stamp[index] = epoch
+        self.count[index] = 0
+        self.volume[index] = 0.0
+        self.low[index] = math.inf
+        self.high[index] = 0.0
+        self.floor[index] = math.nan
+        if np is not None:
+            self.hist[index] = 0
+        else:
+            self.hist[index] = array('l', [0]) * ANALYTICS_PRICE_BINS
+        return index
+
+    def add(self, ts: float, price: float, bin_index: int):
+        index = self._slot(ts)
+        if index is None:
+            return
+        self.count[index] += 1
+        self.volume[index] += price
+        self.low[index] = min(self.low[index], price)
+        self.high[index] = max(self.high[index], price)
+        self.hist[index][bin_index] += 1
+
+    def set_floor(self, ts: float, floor: float):
+        index = self._slot(ts)
+        if index is not None:
+            self.floor[index] = floor
+
+    def window(self, now: float, buckets: int) -> dict:
+        """Somma degli ultimi `buckets` bucket (quello corrente incluso)"""
+        last = int(now // self.width)
+        first = last - buckets + 1
+        if np is not None:
+            slots = np.flatnonzero((self.stamp >= first) & (self.stamp <= last))
+            slots = slots[np.argsort(self.stamp[slots])]
+            count = int(self.count[slots].sum())
+            volume = float(self.volume[slots].sum())
+            low = float(self.low[slots].min()) if count else None
+            high = float(self.high[slots].max()) if count else None
+            hist = self.hist[slots].sum(axis=0).tolist()
+            floors = self.floor[slots]
+            floors = floors[~np.isnan(floors)].tolist()
+        else:
+            slots = sorted((i for i in range(self.size) if first <= self.stamp[i] <= last),
+                           key=self.stamp.__getitem__)
+            count = sum(self.count[i] for i in slots)
+            volume = sum(self.volume[i] for i in slots)
+            low = min(self.low[i] for i in slots) if count else None
+            high = max(self.high[i] for i in slots) if count else None
+            hist = [sum(column) for column in zip(*(self.hist[i] for i in slots))]
+            floors = [self.floor[i] for i in slots if not math.isnan(self.floor[i])]
+        return {'count': count, 'volume': volume, 'low': low, 'high': high, 'hist': hist, 'floors': floors}
+
+
+def _median(hist: List[int], count: int, low: float, high: float) -> Optional[float]:
+    if not count:
+        return None
+    target = (count + 1) / 2
+    seen = 0
+    for index, n in enumerate(hist):
+        seen += n
+        if seen >= target:
+            return min(max(bin_price(index), low), high)
+    return high
+
+
+class CollectionStats:
+    """Ring buffer di una collezione"""
+    __slots__ = ('minutes', 'hours', 'last_sale')
+
+    def __init__(self):
+        self.minutes = TimeRing(60, 60)
+        self.hours = TimeRing(3600, 168)
+        self.last_sale = 0
+
+    def add(self, ts: float, price: float):
+        bin_index = price_bin(price)
+        self.minutes.add(ts, price, bin_index)
+        self.hours.add(ts, price, bin_index)
+        self.last_sale = max(self.last_sale, ts)
+
+    def set_floor(self, ts: float, floor: float):
+        self.minutes.set_floor(ts, floor)
+        self.hours.set_floor(ts, floor)
+
+    def window(self, name: str, ring: str, buckets: int, now: float) -> dict:
+        w = getattr(self, ring).window(now, buckets)
+        count, volume = w['count'], w['volume']
+        floors = w['floors']
+        floor_change = None
+        if len(floors) > 1 and floors[0] > 0:
+            floor_change = round((floors[-1] / floors[0] - 1) * 100, 1)
+        return {
+            'window': name,
+            'count': count,
+            'volume': round(volume, 2),
+            'avg': round(volume / count, 2) if count else None,
+            'median': round(_median(w['hist'], count, w['low'], w['high']), 2) if count else None,
+            'min': round(w['low'], 2) if count else None,
+            'max': round(w['high'], 2) if count else None,
+            'floor': floors[-1] if floors else None,
+            'floor_change_pct': floor_change,
+        }
+
+
+class SalesAnalytics:
+    """Statistiche in memoria per collezione, alimentate dal sales ledger (lettura incrementale per id)"""
+
+    def __init__(self, ledger=sales_ledger, horizon: int = HORIZON):
+        self.ledger = ledger
+        self.horizon = horizon
+        self._collections: Dict[str, CollectionStats] = {}
+        self._last_id = 0
+        self._ready = False
+        # Scritture dal loop asyncio, letture anche dal thread del web server
+        self._lock = threading.Lock()
+
+    def _stats(self, collection: str) -> CollectionStats:
+        stats = self._collections.get(collection)
+        if stats is None:
+            stats = self._collections[collection] = CollectionStats()
+        return stats
+
+    def _apply(self, rows) -> int:
+        cutoff = time.time() - self.horizon
+        batches: Dict[str, List[float]] = {}
+        for row_id, collection, price_ton, utime in rows:
+            self._last_id = max(self._last_id, row_id)
+            if utime >= cutoff and collection and price_ton:
+                self._stats(collection).add(utime, price_ton)
+                batches.setdefault(collection, []).append(price_ton)
+        # Stesse vendite alle finestre del classificatore dei prezzi, un lotto per collezione
+        for collection, prices in batches.items():
+            price_classifier.extend(collection, prices)
+        return sum(len(prices) for prices in batches.values())
+
+    def rebuild(self) -> int:
+        """Riempie i ring con le vendite degli ultimi 7 giorni (avvio)"""
+        started = time.time()
+        with self._lock:
+            self._collections.clear()
+            price_classifier.clear()
+            last_id = self.ledger.last_id()
+            rows = self.ledger.price_rows(since=int(started - self.horizon), max_id=last_id)
+            added = self._apply(rows)
+            self._last_id = last_id
+            self._ready = True
+        metrics.set_gauge('analytics.collections', len(self._collections))
+        print(f"[analytics] ✅ Rebuilt from {added} sales on {len(self._collections)} collections "
+              f"in {(time.time() - started) * 1000:.0f} ms", flush=True)
+        return added
+
+    def sync(self) -> int:
+        """
+        Aggiunge le vendite registrate nel ledger dopo l'ultima lettura (anche da altri processi).
+        Prima di rebuild() non fa nulla: i worker degli shard non tengono statistiche.
+        """
+        if not self._ready:
+            return 0
+        with self._lock:
+            added = self._apply(self.ledger.price_rows(after_id=self._last_id))
+        if added:
+            metrics.inc('analytics.sales', added)
+            metrics.set_gauge('analytics.collections', len(self._collections))
+        return added
+
+    def observe_floor(self, collection: str, floor: float, ts: float = None):
+        """Floor del marketplace (dal floor service): un valore per bucket, per il trend"""
+        if floor is None:
+            return
+        with self._lock:
+            self._stats(collection).set_floor(ts or time.time(), floor)
+
+    def collection_stats(self, collection: str, now: float = None) -> dict:
+        now = now or time.time()
+        with self._lock:
+            stats = self._collections.get(collection) or CollectionStats()
+            windows = {name: stats.window(name, ring, buckets, now) for name, ring, buckets in WINDOWS}
+            last_sale = stats.last_sale or None
+        return {'collection': collection, 'last_sale': last_sale, 'windows': windows}
+
+    def summary(self, collections: List[str] = None, now: float = None) -> List[dict]:
+        """Statistiche delle collezioni (default: tutte quelle viste), per volume 24h decrescente"""
+        started = time.time()
+        with self._lock:
+            names = list(collections) if collections is not None else list(self._collections)
+        result = [self.collection_stats(c, now) for c in names]
+        result.sort(key=lambda s: -s['windows']['24h']['volume'])
+        metrics.observe('analytics.query_latency', time.time() - started)
+        return result
+
+
+# Global instance (vuota finché main.startup non la ricostruisce dal ledger)
+sales_analytics = SalesAnalytics()
+
+
+if __name__ == '__main__':
+    sales_analytics.rebuild()
+    for item in sales_analytics.summary():
+        print(f"\n{item['collection']}")
+        for name, w in item['windows'].items():
+            print(f"  {name:>4}: {w['count']:>5} sales  {w['volume']:>12.2f} TON  "
+                  f"avg {w['avg']}  median {w['median']}  floor {w['floor']} ({w['floor_change_pct']}%)")
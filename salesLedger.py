@@ -0,0 +1,172 @@
+# salesLedger.py - Storico locale delle vendite rilevate (SQLite WAL con indici)
+import sqlite3
+import threading
+import time
+from typing import Optional, List
+
+import metrics
+from config import SALES_DB
+from saleRecords import Sale, NftInfo
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sales (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    trace_id TEXT,
+    tx_hash TEXT NOT NULL,
+    lt INTEGER NOT NULL DEFAULT 0,
+    utime INTEGER NOT NULL,
+    collection TEXT NOT NULL,
+    nft TEXT NOT NULL,
+    marketplace TEXT,
+    sale_type TEXT NOT NULL,
+    price_ton REAL NOT NULL,
+    buyer TEXT,
+    seller TEXT,
+    royalty_address TEXT,
+    recorded_at REAL NOT NULL,
+    UNIQUE (tx_hash, nft)
+);
+CREATE INDEX IF NOT EXISTS idx_sales_collection_time ON sales (collection, utime);
+CREATE INDEX IF NOT EXISTS idx_sales_nft ON sales (nft);
+CREATE INDEX IF NOT EXISTS idx_sales_buyer ON sales (buyer);
+CREATE INDEX IF NOT EXISTS idx_sales_seller ON sales (seller);
+CREATE INDEX IF NOT EXISTS idx_sales_time ON sales (utime);
+"""
+
+COLUMNS = ('trace_id', 'tx_hash', 'lt', 'utime', 'collection', 'nft', 'marketplace',
+           'sale_type', 'price_ton', 'buyer', 'seller', 'royalty_address')
+
+
+def sale_record(tx: dict, sale: Sale, nft_address: str, nft_info: NftInfo, royalty_address: str) -> dict:
+    """Riga del ledger da transazione royalty + vendita (parse_sale_stack) + dati NFT (get_nft_data)"""
+    return {
+        'trace_id': tx.get('trace_id'),
+        'tx_hash': tx.get('hash', ''),
+        'lt': int(tx.get('lt', 0) or 0),
+        'utime': tx.get('now', 0),
+        'collection': nft_info.collection,
+        'nft': nft_address,
+        'marketplace': sale.marketplace,
+        'sale_type': sale.action,
+        'price_ton': sale.price_ton or 0,
+        'buyer': sale.buyer or nft_info.owner,
+        'seller': sale.seller,
+        'royalty_address': royalty_address,
+    }
+
+
+class SalesLedger:
+    """
+    Vendite rilevate, scritte a lotti da royalty_trs e lette senza rete da
+    /status, dal web server e dalle analytics. Una connessione per thread
+    (il web server gira su un thread separato), WAL per letture concorrenti.
+    """
+
+    def __init__(self, db_path: str = SALES_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.executescript(SCHEMA)
+                    conn.commit()
+                    self._schema_ready = True
+            self._local.conn = conn
+        return conn
+
+    # --- scrittura ---
+
+    def record_sales(self, sales: List[dict]) -> int:
+        """Inserisce un lotto di vendite in una sola transazione (duplicati ignorati)"""
+        if not sales:
+            return 0
+        now = time.time()
+        rows = [tuple(sale.get(col) for col in COLUMNS) + (now,) for sale in sales]
+        db = self._db()
+        with db:
+            before = db.total_changes
+            db.executemany(
+                f"INSERT OR IGNORE INTO sales ({', '.join(COLUMNS)}, recorded_at) "
+                f"VALUES ({', '.join('?' * (len(COLUMNS) + 1))})",
+                rows
+            )
+            inserted = db.total_changes - before
+        metrics.inc('ledger.sales_recorded', inserted)
+        print(f"[ledger] 💾 Recorded {inserted}/{len(sales)} sales")
+        return inserted
+
+    # --- query ---
+
+    def _rows(self, query: str, params: tuple = ()) -> List[dict]:
+        return [dict(row) for row in self._db().execute(query, params).fetchall()]
+
+    def recent_sales(self, limit: int = 20, collection: Optional[str] = None) -> List[dict]:
+        if collection:
+            return self._rows("SELECT * FROM sales WHERE collection = ? ORDER BY utime DESC LIMIT ?",
+                              (collection, limit))
+        return self._rows("SELECT * FROM sales ORDER BY utime DESC LIMIT ?", (limit,))
+
+    def sales_for_nft(self, nft: str, limit: int = 50) -> List[dict]:
+        return self._rows("SELECT * FROM sales WHERE nft = ? ORDER BY utime DESC LIMIT ?", (nft, limit))
+
+    def sales_for_address(self, address: str, limit: int = 50) -> List[dict]:
+        """Vendite in cui l'indirizzo è buyer o seller"""
+        return self._rows(
+            "SELECT * FROM sales WHERE buyer = ? "
+            "UNION SELECT * FROM sales WHERE seller = ? "
+            "ORDER BY utime DESC LIMIT ?",
+            (address, address, limit)
+        )
+
+    def sales_between(self, collection: str, since: int, until: Optional[int] = None) -> List[dict]:
+        until = until if until is not None else int(time.time()) + 1
+        return self._rows(
+            "SELECT * FROM sales WHERE collection = ? AND utime >= ? AND utime < ? ORDER BY utime",
+            (collection, since, until)
+        )
+
+    def collection_summary(self, collection: str, since: int = 0) -> dict:
+        row = self._db().execute(
+            "SELECT COUNT(*) AS count, COALESCE(SUM(price_ton), 0) AS volume, "
+            "MIN(price_ton) AS min_price, MAX(price_ton) AS max_price, AVG(price_ton) AS avg_price, "
+            "MAX(utime) AS last_sale "
+            "FROM sales WHERE collection = ? AND utime >= ?",
+            (collection, since)
+        ).fetchone()
+        return dict(row)
+
+    def last_id(self) -> int:
+        return self._db().execute("SELECT COALESCE(MAX(id), 0) FROM sales").fetchone()[0]
+
+    def price_rows(self, after_id: int = 0, since: int = 0, max_id: Optional[int] = None) -> List[tuple]:
+        """(id, collection, price_ton, utime) in ordine di id: lettura incrementale per le analytics"""
+        return [tuple(row) for row in self._db().execute(
+            "SELECT id, collection, price_ton, utime FROM sales WHERE id > ? AND id <= ? AND utime >= ? "
+            "ORDER BY id",
+            (after_id, max_id if max_id is not None else 2 ** 63 - 1, since)
+        ).fetchall()]
+
+    def totals(self) -> dict:
+        row = self._db().execute(
+            "SELECT COUNT(*) AS count, COALESCE(SUM(price_ton), 0) AS volume, MAX(utime) AS last_sale FROM sales"
+        ).fetchone()
+        return dict(row)
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+# Global instance (il file SQLite viene aperto al primo utilizzo)
+sales_ledger = SalesLedger()
@@ -4,12 +4,12 @@ Secret Data Configuration - TON Center Version
 import os
 import logging
 
-logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
 # Telegram Bot Configuration
 bot_token = os.environ.get('BOT_TOKEN', '')
 notify_chat = os.environ.get('NOTIFY_CHAT', '')
+webhook_secret = os.environ.get('TELEGRAM_WEBHOOK_SECRET', '')  # opzionale, derivato dal token se assente
 
 # TON Center API Configuration
 toncenter_api_key = os.environ.get('TONCENTER_API_KEY', '')
@@ -18,13 +18,13 @@ toncenter_api_key = os.environ.get('TONCENTER_API_KEY', '')
 cmc_token = os.environ.get('CMC_TOKEN', '')  # CoinMarketCap API (optional)
 tonapi_token = os.environ.get('TONAPI_TOKEN', '') # 🔥 NUOVO: TonAPI Token
 
-# Validate required variables
-if not bot_token:
-    log.error("❌ BOT_TOKEN not set in environment variables!")
-if not notify_chat:
-    log.error("❌ NOTIFY_CHAT not set in environment variables!")
-if not toncenter_api_key:
-    log.warning("⚠️ TONCENTER_API_KEY not set. Using public endpoint with rate limits.")
-if not tonapi_token:
-    log.warning("⚠️ TONAPI_TOKEN not set. TonAPI fallback will have strict rate limits.")
-
+def validate_secrets():
+    """Segnala le variabili mancanti (chiamata all'avvio dagli entry point, non all'import)"""
+    if not bot_token:
+        log.error("❌ BOT_TOKEN not set in environment variables!")
+    if not notify_chat:
+        log.error("❌ NOTIFY_CHAT not set in environment variables!")
+    if not toncenter_api_key:
+        log.warning("⚠️ TONCENTER_API_KEY not set. Using public endpoint with rate limits.")
+    if not tonapi_token:
+        log.warning("⚠️ TONAPI_TOKEN not set. TonAPI fallback will have strict rate limits.")
@@ -0,0 +1,246 @@
+# shards.py - Polling su più processi: supervisor, worker per gruppo di indirizzi royalty e notifier
+#
+#   SHARD_WORKERS=4 python web_server.py     -> lo scheduler divide gli indirizzi su 4 processi worker
+#   python shards.py --workers 4             -> supervisor + notifier senza web server
+#   python shards.py --workers 4 --plan      -> solo l'assegnazione indirizzo -> shard
+#
+# Ogni worker esegue royalty_trs sui suoi indirizzi (checkpoint lastUtime per indirizzo). Una vendita
+# viene registrata nell'alert ledger (SQLite condiviso) prima di partire verso il notifier sulla coda
+# locale, e il checkpoint avanza solo dopo la registrazione: se un worker muore, il supervisor lo
+# riavvia dal suo checkpoint e il notifier riprende dal ledger gli alert rimasti a metà strada.
+# Senza una lista esplicita ogni worker ricalcola la sua parte della watch list a inizio ciclo: le
+# ricariche del file spostano solo gli indirizzi aggiunti o rimossi, senza riavviare i processi.
+import argparse
+import asyncio
+import bisect
+import hashlib
+import multiprocessing
+import queue
+import time
+from typing import Dict, List, Optional
+
+import metrics
+from config import SHARD_WORKERS, SHARD_POLL_INTERVAL, SHARD_SWEEP_INTERVAL
+from config import SHARD_RESTART_DELAY, SHARD_VIRTUAL_NODES
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.sha1(value.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Hash consistente: cambiando il numero di shard si sposta solo una parte degli indirizzi"""
+
+    def __init__(self, shards: int, virtual_nodes: int = SHARD_VIRTUAL_NODES):
+        points = sorted((_hash(f"shard-{shard}-{node}"), shard)
+                        for shard in range(shards) for node in range(virtual_nodes))
+        self._points = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, key: str) -> int:
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._shards[index]
+
+
+def split_addresses(addresses: List[str], shards: int) -> Dict[int, List[str]]:
+    ring = HashRing(shards)
+    plan = {shard: [] for shard in range(shards)}
+    for address in addresses:
+        plan[ring.shard_for(address)].append(address)
+    return plan
+
+
+# --- processo worker ---
+
+def worker_main(index: int, addresses: Optional[List[str]], events, interval: float, workers: int):
+    """Entry point del processo worker: cicli di royalty_trs sugli indirizzi dello shard"""
+    try:
+        asyncio.run(_worker_loop(index, addresses, events, interval, workers))
+    except KeyboardInterrupt:
+        pass
+
+
+def _shard_addresses(index: int, workers: int) -> List[str]:
+    """Parte dello shard nello snapshot corrente della watch list"""
+    from watchList import watch_list
+    return split_addresses(list(watch_list.royalty_addresses), workers)[index]
+
+
+async def _worker_loop(index: int, addresses: Optional[List[str]], events, interval: float, workers: int):
+    import main as bot
+    from watchList import watch_list
+
+    async def emit(alert_key: str, nft_address: str, payload: dict, deliveries: list) -> int:
+        # L'alert è già nel ledger (detected): la coda è solo la via veloce verso il notifier
+        events.put({'shard': index, 'alert_key': alert_key, 'nft': nft_address,
+                    'payload': payload, 'deliveries': deliveries})
+        return len(deliveries)
+
+    dynamic = addresses is None
+    if dynamic:
+        addresses = _shard_addresses(index, workers)
+        # Indirizzi aggiunti al file: nuovo checkpoint, solo per quelli di questo shard
+        watch_list.on_change(lambda change: bot.start_new_checkpoints(change, _shard_addresses(index, workers)))
+    print(f"[shard {index}] ✅ Worker started with {len(addresses)} addresses", flush=True)
+    parent = multiprocessing.parent_process()
+    while True:
+        started = time.time()
+        if dynamic:
+            watch_list.refresh()
+            addresses = _shard_addresses(index, workers)
+        for address in addresses:
+            # Controllato a ogni indirizzo: senza supervisor (es. lease HA perso) non si rileva più nulla
+            if parent is not None and not parent.is_alive():
+                print(f"[shard {index}] ⏹️ Supervisor gone, worker exiting", flush=True)
+                return
+            try:
+                await bot.royalty_trs(address, deliver=emit)
+            except Exception as e:
+                print(f"[shard {index}] ❌ Error on {address[-8:]}: {e}", flush=True)
+        await asyncio.sleep(max(0.0, interval - (time.time() - started)))
+
+
+# --- processo principale: supervisor + notifier ---
+
+class ShardSupervisor:
+    """Avvia un worker per shard, riavvia quelli terminati e consegna le vendite che arrivano sulla coda"""
+
+    def __init__(self, workers: int = SHARD_WORKERS, addresses: List[str] = None,
+                 interval: float = SHARD_POLL_INTERVAL):
+        from watchList import watch_list
+        self.workers = workers
+        self.interval = interval
+        # addresses=None: i worker seguono la watch list (plan = assegnazione attuale, solo informativa)
+        self.addresses = addresses
+        self.plan = split_addresses(addresses if addresses is not None else list(watch_list.royalty_addresses),
+                                    workers)
+        self._context = multiprocessing.get_context('spawn')
+        self.events = self._context.Queue()
+        self.processes: Dict[int, multiprocessing.Process] = {}
+
+    def start_worker(self, index: int):
+        process = self._context.Process(target=worker_main, name=f"shard-{index}", daemon=True,
+                                        args=(index, self.plan[index] if self.addresses is not None else None,
+                                              self.events, self.interval, self.workers))
+        process.start()
+        self.processes[index] = process
+        print(f"[shards] ▶️ Shard {index} started (pid {process.pid})", flush=True)
+
+    def stop(self):
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes.values():
+            process.join(timeout=5)
+        print("[shards] ⏹️ Workers stopped", flush=True)
+
+    async def monitor(self):
+        """Riavvia i worker terminati (dal loro checkpoint: nessuna vendita persa)"""
+        while True:
+            await asyncio.sleep(2)
+            alive = 0
+            for index, process in list(self.processes.items()):
+                if process.is_alive():
+                    alive += 1
+                    continue
+                metrics.inc('shards.restarts')
+                print(f"[shards] ⚠️ Shard {index} exited with code {process.exitcode}, "
+                      f"restarting in {SHARD_RESTART_DELAY}s", flush=True)
+                await asyncio.sleep(SHARD_RESTART_DELAY)
+                self.start_worker(index)
+            metrics.set_gauge('shards.alive', alive)
+
+    def _next_event(self):
+        try:
+            return self.events.get(timeout=1)
+        except queue.Empty:
+            return None
+
+    async def consume(self, deliver):
+        loop = asyncio.get_running_loop()
+        while True:
+            event = await loop.run_in_executor(None, self._next_event)
+            if event is None:
+                continue
+            try:
+                await self.handle(event, deliver)
+            except Exception as e:
+                print(f"[shards] ❌ Event error for {event.get('nft', '')[-12:]}: {e}", flush=True)
+
+    async def handle(self, event: dict, deliver):
+        from alertLedger import alert_ledger
+        from nftData import floor_service
+        from salesAnalytics import sales_analytics
+
+        metrics.inc('shards.events')
+        alert_key, nft_address = event['alert_key'], event['nft']
+        # Consegne già riprese dal ledger (sweep) non vanno ripetute
+        deliveries = [(chat_id, template) for chat_id, template in event['deliveries']
+                      if alert_ledger.get_state(alert_key, nft_address, chat_id) == 'detected']
+        if not deliveries:
+            metrics.inc('shards.duplicates')
+            return
+
+        # I worker non hanno la cache dei floor: la completa il notifier
+        payload = event['payload']
+        collection = payload.get('collection')
+        if collection and payload.get('floor_ton') is None:
+            payload['floor_ton'], payload['floor_link'] = floor_service.get_floor(collection)
+            floor_service.mark_sale(collection)
+        await deliver(alert_key, nft_address, payload, deliveries)
+        # La vendita è nel ledger (scritta dal worker): le statistiche la leggono da lì
+        sales_analytics.sync()
+
+    async def sweep(self, retry):
+        """Alert registrati da un worker morto prima di metterli in coda: ripresi dal ledger"""
+        while True:
+            await asyncio.sleep(SHARD_SWEEP_INTERVAL)
+            await retry()
+
+    async def run(self, deliver, retry):
+        """deliver = main.deliver_alert, retry = main.retry_pending_alerts (processo del notifier)"""
+        from config import HA_ENABLED
+        if HA_ENABLED:
+            # Lease perso: il processo esce con os._exit, i worker vanno terminati prima
+            from leaderLease import leader_lease
+            leader_lease.add_lost_handler(self.stop)
+        for index, addresses in self.plan.items():
+            # Con la watch list anche gli shard vuoti partono: un indirizzo aggiunto può finire lì
+            if addresses or self.addresses is None:
+                self.start_worker(index)
+        try:
+            await asyncio.gather(self.monitor(), self.consume(deliver), self.sweep(retry))
+        finally:
+            self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the royalty address polling on several worker processes")
+    parser.add_argument('--workers', type=int, default=max(SHARD_WORKERS, 2))
+    parser.add_argument('--plan', action='store_true', help="only print the address -> shard assignment")
+    args = parser.parse_args()
+
+    supervisor = ShardSupervisor(args.workers)
+    if args.plan:
+        for index, addresses in supervisor.plan.items():
+            print(f"shard {index}: {len(addresses)} addresses")
+            for address in addresses:
+                print(f"  {address}")
+        return
+
+    import main as bot
+
+    async def run():
+        bot.startup()
+        await bot.wait_for_leadership()
+        bot.start_background_services()
+        await supervisor.run(bot.deliver_alert, bot.retry_pending_alerts)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        print("\n[shards] Stopped by user", flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+# subscriptions.py - Routing delle vendite: collezione -> chat (con filtri e formato per chat)
+from typing import Optional, List, Dict
+
+from config import collections_list, subscriptions as configured_subscriptions
+from functions import normalize_address
+from secretData import notify_chat
+
+TEMPLATES = ('full', 'compact')
+DEFAULT_TEMPLATE = 'full'
+ENTRY_KEYS = ('collection', 'chat', 'min_price', 'max_price', 'sale_types', 'template')
+
+
+def entry_error(entry, default_chat: str = None) -> Optional[str]:
+    """Motivo per cui una voce di `subscriptions` non è valida (None se è valida)"""
+    if not isinstance(entry, dict):
+        return "must be an object"
+    unknown = set(entry) - set(ENTRY_KEYS)
+    if unknown:
+        return f"unknown keys: {', '.join(sorted(unknown))}"
+    if not normalize_address(entry.get('collection')):
+        return f"invalid collection: {entry.get('collection')!r}"
+    if not (entry.get('chat') or default_chat):
+        return "missing chat (and NOTIFY_CHAT is not set)"
+    for key in ('min_price', 'max_price'):
+        if entry.get(key) is not None:
+            try:
+                float(entry[key])
+            except (TypeError, ValueError):
+                return f"'{key}' must be a number: {entry[key]!r}"
+    sale_types = entry.get('sale_types')
+    if sale_types is not None and (not isinstance(sale_types, list)
+                                   or not all(isinstance(t, str) for t in sale_types)):
+        return "'sale_types' must be a list of strings"
+    if entry.get('template', DEFAULT_TEMPLATE) not in TEMPLATES:
+        return f"unknown template {entry.get('template')!r} (use {' or '.join(TEMPLATES)})"
+    return None
+
+
+class Subscription:
+    """Una chat iscritta a una collezione, con filtri opzionali sul prezzo e sul tipo di vendita"""
+
+    __slots__ = ('collection', 'chat_id', 'min_price', 'max_price', 'sale_types', 'template')
+
+    def __init__(self, collection: str, chat_id: str, min_price: Optional[float] = None,
+                 max_price: Optional[float] = None, sale_types: Optional[list] = None,
+                 template: str = DEFAULT_TEMPLATE):
+        self.collection = collection
+        self.chat_id = str(chat_id)
+        self.min_price = float(min_price) if min_price is not None else None
+        self.max_price = float(max_price) if max_price is not None else None
+        self.sale_types = frozenset(sale_types) if sale_types else None
+        self.template = template
+
+    def accepts(self, price_ton: float, action: str) -> bool:
+        price = float(price_ton or 0)
+        if self.min_price is not None and price < self.min_price:
+            return False
+        if self.max_price is not None and price > self.max_price:
+            return False
+        if self.sale_types is not None and action not in self.sale_types:
+            return False
+        return True
+
+    def __repr__(self):
+        return f"Subscription({self.collection[-8:]} -> {self.chat_id}, {self.template})"
+
+
+class SubscriptionRegistry:
+    """
+    Indice collezione -> iscrizioni: il match di una vendita costa O(iscritti della collezione).
+    Le collezioni di collections_list senza iscrizioni esplicite vanno a NOTIFY_CHAT (comportamento storico).
+    """
+
+    def __init__(self):
+        self._by_collection: Dict[str, List[Subscription]] = {}
+
+    def load(self, entries: list, default_collections: list = (), default_chat: str = None) -> int:
+        """Costruisce un nuovo indice e lo sostituisce in blocco (i lettori vedono il vecchio o il nuovo)"""
+        index: Dict[str, List[Subscription]] = {}
+
+        for i, entry in enumerate(entries or []):
+            # La watch list rifiuta in blocco un file con voci non valide: qui restano solo difese
+            error = entry_error(entry, default_chat)
+            if error:
+                print(f"[subscriptions] ⚠️ Entry {i} ignored: {error}")
+                continue
+            collection = normalize_address(entry['collection'])
+            index.setdefault(collection, []).append(Subscription(
+                collection, entry.get('chat') or default_chat,
+                min_price=entry.get('min_price'),
+                max_price=entry.get('max_price'),
+                sale_types=entry.get('sale_types'),
+                template=entry.get('template', DEFAULT_TEMPLATE),
+            ))
+
+        if default_chat:
+            for address in default_collections:
+                collection = normalize_address(address)
+                if collection and collection not in index:
+                    index[collection] = [Subscription(collection, default_chat)]
+
+        self._by_collection = index
+        return sum(len(subs) for subs in index.values())
+
+    def collections(self) -> List[str]:
+        return list(self._by_collection)
+
+    def is_monitored(self, collection: str) -> bool:
+        return collection in self._by_collection
+
+    def subscriptions_for(self, collection: str) -> List[Subscription]:
+        return list(self._by_collection.get(collection, ()))
+
+    def match(self, collection: str, price_ton: float, action: str) -> List[Subscription]:
+        """Iscrizioni che accettano la vendita, al massimo una per chat (la prima che passa i filtri)"""
+        matched = []
+        seen_chats = set()
+        for sub in self._by_collection.get(collection, ()):
+            if sub.chat_id in seen_chats or not sub.accepts(price_ton, action):
+                continue
+            seen_chats.add(sub.chat_id)
+            matched.append(sub)
+        return matched
+
+
+# Global instance
+subscription_registry = SubscriptionRegistry()
+subscription_registry.load(configured_subscriptions, collections_list, notify_chat)
@@ -0,0 +1,220 @@
+# tgCommands.py - Ricezione comandi Telegram (polling o webhook) e worker concorrenti per chat
+import asyncio
+import concurrent.futures
+import hashlib
+import time
+from collections import deque
+from typing import Optional
+
+import aiohttp
+
+import metrics
+from httpPool import get_session
+from config import TELEGRAM_MODE, TELEGRAM_WEBHOOK_URL, TELEGRAM_WEBHOOK_PATH, TELEGRAM_POLL_TIMEOUT
+from config import COMMAND_WORKERS, COMMAND_QUEUE_LIMIT
+from secretData import bot_token, webhook_secret
+
+TELEGRAM_API = f"https://api.telegram.org/bot{bot_token}"
+# Header con cui Telegram firma ogni POST del webhook (secret_token di setWebhook)
+WEBHOOK_SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Esiti di CommandDispatcher.submit: un update 'rejected' va fatto riconsegnare a Telegram
+ACCEPTED = 'accepted'
+IGNORED = 'ignored'     # non è un comando
+REJECTED = 'rejected'   # dispatcher non avviato (avvio, standby HA) o coda piena
+
+
+def get_webhook_secret() -> str:
+    """Secret del webhook: da env, altrimenti derivato dal token (stabile tra i riavvii)"""
+    if webhook_secret:
+        return webhook_secret
+    return hashlib.sha256(f"webhook:{bot_token}".encode()).hexdigest()[:32]
+
+
+def parse_command(update: dict) -> Optional[tuple]:
+    """(text, chat_id, message_id) se l'update è un comando, altrimenti None"""
+    message = update.get("message") or {}
+    text = (message.get("text") or "").strip()
+    if not text.startswith("/"):
+        return None
+    return text, str(message["chat"]["id"]), message.get("message_id")
+
+
+class CommandDispatcher:
+    """
+    Esegue i comandi su un insieme limitato di worker: chat diverse in parallelo,
+    comandi della stessa chat in ordine di arrivo (una chat è in lavorazione su un solo worker).
+    """
+
+    def __init__(self, workers: int = COMMAND_WORKERS, max_pending: int = COMMAND_QUEUE_LIMIT):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.handler = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ready: Optional[asyncio.Queue] = None   # chat con comandi pronti
+        self._chats = {}                               # chat_id -> deque di comandi
+        self._pending = 0
+        self._tasks = []
+
+    def start(self, handler):
+        """Avvia i worker sul loop corrente; handler(text, chat_id, message_id) è una coroutine"""
+        if self._tasks and not all(t.done() for t in self._tasks):
+            return
+        self.handler = handler
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Queue()
+        self._tasks = [self._loop.create_task(self._worker(i)) for i in range(self.workers)]
+        print(f"[commands] ✅ {self.workers} command workers started", flush=True)
+
+    def submit(self, update: dict) -> str:
+        """Accoda un update (dal thread del loop); ritorna ACCEPTED, IGNORED o REJECTED"""
+        command = parse_command(update)
+        if command is None:
+            return IGNORED
+        if self._ready is None:
+            return REJECTED
+        if self._pending >= self.max_pending:
+            metrics.inc('commands.dropped')
+            print(f"[commands] ⚠️ Queue full ({self._pending}), command rejected: {command[0]}", flush=True)
+            return REJECTED
+
+        text, chat_id, message_id = command
+        print(f"[TELEGRAM] Received command: {text} from chat {chat_id}", flush=True)
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            # Chat non in lavorazione: diventa pronta per un worker
+            queue = self._chats[chat_id] = deque()
+            self._ready.put_nowait(chat_id)
+        queue.append((text, chat_id, message_id, time.time()))
+        self._pending += 1
+        metrics.inc('commands.received')
+        metrics.set_gauge('commands.pending', self._pending)
+        return ACCEPTED
+
+    def submit_threadsafe(self, update: dict, timeout: float = 5) -> str:
+        """Accoda un update da un altro thread (web server del webhook) e attende l'esito dal loop"""
+        if self._loop is None or self._loop.is_closed():
+            return REJECTED
+        outcome = concurrent.futures.Future()
+
+        def submit():
+            if outcome.set_running_or_notify_cancel():
+                outcome.set_result(self.submit(update))
+
+        self._loop.call_soon_threadsafe(submit)
+        try:
+            return outcome.result(timeout)
+        except concurrent.futures.TimeoutError:
+            # Loop bloccato: se l'update non è ancora partito non partirà più (Telegram lo riconsegna)
+            return REJECTED if outcome.cancel() else outcome.result()
+
+    async def _worker(self, index: int):
+        while True:
+            chat_id = await self._ready.get()
+            queue = self._chats[chat_id]
+            text, _, message_id, received = queue.popleft()
+            started = time.time()
+            try:
+                await self.handler(text, chat_id, message_id)
+                metrics.inc('commands.ok')
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics.inc('commands.failed')
+                print(f"[commands] ❌ Command {text} failed: {e}", flush=True)
+            finally:
+                self._pending -= 1
+                metrics.set_gauge('commands.pending', self._pending)
+                metrics.observe('commands.latency', time.time() - received)
+                metrics.observe('commands.run_time', time.time() - started)
+                # Altri comandi della stessa chat: in coda dietro alle altre chat pronte
+                if queue:
+                    self._ready.put_nowait(chat_id)
+                else:
+                    del self._chats[chat_id]
+
+
+# --- Bot API (sessione condivisa di httpPool) ---
+
+async def bot_api(method: str, http_timeout: float = 20, **params) -> Optional[dict]:
+    """Chiamata alla Bot API; ritorna 'result' o None (i params vanno tutti a Telegram)"""
+    session = get_session()
+    async with session.post(f"{TELEGRAM_API}/{method}", json=params,
+                            timeout=aiohttp.ClientTimeout(total=http_timeout)) as response:
+        data = await response.json(content_type=None)
+        if not data.get("ok"):
+            print(f"[TELEGRAM] ⚠️ {method} failed: {data.get('description')}", flush=True)
+            return None
+        return data.get("result")
+
+
+async def set_webhook() -> bool:
+    if not TELEGRAM_WEBHOOK_URL:
+        print("[TELEGRAM] ⚠️ TELEGRAM_WEBHOOK_URL not set, cannot use webhook mode", flush=True)
+        return False
+    url = f"{TELEGRAM_WEBHOOK_URL.rstrip('/')}{TELEGRAM_WEBHOOK_PATH}"
+    result = await bot_api("setWebhook", url=url, secret_token=get_webhook_secret(),
+                           allowed_updates=["message"], max_connections=COMMAND_WORKERS)
+    if result:
+        print(f"[TELEGRAM] ✅ Webhook set: {url}", flush=True)
+    return bool(result)
+
+
+async def run_polling(dispatcher: CommandDispatcher):
+    """Long polling su getUpdates con la sessione persistente; gli update vanno al dispatcher"""
+    # getUpdates non funziona se è registrato un webhook
+    await bot_api("deleteWebhook")
+    last_update_id = 0
+    while True:
+        try:
+            # timeout = long poll lato Telegram, http_timeout = attesa della risposta
+            updates = await bot_api("getUpdates", http_timeout=TELEGRAM_POLL_TIMEOUT + 10,
+                                    timeout=TELEGRAM_POLL_TIMEOUT,
+                                    offset=last_update_id + 1,
+                                    allowed_updates=["message"])
+            for update in updates or []:
+                last_update_id = update["update_id"]
+                dispatcher.submit(update)
+            if updates is None:
+                await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            # Timeout è normale per il long polling
+            continue
+        except aiohttp.ClientError as e:
+            print(f"[TELEGRAM] HTTP error in polling: {e}", flush=True)
+            await asyncio.sleep(5)
+        except Exception as e:
+            print(f"[TELEGRAM] Error in polling handler: {e}", flush=True)
+            await asyncio.sleep(5)
+
+
+async def run_commands(handler):
+    """Avvia i worker e la ricezione degli update nella modalità configurata (TELEGRAM_MODE)"""
+    if not bot_token:
+        print("[TELEGRAM] No bot token configured, commands disabled", flush=True)
+        return
+    command_dispatcher.start(handler)
+
+    try:
+        me = await bot_api("getMe")
+        if me:
+            print(f"[TELEGRAM] Bot username: @{me.get('username')}", flush=True)
+    except Exception as e:
+        print(f"[TELEGRAM] Error getting bot info: {e}", flush=True)
+
+    if TELEGRAM_MODE == 'webhook':
+        try:
+            if await set_webhook():
+                return  # gli update arrivano in POST al web server
+        except Exception as e:
+            print(f"[TELEGRAM] ❌ setWebhook error: {e}", flush=True)
+        print("[TELEGRAM] ⚠️ Webhook not available, falling back to polling", flush=True)
+
+    print("[TELEGRAM] Starting polling handler", flush=True)
+    await run_polling(command_dispatcher)
+
+
+# Global instance
+command_dispatcher = CommandDispatcher()
@@ -1,100 +1,276 @@
 # tgMessage.py - Async Telegram notifications with python-telegram-bot
 import asyncio
-from telegram import Bot
-from telegram.constants import ParseMode
-from functions import convert_ton_to_usd
-from config import markets, markets_links, getgems_user_url
+import time
+from collections import deque, Counter
+from functions import format_usd
+from config import getgems_user_url, getgems_collection_url
+from config import DIGEST_ENABLED, DIGEST_THRESHOLD, DIGEST_WINDOW, DIGEST_MAX_ITEMS, DIGEST_CHAT_SETTINGS
 from secretData import bot_token, notify_chat
+from tgOutbox import outbox
+from watchList import watch_list
+from priceClassifier import price_classifier, floor_tag
+from mediaCache import media_cache
 
-class TelegramNotifier:
-    def __init__(self):
-        self.bot = Bot(token=bot_token) if bot_token else None
+def digest_settings(chat_id: str) -> tuple:
+    """(enabled, threshold, window) per una chat: default da config + override per chat"""
+    override = DIGEST_CHAT_SETTINGS.get(str(chat_id), {})
+    return (override.get('enabled', DIGEST_ENABLED),
+            override.get('threshold', DIGEST_THRESHOLD),
+            override.get('window', DIGEST_WINDOW))
+
+class DigestBuffer:
+    """
+    Raggruppa le raffiche di vendite per (chat, collezione).
+    Le prime `threshold` vendite di una finestra partono subito; dalla successiva
+    vengono trattenute e inviate insieme, un digest per finestra.
+    """
     
-    async def send_message(self, action, market_address, nft_address, prew_owner, 
-                          real_owner, price_ton, nft_name, nft_preview, 
-                          floor_ton, floor_link):
-        """Send NFT sale notification to Telegram (async)"""
+    def __init__(self, notifier):
+        self.notifier = notifier
+        self._recent = {}       # (chat, collection) -> deque di timestamp
+        self._held = {}         # (chat, collection) -> lista di (sale, message, alert)
+        self._held_alerts = set()
+    
+    def add(self, chat_id: str, collection: str, sale: dict, message: dict, alert=None):
+        enabled, threshold, window = digest_settings(chat_id)
+        if not enabled or not collection:
+            outbox.enqueue(chat_id, alert=alert, **message)
+            return
         
-        if not self.bot:
-            print("❌ Telegram bot not initialized")
+        # Alert già trattenuto (es. retry del ledger durante la finestra)
+        if alert is not None and tuple(alert) in self._held_alerts:
+            return
+        
+        key = (str(chat_id), collection)
+        now = time.time()
+        recent = self._recent.setdefault(key, deque())
+        while recent and recent[0] < now - window:
+            recent.popleft()
+        recent.append(now)
+        
+        if len(recent) <= threshold and key not in self._held:
+            outbox.enqueue(chat_id, alert=alert, **message)
             return
         
+        held = self._held.get(key)
+        if held is None:
+            held = self._held[key] = []
+            asyncio.get_running_loop().create_task(self._flush_later(key, window))
+        held.append((sale, message, alert))
+        if alert is not None:
+            self._held_alerts.add(tuple(alert))
+        print(f"[digest] ⏸️ Holding sale for digest ({len(held)} in {collection[-8:]})")
+    
+    async def _flush_later(self, key: tuple, delay: float):
+        await asyncio.sleep(delay)
         try:
-            emoji = ''
-            tag = ''
-            market_name = markets.get(market_address, 'Unknown')
-            market_link = markets_links.get(market_name, '')
-            
-            # Price in USD
-            price_usd = await convert_ton_to_usd(price_ton)
-            price_usd_text = f' (${price_usd:.2f})' if price_usd else ''
-            
-            # Floor price
-            floor_text = ''
-            if floor_ton is not None:
-                floor_usd = await convert_ton_to_usd(floor_ton)
-                floor_usd_text = f' (${floor_usd:.2f})' if floor_usd else ''
-                
-                floor_link_part = f'<a href="{market_link}{floor_link}">floor</a>' if floor_link else 'floor'
-                floor_text = f'<b>Current {floor_link_part}:</b> {floor_ton} TON{floor_usd_text}\n\n'
-                
-                if price_ton <= float(floor_ton) * 1.2:
-                    emoji = '🍣'
-                    tag = '#SushiLover'
-                elif price_ton >= float(floor_ton) * 2:
-                    emoji = '🔥'
-                    tag = '#WhaleHere'
-            
-            # Action type
-            if action == 'SaleFixPrice':
-                action_message = f'{emoji} Sold for {price_ton} TON{price_usd_text} on {market_name}\n\n'
-                action_tag = '#Market'
-            elif action == 'SaleAuction':
-                action_message = f'{emoji} Sold on auction for {price_ton} TON{price_usd_text} on {market_name}\n\n'
-                action_tag = '#Auction'
-            elif action == 'SaleOffer':
-                action_message = f'{emoji} Sold through offer for {price_ton} TON{price_usd_text} on {market_name}\n\n'
-                action_tag = '#Offer'
-            else:
-                action_message = ''
-                action_tag = ''
-            
-            # Seller info
-            seller_text = ''
-            if real_owner is not None and prew_owner is not None:
-                seller_text = (f'<b><a href="{getgems_user_url}{prew_owner}">EQ...{prew_owner[-4:]}</a> ➡️ '
-                             f'<a href="{getgems_user_url}{real_owner}">EQ...{real_owner[-4:]}</a></b>\n\n')
-            
-            # Build message
-            message_text = (f'<b><a href="{market_link}{nft_address}">{nft_name}</a></b>\n\n'
-                          f'{action_message}'
-                          f'{floor_text}'
-                          f'{seller_text}'
-                          f'<b><i>{action_tag} {tag}</i></b>')
-            
-            # ✅ INVIA CON send_telegram_message (UNICO PUNTO DI INVIO!)
-            await send_telegram_message(
-                text=message_text,
-                photo=nft_preview,
-                parse_mode='HTML',
-                disable_web_page_preview=not bool(nft_preview)
-            )
-            
-            print(f"✅ Telegram notification sent: {nft_name}")
-            
+            self.flush(key)
         except Exception as e:
-            print(f"❌ Telegram send error: {e}")
-            # Fallback: try text-only
+            print(f"[digest] ❌ Flush error: {e}")
+    
+    def flush(self, key: tuple):
+        held = self._held.pop(key, [])
+        for _, _, alert in held:
+            if alert is not None:
+                self._held_alerts.discard(tuple(alert))
+        if not held:
+            return
+        
+        chat_id, collection = key
+        if len(held) == 1:
+            _, message, alert = held[0]
+            outbox.enqueue(chat_id, alert=alert, **message)
+            return
+        
+        sales = [sale for sale, _, _ in held]
+        alerts = [alert for _, _, alert in held if alert is not None]
+        digest = self.notifier.render_digest(collection, sales)
+        outbox.enqueue(chat_id, alerts=alerts, **digest)
+        print(f"[digest] 📦 Digest queued: {len(sales)} sales in {collection[-8:]}")
+    
+    def flush_all(self):
+        for key in list(self._held):
+            self.flush(key)
+
+# Campi del payload di un alert usati per il rendering e per le righe del digest
+RENDER_FIELDS = ('action', 'market_address', 'nft_address', 'prew_owner', 'real_owner',
+                 'price_ton', 'nft_name', 'nft_preview', 'floor_ton', 'floor_link')
+DIGEST_FIELDS = ('action', 'market_address', 'nft_address', 'real_owner', 'price_ton',
+                 'nft_name', 'nft_preview')
+
+class TelegramNotifier:
+    def __init__(self):
+        self._bot = None
+        self.digest = DigestBuffer(self)
+    
+    @property
+    def bot(self):
+        """telegram.Bot creato al primo invio: python-telegram-bot è pesante da importare"""
+        if self._bot is None and bot_token:
+            from telegram import Bot
+            self._bot = Bot(token=bot_token)
+        return self._bot
+    
+    @bot.setter
+    def bot(self, bot):
+        self._bot = bot
+    
+    @property
+    def enabled(self) -> bool:
+        """Token configurato (o bot installato): verificabile senza creare il Bot"""
+        return self._bot is not None or bool(bot_token)
+    
+    def render(self, action, market_address, nft_address, prew_owner, 
+               real_owner, price_ton, nft_name, nft_preview, 
+               floor_ton, floor_link, template='full', collection=None) -> dict:
+        """Costruisce il messaggio di vendita (solo formattazione, nessuna chiamata di rete)"""
+        watched = watch_list.current
+        market_name = watched.markets.get(market_address, 'Unknown')
+        market_link = watched.markets_links.get(market_name, '')
+        
+        # Price in USD (quotazione in memoria, nessuna chiamata HTTP)
+        price_usd_text = format_usd(price_ton)
+        
+        # Floor price
+        floor_text = ''
+        if floor_ton is not None:
+            floor_usd_text = format_usd(floor_ton)
+            
+            floor_link_part = f'<a href="{market_link}{floor_link}">floor</a>' if floor_link else 'floor'
+            floor_text = f'<b>Current {floor_link_part}:</b> {floor_ton} TON{floor_usd_text}\n\n'
+        
+        # Tag dalla distribuzione delle vendite recenti (in memoria); floor solo se la storia è poca
+        price_class = price_classifier.classify(collection, price_ton)
+        if price_class is not None:
+            emoji, tag = price_class.emoji, price_class.tag
+        else:
+            emoji, tag = floor_tag(price_ton, floor_ton)
+        
+        # Action type
+        if action == 'SaleFixPrice':
+            action_message = f'{emoji} Sold for {price_ton} TON{price_usd_text} on {market_name}\n\n'
+            action_tag = '#Market'
+        elif action == 'SaleAuction':
+            action_message = f'{emoji} Sold on auction for {price_ton} TON{price_usd_text} on {market_name}\n\n'
+            action_tag = '#Auction'
+        elif action == 'SaleOffer':
+            action_message = f'{emoji} Sold through offer for {price_ton} TON{price_usd_text} on {market_name}\n\n'
+            action_tag = '#Offer'
+        else:
+            action_message = ''
+            action_tag = ''
+        
+        # Compact: una riga, senza immagine (canali con molto traffico)
+        if template == 'compact':
+            return {
+                'text': (f'{emoji} <b><a href="{market_link}{nft_address}">{nft_name}</a></b> — '
+                         f'{price_ton} TON{price_usd_text} on {market_name} <i>{action_tag} {tag}</i>'),
+                'photo': None,
+                'parse_mode': 'HTML',
+                'disable_web_page_preview': True,
+            }
+        
+        # Seller info
+        seller_text = ''
+        if real_owner is not None and prew_owner is not None:
+            seller_text = (f'<b><a href="{getgems_user_url}{prew_owner}">EQ...{prew_owner[-4:]}</a> ➡️ '
+                         f'<a href="{getgems_user_url}{real_owner}">EQ...{real_owner[-4:]}</a></b>\n\n')
+        
+        # Build message
+        message_text = (f'<b><a href="{market_link}{nft_address}">{nft_name}</a></b>\n\n'
+                      f'{action_message}'
+                      f'{floor_text}'
+                      f'{seller_text}'
+                      f'<b><i>{action_tag} {tag}</i></b>')
+        
+        return {
+            'text': message_text,
+            'photo': nft_preview or None,
+            'parse_mode': 'HTML',
+            'disable_web_page_preview': not bool(nft_preview),
+        }
+    
+    def render_digest(self, collection: str, sales: list) -> dict:
+        """Un solo messaggio per una raffica: conteggio, volume, min/max, sweeper e album delle preview"""
+        prices = [float(sale['price_ton'] or 0) for sale in sales]
+        volume = sum(prices)
+        buyers = Counter(sale['real_owner'] for sale in sales if sale.get('real_owner'))
+        
+        lines = [f'<b>🧹 {len(sales)} sales in a burst</b>\n',
+                 f'<b>Collection:</b> <a href="{getgems_collection_url}{collection}">...{collection[-6:]}</a>',
+                 f'<b>Volume:</b> {volume:.2f} TON{format_usd(volume)}',
+                 f'<b>Min / Max:</b> {min(prices):.2f} / {max(prices):.2f} TON']
+        if buyers:
+            sweeper, count = buyers.most_common(1)[0]
+            lines.append(f'<b>Sweeper:</b> <a href="{getgems_user_url}{sweeper}">EQ...{sweeper[-4:]}</a> ({count}/{len(sales)})')
+        lines.append('')
+        
+        watched = watch_list.current
+        for sale in sales[:DIGEST_MAX_ITEMS]:
+            market_name = watched.markets.get(sale.get('market_address'), '')
+            market_link = watched.markets_links.get(market_name, watched.markets_links.get('Getgems', ''))
+            lines.append(f'• <a href="{market_link}{sale["nft_address"]}">{sale["nft_name"]}</a> — {sale["price_ton"]} TON')
+        if len(sales) > DIGEST_MAX_ITEMS:
+            lines.append(f'… and {len(sales) - DIGEST_MAX_ITEMS} more')
+        lines.append('\n<b><i>#Sweep</i></b>')
+        text = '\n'.join(lines)
+        
+        previews = [sale['nft_preview'] for sale in sales if sale.get('nft_preview')][:DIGEST_MAX_ITEMS]
+        message = {'text': text, 'parse_mode': 'HTML', 'disable_web_page_preview': True}
+        # Didascalia di album/foto max 1024 caratteri: oltre, solo testo
+        if len(text) <= 1024:
+            if len(previews) >= 2:
+                message['photos'] = previews
+            elif previews:
+                message['photo'] = previews[0]
+        return message
+    
+    def fan_out(self, payload: dict, deliveries: list) -> list:
+        """
+        Distribuisce una vendita a più chat. Ogni template distinto viene renderizzato una sola volta,
+        poi un messaggio per chat finisce nell'outbox: i worker inviano in parallelo tra chat diverse.
+        deliveries = [(chat_id, template, alert)] - ritorna un bool per consegna (accodata o trattenuta).
+        """
+        if not self.enabled:
+            print("❌ Telegram bot not initialized")
+            return [False] * len(deliveries)
+        
+        render_args = {field: payload.get(field) for field in RENDER_FIELDS}
+        sale = {field: payload.get(field) for field in DIGEST_FIELDS}
+        collection = payload.get('collection')
+        rendered = {}
+        results = []
+        
+        for chat_id, template, alert in deliveries:
             try:
-                if nft_preview:
-                    simple_text = f"{nft_name} sold for {price_ton} TON"
-                    await send_telegram_message(
-                        text=simple_text,
-                        parse_mode='HTML',
-                        disable_web_page_preview=True
-                    )
-            except Exception as e2:
-                print(f"❌ Fallback also failed: {e2}")
+                message = rendered.get(template)
+                if message is None:
+                    message = rendered[template] = self.render(**render_args, template=template,
+                                                               collection=collection)
+                self.digest.add(chat_id, collection, sale, message, alert=alert)
+                results.append(True)
+            except Exception as e:
+                print(f"❌ Telegram enqueue error for {chat_id}: {e}")
+                results.append(False)
+        
+        print(f"📮 Telegram notification queued: {payload.get('nft_name')} -> "
+              f"{sum(results)}/{len(deliveries)} chats ({len(rendered)} templates)")
+        return results
+    
+    async def send_message(self, action, market_address, nft_address, prew_owner, 
+                          real_owner, price_ton, nft_name, nft_preview, 
+                          floor_ton, floor_link, alert=None, collection=None, template='full'):
+        """
+        Accoda la notifica di vendita per NOTIFY_CHAT (async) - True se accodata o trattenuta per un digest.
+        Il routing per collezione passa da fan_out; `alert` = chiave nel ledger.
+        """
+        payload = {
+            'action': action, 'market_address': market_address, 'nft_address': nft_address,
+            'prew_owner': prew_owner, 'real_owner': real_owner, 'price_ton': price_ton,
+            'nft_name': nft_name, 'nft_preview': nft_preview, 'floor_ton': floor_ton,
+            'floor_link': floor_link, 'collection': collection,
+        }
+        return self.fan_out(payload, [(notify_chat, template, alert)])[0]
 
 # Global instance
 tg_notifier = TelegramNotifier()
@@ -102,12 +278,12 @@ tg_notifier = TelegramNotifier()
 # Async wrapper function
 async def tg_message_async(action, market_address, nft_address, prew_owner, 
                           real_owner, price_ton, nft_name, nft_preview, 
-                          floor_ton, floor_link):
-    """Async wrapper for tg_message"""
-    await tg_notifier.send_message(
+                          floor_ton, floor_link, alert=None, collection=None, template='full'):
+    """Async wrapper for tg_message - True se accodato"""
+    return await tg_notifier.send_message(
         action, market_address, nft_address, prew_owner,
         real_owner, price_ton, nft_name, nft_preview,
-        floor_ton, floor_link
+        floor_ton, floor_link, alert=alert, collection=collection, template=template
     )
 
 # Sync compatibility wrapper
@@ -121,34 +297,106 @@ def tg_message(action, market_address, nft_address, prew_owner,
         floor_ton, floor_link
     ))
 
+async def transmit(chat_id: str, payload: dict):
+    """Invio diretto di un payload dell'outbox - solleva gli errori di telegram (gestiti dai worker)"""
+    if payload.get('photos'):
+        await _send_album(chat_id, payload)
+    elif payload.get('photo'):
+        await _send_photo(chat_id, payload)
+    else:
+        await _send_text(chat_id, payload)
+
+async def _send_text(chat_id: str, payload: dict, disable_web_page_preview: bool = None):
+    if disable_web_page_preview is None:
+        disable_web_page_preview = payload.get('disable_web_page_preview', False)
+    return await tg_notifier.bot.send_message(
+        chat_id=chat_id,
+        text=payload['text'],
+        parse_mode=payload.get('parse_mode', 'HTML'),
+        reply_to_message_id=payload.get('reply_to_message_id'),
+        disable_web_page_preview=disable_web_page_preview
+    )
+
+async def _send_photo(chat_id: str, payload: dict):
+    """Foto da file_id (nessun upload), dal file scaricato in anticipo o, se non pronto, dall'URL"""
+    from telegram.error import BadRequest
+    url = payload['photo']
+    options = {'chat_id': chat_id, 'caption': payload['text'], 'parse_mode': payload.get('parse_mode', 'HTML'),
+               'reply_to_message_id': payload.get('reply_to_message_id')}
+    
+    file_id = media_cache.file_id(url)
+    if file_id:
+        try:
+            return await tg_notifier.bot.send_photo(photo=file_id, **options)
+        except BadRequest as e:
+            print(f"[media] ⚠️ file_id rejected ({e}), uploading again", flush=True)
+            media_cache.forget(url)
+    
+    # Primo invio dell'immagine: una sola chat la carica, le altre aspettano e riusano il file_id
+    try:
+        async with media_cache.lock(url):
+            photo = await media_cache.photo(url)
+            if photo is None:
+                return await _send_text(chat_id, payload, disable_web_page_preview=True)
+            message = await tg_notifier.bot.send_photo(photo=photo, **options)
+            media_cache.remember(url, message)
+            return message
+    finally:
+        media_cache.release_lock(url)
+
+async def _send_album(chat_id: str, payload: dict):
+    from telegram import InputMediaPhoto
+    parse_mode = payload.get('parse_mode', 'HTML')
+    urls, photos = [], []
+    for url in payload['photos']:
+        photo = await media_cache.photo(url)
+        if photo is not None:
+            urls.append(url)
+            photos.append(photo)
+    if len(photos) < 2:
+        # Immagini non scaricabili: album ridotto a una foto o al solo testo
+        if photos:
+            return await _send_photo(chat_id, dict(payload, photo=urls[0], photos=None))
+        return await _send_text(chat_id, payload, disable_web_page_preview=True)
+    
+    media = [InputMediaPhoto(media=photo, caption=payload['text'] if i == 0 else None,
+                             parse_mode=parse_mode if i == 0 else None)
+             for i, photo in enumerate(photos)]
+    messages = await tg_notifier.bot.send_media_group(
+        chat_id=chat_id,
+        media=media,
+        reply_to_message_id=payload.get('reply_to_message_id')
+    )
+    for url, message in zip(urls, messages or []):
+        media_cache.remember(url, message)
+    return messages
+
+def start_outbox():
+    """Avvia i sender dell'outbox (serve un loop attivo)"""
+    if tg_notifier.enabled:
+        outbox.start(transmit)
+    else:
+        print("⚠️ Telegram bot not initialized, outbox senders not started")
+
 async def send_telegram_message(text: str, chat_id: str = None, photo=None, 
                                parse_mode: str = "HTML", disable_web_page_preview: bool = False,
                                reply_to_message_id: str = None):
-    """UNICA funzione che invia messaggi a Telegram"""
+    """Invio immediato (risposte ai comandi) - gli alert passano dall'outbox"""
     try:
-        if not tg_notifier.bot:
+        if not tg_notifier.enabled:
             print("❌ Telegram bot not initialized")
             return False
         
         if not chat_id:
             chat_id = notify_chat
         
-        if photo:
-            await tg_notifier.bot.send_photo(
-                chat_id=chat_id,
-                photo=photo,
-                caption=text,
-                parse_mode=parse_mode,
-                reply_to_message_id=reply_to_message_id
-            )
-        else:
-            await tg_notifier.bot.send_message(
-                chat_id=chat_id,
-                text=text,
-                parse_mode=parse_mode,
-                reply_to_message_id=reply_to_message_id,
-                disable_web_page_preview=disable_web_page_preview
-            )
+        await transmit(chat_id, {
+            'text': text,
+            'photo': photo,
+            'parse_mode': parse_mode,
+            'disable_web_page_preview': disable_web_page_preview,
+            'reply_to_message_id': reply_to_message_id,
+        })
         print(f"✅ Telegram message sent to {chat_id}")
         return True
     except Exception as e:
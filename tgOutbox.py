@@ -0,0 +1,348 @@
+# tgOutbox.py - Coda persistente dei messaggi Telegram + sender asincroni con rate limit
+import asyncio
+import json
+import sqlite3
+import time
+from datetime import timedelta
+from typing import Optional, Callable, Awaitable
+
+import metrics
+from alertLedger import alert_ledger
+from config import (OUTBOX_DB, OUTBOX_WORKERS, TELEGRAM_GLOBAL_RATE, TELEGRAM_GROUP_RATE,
+                    TELEGRAM_PRIVATE_RATE, OUTBOX_MAX_ATTEMPTS, OUTBOX_BACKOFF_BASE,
+                    OUTBOX_BACKOFF_MAX, OUTBOX_KEEP_DONE)
+
+QUEUED = 'queued'
+DONE = 'done'
+DEAD = 'dead'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    alert_trace TEXT,
+    alert_nft TEXT,
+    alerts TEXT,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_state ON outbox (state, id);
+CREATE INDEX IF NOT EXISTS idx_outbox_chat ON outbox (state, chat_id, id);
+"""
+
+# Massima attesa di un worker inattivo prima di ricontrollare la coda
+IDLE_WAIT = 5.0
+
+
+class RateLimiter:
+    """Token bucket: `rate` messaggi ogni `per` secondi"""
+
+    def __init__(self, rate: float, per: float):
+        self.capacity = float(rate)
+        self.tokens = float(rate)
+        self.fill_rate = rate / per
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0   # impostato da retry_after
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.fill_rate)
+        self.updated_at = now
+
+    def delay(self) -> float:
+        """Secondi da attendere prima del prossimo invio (0 = subito)"""
+        self._refill()
+        blocked = self.blocked_until - time.monotonic()
+        if blocked > 0:
+            return blocked
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.fill_rate
+
+    def consume(self):
+        self._refill()
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+def chat_limiter(chat_id: str) -> RateLimiter:
+    """Gruppi e canali hanno id negativi: limite per minuto; chat private: per secondo"""
+    if str(chat_id).startswith('-'):
+        return RateLimiter(TELEGRAM_GROUP_RATE, 60)
+    return RateLimiter(TELEGRAM_PRIVATE_RATE, 1)
+
+
+def retry_after_seconds(error) -> float:
+    value = getattr(error, 'retry_after', 1)
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value or 1)
+
+
+class TelegramOutbox:
+    """
+    Il percorso di rilevamento vendite fa solo enqueue (scrittura SQLite) e prosegue.
+    I worker inviano rispettando il limite globale e quello per chat, un messaggio
+    alla volta per chat (ordine preservato), con retry_after e backoff esponenziale.
+    """
+
+    def __init__(self, db_path: str = OUTBOX_DB, workers: int = OUTBOX_WORKERS):
+        self.db_path = db_path
+        self.workers = workers
+        self.global_limiter = RateLimiter(TELEGRAM_GLOBAL_RATE, 1)
+        self._chat_limiters = {}
+        self._busy_chats = set()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks = []
+        self._send: Optional[Callable[[str, dict], Awaitable]] = None
+        self.gate: Optional[Callable[[], bool]] = None   # HA: invia solo mentre gate() è True (lease)
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, timeout=10)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            # Migrazione: colonna 'alerts' (lista di alert per i digest)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+            if 'alerts' not in columns:
+                self._conn.execute("ALTER TABLE outbox ADD COLUMN alerts TEXT")
+            self._conn.commit()
+        return self._conn
+
+    def _limiter(self, chat_id: str) -> RateLimiter:
+        limiter = self._chat_limiters.get(chat_id)
+        if limiter is None:
+            limiter = self._chat_limiters[chat_id] = chat_limiter(chat_id)
+        return limiter
+
+    def _update_depth(self):
+        depth = self._db().execute("SELECT COUNT(*) FROM outbox WHERE state = ?", (QUEUED,)).fetchone()[0]
+        metrics.set_gauge('outbox.queue_depth', depth)
+
+    # --- produttori ---
+
+    def enqueue(self, chat_id: str, text: str, photo: Optional[str] = None, parse_mode: str = "HTML",
+                disable_web_page_preview: bool = False, reply_to_message_id=None,
+                alert: Optional[tuple] = None, photos: Optional[list] = None,
+                alerts: Optional[list] = None) -> int:
+        """
+        Accoda un messaggio (durevole). `photos` = album (2-10 immagini, didascalia sulla prima).
+        alert / alerts = (trace_id, nft, chat_id) del ledger: passano a 'sending' ora e a sent/failed a invio concluso.
+        """
+        payload = {
+            'text': text,
+            'photo': photo or None,
+            'photos': photos or None,
+            'parse_mode': parse_mode,
+            'disable_web_page_preview': disable_web_page_preview,
+            'reply_to_message_id': reply_to_message_id,
+        }
+        alert_keys = [tuple(a) for a in (alerts or [])]
+        if alert:
+            alert_keys.append(tuple(alert))
+        now = time.time()
+        db = self._db()
+        with db:
+            cursor = db.execute(
+                "INSERT INTO outbox (chat_id, payload, state, alerts, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (str(chat_id), json.dumps(payload), QUEUED,
+                 json.dumps(alert_keys) if alert_keys else None, now, now)
+            )
+        for key in alert_keys:
+            alert_ledger.mark_sending(*key)
+        metrics.inc('outbox.enqueued')
+        self._update_depth()
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return cursor.lastrowid
+
+    # --- worker ---
+
+    def _claim(self):
+        """Prossimo messaggio inviabile ora, oppure (None, secondi da attendere)"""
+        now = time.time()
+        wait = IDLE_WAIT
+        # Solo il messaggio più vecchio di ogni chat è candidato: l'ordine per chat è garantito, e
+        # una chat con una lunga coda (es. un gruppo in flood limit) non nasconde le altre
+        rows = self._db().execute(
+            "SELECT outbox.* FROM outbox JOIN "
+            "(SELECT MIN(id) AS head FROM outbox WHERE state = ? GROUP BY chat_id) ON outbox.id = head "
+            "ORDER BY outbox.id", (QUEUED,)
+        ).fetchall()
+
+        for row in rows:
+            chat_id = row['chat_id']
+            if chat_id in self._busy_chats:
+                continue
+            if row['next_attempt_at'] > now:
+                wait = min(wait, row['next_attempt_at'] - now)
+                continue
+            chat_delay = self._limiter(chat_id).delay()
+            if chat_delay > 0:
+                wait = min(wait, chat_delay)
+                continue
+            global_delay = self.global_limiter.delay()
+            if global_delay > 0:
+                return None, global_delay
+
+            self._limiter(chat_id).consume()
+            self.global_limiter.consume()
+            self._busy_chats.add(chat_id)
+            return dict(row), 0.0
+
+        return None, max(wait, 0.01)
+
+    async def _worker(self, worker_id: int):
+        while True:
+            if self.gate is not None and not self.gate():
+                # Lease non (più) valido: i messaggi restano in coda per il nodo active
+                await asyncio.sleep(IDLE_WAIT)
+                continue
+            try:
+                job, wait = self._claim()
+            except Exception as e:
+                print(f"[outbox] ❌ Worker {worker_id} claim error: {e}", flush=True)
+                job, wait = None, IDLE_WAIT
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self._process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[outbox] ❌ Worker {worker_id} error on #{job['id']}: {e}", flush=True)
+            finally:
+                self._busy_chats.discard(job['chat_id'])
+
+    async def _process(self, job: dict):
+        from telegram.error import RetryAfter, Forbidden, BadRequest, NetworkError
+
+        payload = json.loads(job['payload'])
+        chat_id = job['chat_id']
+        started = time.time()
+        try:
+            await self._send(chat_id, payload)
+        except RetryAfter as e:
+            delay = retry_after_seconds(e)
+            self._limiter(chat_id).block(delay)
+            metrics.inc('outbox.retry_after')
+            print(f"[outbox] ⛔ Flood limit on {chat_id}, retry after {delay:.0f}s", flush=True)
+            self._reschedule(job, delay, f"retry_after {delay}", count_attempt=False)
+        except Forbidden as e:
+            self._finish(job, DEAD, f"forbidden: {e}")
+        except BadRequest as e:
+            if payload.get('photo') or payload.get('photos'):
+                # Foto non raggiungibile/non valida: stesso testo senza immagini
+                print(f"[outbox] ⚠️ Photo rejected for #{job['id']} ({e}), sending text-only", flush=True)
+                payload['photo'] = None
+                payload['photos'] = None
+                payload['disable_web_page_preview'] = True
+                db = self._db()
+                with db:
+                    db.execute("UPDATE outbox SET payload = ? WHERE id = ?", (json.dumps(payload), job['id']))
+                self._reschedule(job, 0, f"photo rejected: {e}", count_attempt=False)
+            else:
+                self._finish(job, DEAD, f"bad request: {e}")
+        except (NetworkError, asyncio.TimeoutError, OSError) as e:
+            self._retry_or_drop(job, str(e))
+        except Exception as e:
+            self._retry_or_drop(job, f"{type(e).__name__}: {e}")
+        else:
+            now = time.time()
+            metrics.observe('outbox.api_latency', now - started)
+            metrics.observe('outbox.send_latency', now - job['created_at'])
+            self._finish(job, DONE)
+
+    def _retry_or_drop(self, job: dict, error: str):
+        attempts = job['attempts'] + 1
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            self._finish(job, DEAD, error)
+            return
+        delay = min(OUTBOX_BACKOFF_BASE * (2 ** (attempts - 1)), OUTBOX_BACKOFF_MAX)
+        metrics.inc('outbox.retries')
+        print(f"[outbox] 🔁 #{job['id']} failed ({error[:80]}), retry {attempts} in {delay}s", flush=True)
+        self._reschedule(job, delay, error)
+
+    def _reschedule(self, job: dict, delay: float, error: str, count_attempt: bool = True):
+        db = self._db()
+        with db:
+            db.execute(
+                "UPDATE outbox SET attempts = attempts + ?, next_attempt_at = ?, last_error = ?, updated_at = ? "
+                "WHERE id = ?",
+                (1 if count_attempt else 0, time.time() + delay, error[:500], time.time(), job['id'])
+            )
+        self._wakeup.set()
+
+    def _finish(self, job: dict, state: str, error: Optional[str] = None):
+        db = self._db()
+        with db:
+            db.execute("UPDATE outbox SET state = ?, last_error = ?, updated_at = ? WHERE id = ?",
+                       (state, error[:500] if error else None, time.time(), job['id']))
+        self._update_depth()
+        self._wakeup.set()
+
+        if state == DONE:
+            metrics.inc('outbox.sent')
+        else:
+            metrics.inc('outbox.dead')
+            print(f"[outbox] ❌ #{job['id']} dropped: {error}", flush=True)
+
+        alert_keys = json.loads(job['alerts']) if job.get('alerts') else []
+        if job.get('alert_trace'):
+            alert_keys.append((job['alert_trace'], job['alert_nft']))
+        for key in alert_keys:
+            trace_id, nft = key[0], key[1]
+            chat_id = key[2] if len(key) > 2 else ''
+            try:
+                if state == DONE:
+                    alert_ledger.mark_sent(trace_id, nft, chat_id)
+                else:
+                    alert_ledger.mark_failed(trace_id, nft, chat_id, error or state)
+            except Exception as e:
+                print(f"[outbox] ❌ Alert ledger update failed: {e}", flush=True)
+
+    # --- ciclo di vita ---
+
+    def purge(self):
+        """Rimuove i messaggi conclusi più vecchi di OUTBOX_KEEP_DONE"""
+        db = self._db()
+        with db:
+            db.execute("DELETE FROM outbox WHERE state != ? AND updated_at < ?",
+                       (QUEUED, time.time() - OUTBOX_KEEP_DONE))
+
+    def start(self, send: Callable[[str, dict], Awaitable]):
+        """Avvia i worker; `send(chat_id, payload)` invia davvero e solleva gli errori telegram"""
+        if self._tasks:
+            return
+        self._send = send
+        self._wakeup = asyncio.Event()
+        self.purge()
+        self._update_depth()
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker(i)) for i in range(self.workers)]
+        print(f"[outbox] ✅ {self.workers} sender workers started", flush=True)
+
+    def stats(self) -> dict:
+        rows = self._db().execute("SELECT state, COUNT(*) FROM outbox GROUP BY state").fetchall()
+        return {state: count for state, count in rows}
+
+
+# Global instance (il file SQLite viene aperto al primo utilizzo)
+outbox = TelegramOutbox()
@@ -0,0 +1,272 @@
+# watchList.py - Liste monitorate (indirizzi royalty, collezioni, iscrizioni, marketplace) da file esterno
+#
+#   WATCHLIST_FILE=watchlist.json python web_server.py   -> modifiche al file applicate senza redeploy
+#   python watchList.py                                   -> valida il file e stampa il riepilogo
+#
+# Il file (JSON o TOML) ha le stesse chiavi delle liste di config.py: royalty_addresses, collections,
+# subscriptions, markets, markets_links. Le chiavi assenti (o il file assente) usano i valori di config.py.
+# Ogni ricarica valida tutto il file e costruisce uno snapshot nuovo, sostituito con un solo assegnamento:
+# un ciclo in corso continua sullo snapshot che ha letto all'inizio. I callback registrati con on_change
+# ricevono solo gli indirizzi aggiunti e rimossi (warm-up del floor, nuovo checkpoint); per le collezioni
+# conta l'indice delle iscrizioni (collections + subscriptions), non la sola lista 'collections'.
+import asyncio
+import json
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+
+import metrics
+from config import royalty_addresses as default_addresses, collections_list as default_collections
+from config import subscriptions as default_subscriptions, markets as default_markets
+from config import markets_links as default_markets_links
+from config import WATCHLIST_FILE, WATCHLIST_POLL_INTERVAL
+from functions import normalize_address
+
+KEYS = ('royalty_addresses', 'collections', 'subscriptions', 'markets', 'markets_links')
+
+
+class WatchListError(ValueError):
+    """File della watch list non valido: la ricarica viene scartata e resta lo snapshot precedente"""
+
+
+class WatchListSnapshot:
+    """Stato immutabile di una versione della watch list"""
+    __slots__ = ('royalty_addresses', 'collections', 'subscriptions', 'markets', 'markets_links', 'source')
+
+    def __init__(self, royalty_addresses: Tuple[str, ...], collections: Tuple[str, ...], subscriptions: tuple,
+                 markets: Dict[str, str], markets_links: Dict[str, str], source: str):
+        self.royalty_addresses = royalty_addresses
+        self.collections = collections
+        self.subscriptions = subscriptions
+        self.markets = markets
+        self.markets_links = markets_links
+        self.source = source
+
+
+class WatchListChange:
+    """Differenza tra due snapshot: solo queste voci richiedono lavoro"""
+    __slots__ = ('added_addresses', 'removed_addresses', 'added_collections', 'removed_collections')
+
+    def __init__(self, old: WatchListSnapshot, new: WatchListSnapshot,
+                 old_collections: List[str], new_collections: List[str]):
+        """old/new_collections: collezioni monitorate (subscription_registry.collections()) prima e dopo"""
+        old_addresses, new_addresses = set(old.royalty_addresses), set(new.royalty_addresses)
+        old_monitored, new_monitored = set(old_collections), set(new_collections)
+        self.added_addresses = [a for a in new.royalty_addresses if a not in old_addresses]
+        self.removed_addresses = [a for a in old.royalty_addresses if a not in new_addresses]
+        self.added_collections = [c for c in new_collections if c not in old_monitored]
+        self.removed_collections = [c for c in old_collections if c not in new_monitored]
+
+    def __bool__(self):
+        return bool(self.added_addresses or self.removed_addresses
+                    or self.added_collections or self.removed_collections)
+
+    def __repr__(self):
+        return (f"+{len(self.added_addresses)}/-{len(self.removed_addresses)} addresses, "
+                f"+{len(self.added_collections)}/-{len(self.removed_collections)} collections")
+
+
+def read_file(path: str) -> dict:
+    """Contenuto del file (.toml o JSON); WatchListError se illeggibile"""
+    try:
+        with open(path, 'rb') as f:
+            raw = f.read()
+        if path.endswith('.toml'):
+            try:
+                import tomllib
+            except ImportError:   # Python < 3.11
+                import tomli as tomllib
+            data = tomllib.loads(raw.decode('utf-8'))
+        else:
+            data = json.loads(raw)
+    except (OSError, ValueError, ImportError) as e:
+        raise WatchListError(f"cannot read {os.path.basename(path)}: {e}")
+    if not isinstance(data, dict):
+        raise WatchListError("top level must be an object")
+    unknown = set(data) - set(KEYS)
+    if unknown:
+        raise WatchListError(f"unknown keys: {', '.join(sorted(unknown))}")
+    return data
+
+
+def _addresses(values, key: str) -> Tuple[str, ...]:
+    if not isinstance(values, (list, tuple)):
+        raise WatchListError(f"'{key}' must be a list")
+    result = []
+    for i, value in enumerate(values):
+        address = normalize_address(value)
+        if address is None:
+            raise WatchListError(f"'{key}'[{i}] is not a valid address: {value!r}")
+        if address not in result:
+            result.append(address)
+    return tuple(result)
+
+
+def _mapping(values, key: str) -> Dict[str, str]:
+    if not isinstance(values, dict) or not all(isinstance(v, str) for v in values.values()):
+        raise WatchListError(f"'{key}' must map strings to strings")
+    return dict(values)
+
+
+def build_snapshot(data: dict, source: str) -> WatchListSnapshot:
+    """Valida i dati (chiavi assenti = config.py) e costruisce lo snapshot"""
+    markets = {}
+    for address, name in _mapping(data.get('markets', default_markets), 'markets').items():
+        # I marketplace arrivano dallo stack in RAW maiuscolo: le chiavi EQ vengono convertite
+        markets[normalize_address(address) or address] = name
+
+    subscriptions = data.get('subscriptions', default_subscriptions)
+    if not isinstance(subscriptions, list):
+        raise WatchListError("'subscriptions' must be a list")
+    # Una voce sbagliata rifiuta tutto il file: scartarla in silenzio toglierebbe l'iscrizione a una chat
+    from subscriptions import entry_error
+    from secretData import notify_chat
+    for i, entry in enumerate(subscriptions):
+        error = entry_error(entry, notify_chat)
+        if error:
+            raise WatchListError(f"'subscriptions'[{i}]: {error}")
+
+    return WatchListSnapshot(
+        royalty_addresses=_addresses(data.get('royalty_addresses', default_addresses), 'royalty_addresses'),
+        collections=_addresses(data.get('collections', default_collections), 'collections'),
+        subscriptions=tuple(subscriptions),
+        markets=markets,
+        markets_links=_mapping(data.get('markets_links', default_markets_links), 'markets_links'),
+        source=source,
+    )
+
+
+class WatchList:
+    """Snapshot corrente della watch list, ricaricato quando il file cambia (mtime)"""
+
+    def __init__(self, path: str = WATCHLIST_FILE, poll_interval: float = WATCHLIST_POLL_INTERVAL):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._current: Optional[WatchListSnapshot] = None
+        self._stamp = None    # (mtime_ns, size) del file caricato, None se assente
+        self._callbacks: List[Callable[[WatchListChange], None]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    # --- lettura (sempre dallo snapshot corrente) ---
+
+    @property
+    def current(self) -> WatchListSnapshot:
+        if self._current is None:
+            self.load()
+        return self._current
+
+    @property
+    def royalty_addresses(self) -> Tuple[str, ...]:
+        return self.current.royalty_addresses
+
+    @property
+    def collections(self) -> Tuple[str, ...]:
+        return self.current.collections
+
+    @property
+    def markets(self) -> Dict[str, str]:
+        return self.current.markets
+
+    @property
+    def markets_links(self) -> Dict[str, str]:
+        return self.current.markets_links
+
+    # --- caricamento ---
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self) -> WatchListSnapshot:
+        """Caricamento iniziale: file se presente, altrimenti le liste di config.py"""
+        stamp = self._file_stamp()
+        if stamp is None:
+            snapshot = build_snapshot({}, 'config.py')
+        else:
+            snapshot = build_snapshot(read_file(self.path), os.path.basename(self.path))
+        self._swap(snapshot, stamp)
+        print(f"[watchlist] ✅ {len(snapshot.royalty_addresses)} royalty addresses, "
+              f"{len(snapshot.collections)} collections from {snapshot.source}", flush=True)
+        return snapshot
+
+    def refresh(self) -> Optional[WatchListChange]:
+        """Ricarica se il file è cambiato; None se invariato o non valido (resta lo snapshot precedente)"""
+        if self._current is None:
+            self.load()
+            return None
+        stamp = self._file_stamp()
+        if stamp == self._stamp:
+            return None
+        try:
+            data = read_file(self.path) if stamp is not None else {}
+            snapshot = build_snapshot(data, os.path.basename(self.path) if stamp is not None else 'config.py')
+        except WatchListError as e:
+            self._stamp = stamp   # non ritentare finché il file non cambia di nuovo
+            metrics.inc('watchlist.reload_failed')
+            print(f"[watchlist] ❌ Reload rejected, keeping the previous list: {e}", flush=True)
+            return None
+
+        from subscriptions import subscription_registry
+        old, old_collections = self._current, subscription_registry.collections()
+        self._swap(snapshot, stamp)
+        change = WatchListChange(old, snapshot, old_collections, subscription_registry.collections())
+        metrics.inc('watchlist.reloads')
+        print(f"[watchlist] 🔄 Reloaded from {snapshot.source}: {change}", flush=True)
+        if change:
+            for callback in list(self._callbacks):
+                try:
+                    callback(change)
+                except Exception as e:
+                    print(f"[watchlist] ❌ Change handler error: {e}", flush=True)
+        return change
+
+    def _swap(self, snapshot: WatchListSnapshot, stamp):
+        from subscriptions import subscription_registry
+        from secretData import notify_chat
+        # Prima l'indice delle iscrizioni (swap atomico anch'esso), poi lo snapshot
+        subscription_registry.load(list(snapshot.subscriptions), snapshot.collections, notify_chat)
+        self._current = snapshot
+        self._stamp = stamp
+        metrics.set_gauge('watchlist.royalty_addresses', len(snapshot.royalty_addresses))
+        metrics.set_gauge('watchlist.collections', len(snapshot.collections))
+
+    def on_change(self, callback: Callable[[WatchListChange], None]):
+        """callback(change) dopo ogni ricarica con voci aggiunte o rimosse (una volta per callback)"""
+        if callback not in self._callbacks:
+            self._callbacks.append(callback)
+
+    # --- watcher ---
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"[watchlist] ❌ Watcher error: {e}", flush=True)
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            if self._current is None:
+                self.load()
+            self._task = asyncio.get_running_loop().create_task(self.watch())
+        return self._task
+
+
+# Global instance (il file viene letto al primo accesso)
+watch_list = WatchList()
+
+
+if __name__ == '__main__':
+    try:
+        snapshot = watch_list.load()
+    except WatchListError as e:
+        print(f"❌ {e}")
+        raise SystemExit(1)
+    for address in snapshot.royalty_addresses:
+        print(f"  royalty     {address}")
+    for address in snapshot.collections:
+        print(f"  collection  {address}")
+    print(f"  {len(snapshot.subscriptions)} subscriptions, {len(snapshot.markets)} markets")
@@ -1,12 +1,24 @@
 # web_server.py - REQUIRED FOR RENDER
 import os
 import asyncio
+import json
 import logging
+import random
 import threading
 import time
-import requests
 from datetime import datetime
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import aiohttp
+
+import metrics
+from httpPool import get_session
+from salesLedger import sales_ledger
+from salesAnalytics import sales_analytics
+from tgCommands import command_dispatcher, get_webhook_secret, WEBHOOK_SECRET_HEADER, REJECTED
+from config import SELF_PING_INTERVAL, SELF_PING_JITTER, SELF_PING_INITIAL_DELAY, SELF_PING_TIMEOUT
+from config import TELEGRAM_WEBHOOK_PATH
 
 PORT = int(os.environ.get("PORT", 8000))
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(message)s')
@@ -15,12 +27,17 @@ log = logging.getLogger(__name__)
 # Global variables for uptime tracking
 start_time = time.time()
 bot_status = "Starting..."
-last_ping_time = time.time()
-ping_count = 0
+
+# Header che il self-pinger aggiunge: le sue richieste non contano come traffico reale
+SELF_PING_HEADER = "X-Self-Ping"
 
 class HealthHandler(BaseHTTPRequestHandler):
     def do_GET(self):
-        global ping_count, last_ping_time
+        if not self.headers.get(SELF_PING_HEADER):
+            metrics.set_gauge('http.last_external_request', time.time())
+        metrics.inc('http.requests')
+        
+        parsed = urlparse(self.path)
         
         if self.path == '/':
             self.send_response(200)
@@ -31,8 +48,38 @@ class HealthHandler(BaseHTTPRequestHandler):
             uptime_seconds = int(time.time() - start_time)
             uptime_str = f"{uptime_seconds // 3600}h {(uptime_seconds % 3600) // 60}m {uptime_seconds % 60}s"
             
-            # Time since last ping
+            # Self-ping stats (scritte dal pinger asyncio in metrics)
+            ping_count = metrics.get_counter('self_ping.ok') + metrics.get_counter('self_ping.failed')
+            skipped_count = metrics.get_counter('self_ping.skipped')
+            last_ping_time = metrics.get_gauge('self_ping.last_time', start_time)
+            next_ping_time = metrics.get_gauge('self_ping.next_time', start_time)
             time_since_last_ping = int(time.time() - last_ping_time)
+            # L'app è "sveglia" se c'è stato un ping o traffico reale di recente
+            last_alive = max(last_ping_time, metrics.get_gauge('http.last_external_request', 0))
+            time_since_alive = int(time.time() - last_alive)
+            
+            # Storico vendite (ledger locale, nessuna chiamata di rete)
+            try:
+                totals = sales_ledger.totals()
+                sales_text = f"{totals['count']} sales, {totals['volume']:.2f} TON"
+                last_sale_text = datetime.fromtimestamp(totals['last_sale']).strftime('%Y-%m-%d %H:%M:%S') if totals['last_sale'] else 'Never'
+            except Exception as e:
+                sales_text = f"unavailable ({e})"
+                last_sale_text = '-'
+            
+            # Statistiche per collezione (ring buffer in memoria)
+            try:
+                sales_analytics.sync()
+                stats_rows = "".join(
+                    f"<tr><td>{s['collection'][:8]}...{s['collection'][-8:]}</td>"
+                    f"<td>{s['windows']['1h']['count']}</td><td>{s['windows']['24h']['count']}</td>"
+                    f"<td>{s['windows']['24h']['volume']:.2f}</td><td>{s['windows']['24h']['median'] or '-'}</td>"
+                    f"<td>{s['windows']['7d']['volume']:.2f}</td>"
+                    f"<td>{s['windows']['24h']['floor'] or '-'}</td></tr>"
+                    for s in sales_analytics.summary()[:10]
+                ) or "<tr><td colspan='7'>No sales in the last 7 days</td></tr>"
+            except Exception as e:
+                stats_rows = f"<tr><td colspan='7'>unavailable ({e})</td></tr>"
             
             html = f"""
             <!DOCTYPE html>
@@ -48,7 +95,7 @@ class HealthHandler(BaseHTTPRequestHandler):
                     .ping-status {{ 
                         padding: 10px; 
                         border-radius: 5px;
-                        background: {'#d4edda' if time_since_last_ping < 400 else '#f8d7da'};
+                        background: {'#d4edda' if time_since_alive < SELF_PING_INTERVAL + SELF_PING_JITTER + 100 else '#f8d7da'};
                     }}
                 </style>
             </head>
@@ -65,13 +112,28 @@ class HealthHandler(BaseHTTPRequestHandler):
                         <p><strong>Environment:</strong> {os.environ.get('RENDER', 'Local Development')}</p>
                     </div>
                     
+                    <div class="info">
+                        <h2>Sales Ledger</h2>
+                        <p><strong>Recorded:</strong> {sales_text}</p>
+                        <p><strong>Last sale:</strong> {last_sale_text}</p>
+                    </div>
+                    
+                    <div class="info">
+                        <h2>Collection Stats</h2>
+                        <table>
+                            <tr><th>Collection</th><th>Sales 1h</th><th>Sales 24h</th><th>Volume 24h</th>
+                                <th>Median 24h</th><th>Volume 7d</th><th>Floor</th></tr>
+                            {stats_rows}
+                        </table>
+                    </div>
+                    
                     <div class="info">
                         <h2>Self-Ping System</h2>
                         <div class="ping-status">
-                            <p><strong>Self-ping:</strong> ACTIVE (every 5 minutes)</p>
-                            <p><strong>Total pings:</strong> {ping_count}</p>
+                            <p><strong>Self-ping:</strong> ACTIVE (every {SELF_PING_INTERVAL}s ± {SELF_PING_JITTER}s)</p>
+                            <p><strong>Total pings:</strong> {ping_count} ({skipped_count} skipped, recent traffic)</p>
                             <p><strong>Last ping:</strong> {time_since_last_ping} seconds ago</p>
-                            <p><strong>Next ping in:</strong> {max(0, 300 - time_since_last_ping)} seconds</p>
+                            <p><strong>Next ping in:</strong> {max(0, int(next_ping_time - time.time()))} seconds</p>
                         </div>
                         <p><em>Prevents Render.com from sleeping the app</em></p>
                     </div>
@@ -81,6 +143,9 @@ class HealthHandler(BaseHTTPRequestHandler):
                         <ul>
                             <li><a href="/health">/health</a> - Health check for Render</li>
                             <li><a href="/ping">/ping</a> - Simple ping endpoint</li>
+                            <li><a href="/metrics">/metrics</a> - Internal metrics (JSON)</li>
+                            <li><a href="/sales">/sales</a> - Recent sales (JSON, ?collection=&amp;limit=)</li>
+                            <li><a href="/stats">/stats</a> - Collection stats 1h/24h/7d (JSON, ?collection=)</li>
                             <li><a href="/status">/status</a> - Detailed status (coming soon)</li>
                         </ul>
                     </div>
@@ -98,11 +163,81 @@ class HealthHandler(BaseHTTPRequestHandler):
             self.end_headers()
             self.wfile.write(b"OK - TON NFT Bot Alive")
         
+        elif parsed.path == '/sales':
+            params = parse_qs(parsed.query)
+            collection = params.get('collection', [None])[0]
+            try:
+                limit = max(1, min(int(params.get('limit', ['20'])[0]), 200))
+            except ValueError:
+                limit = 20
+            body = {
+                'totals': sales_ledger.totals(),
+                'sales': sales_ledger.recent_sales(limit, collection),
+            }
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(json.dumps(body).encode())
+        
+        elif parsed.path == '/stats':
+            collection = parse_qs(parsed.query).get('collection', [None])[0]
+            sales_analytics.sync()
+            if collection:
+                body = sales_analytics.collection_stats(collection)
+            else:
+                body = {'collections': sales_analytics.summary()}
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(json.dumps(body).encode())
+        
+        elif self.path == '/metrics':
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(json.dumps(metrics.snapshot(), default=str).encode())
+        
         else:
             self.send_response(404)
             self.end_headers()
             self.wfile.write(b"Not Found")
     
+    def do_POST(self):
+        """
+        Webhook Telegram: l'update passa ai worker dei comandi e si risponde subito 200.
+        Se il dispatcher non lo accetta (non avviato, standby, coda piena) 503: Telegram lo riconsegna.
+        """
+        if urlparse(self.path).path != TELEGRAM_WEBHOOK_PATH:
+            self.send_response(404)
+            self.end_headers()
+            return
+        
+        if self.headers.get(WEBHOOK_SECRET_HEADER) != get_webhook_secret():
+            metrics.inc('webhook.rejected')
+            self.send_response(403)
+            self.end_headers()
+            return
+        
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            update = json.loads(self.rfile.read(length) or b'{}')
+        except (ValueError, json.JSONDecodeError):
+            self.send_response(400)
+            self.end_headers()
+            return
+        
+        metrics.inc('webhook.updates')
+        if command_dispatcher.submit_threadsafe(update) == REJECTED:
+            metrics.inc('webhook.dropped')
+            self.send_response(503)
+            self.send_header("Retry-After", "5")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(b'{"ok":true}')
+    
     def log_message(self, format, *args):
         # Log only errors
         if "404" in args or "500" in args:
@@ -114,72 +249,74 @@ def run_server():
     log.info(f"✅ Health server running on port {PORT}")
     server.serve_forever()
 
-def start_self_pinger():
-    """Auto-ping to keep the app active on Render"""
-    def pinger():
-        global ping_count, last_ping_time, bot_status
-        
-        # Wait 30 seconds before first ping
-        log.info("[SELF-PING] Waiting 30 seconds before first ping...")
-        time.sleep(30)
+def get_ping_url() -> str:
+    """URL del self-ping: esterno su Render (se noto), altrimenti localhost"""
+    if os.environ.get('RENDER'):
+        render_service_url = os.environ.get('RENDER_EXTERNAL_URL', '')
+        if render_service_url:
+            return f"{render_service_url}/ping"
+    return f"http://localhost:{PORT}/ping"
+
+def next_ping_delay() -> float:
+    """Intervallo con jitter, per non pingare sempre allo stesso secondo"""
+    return max(1.0, SELF_PING_INTERVAL + random.uniform(-SELF_PING_JITTER, SELF_PING_JITTER))
+
+async def self_pinger():
+    """Auto-ping to keep the app active on Render (asyncio task, shared HTTP pool)"""
+    global bot_status
+    ping_url = get_ping_url()
+    timeout = aiohttp.ClientTimeout(total=SELF_PING_TIMEOUT)
+    
+    log.info(f"[SELF-PING] Waiting {SELF_PING_INITIAL_DELAY} seconds before first ping...")
+    await asyncio.sleep(SELF_PING_INITIAL_DELAY)
+    bot_status = "Running"
+    
+    while True:
+        delay = next_ping_delay()
+        metrics.set_gauge('self_ping.next_time', time.time() + delay)
+        await asyncio.sleep(delay)
         
-        bot_status = "Running"
+        # Se è arrivato traffico reale di recente l'app è già sveglia: niente ping
+        last_external = metrics.get_gauge('http.last_external_request', 0)
+        if time.time() - last_external < SELF_PING_INTERVAL:
+            metrics.inc('self_ping.skipped')
+            log.info(f"[SELF-PING] ⏭️ Skipped, real traffic {int(time.time() - last_external)}s ago")
+            continue
         
-        while True:
-            try:
-                # Ping every 5 minutes (less than Render's 15-minute inactivity limit)
-                log.info(f"[SELF-PING] Next ping in 5 minutes...")
-                time.sleep(300)  # 5 minutes
-                
-                ping_count += 1
-                last_ping_time = time.time()
-                
-                # Determine URL based on environment
-                if os.environ.get('RENDER'):
-                    # On Render, try to use external URL if available
-                    render_service_url = os.environ.get('RENDER_EXTERNAL_URL', '')
-                    if render_service_url:
-                        ping_url = f"{render_service_url}/ping"
-                        log.info(f"[SELF-PING] Pinging Render external URL: {ping_url}")
-                    else:
-                        # Fallback: local ping
-                        ping_url = f"http://localhost:{PORT}/ping"
-                        log.info(f"[SELF-PING] Pinging localhost on port {PORT}")
-                else:
-                    # Local development
-                    ping_url = f"http://localhost:{PORT}/ping"
-                    log.info(f"[SELF-PING] Pinging localhost (development)")
-                
-                # Shorter timeout to avoid blocking
-                response = requests.get(ping_url, timeout=15)
-                
-                if response.status_code == 200:
-                    log.info(f"[SELF-PING] ✅ Ping #{ping_count} successful")
+        started = time.time()
+        metrics.set_gauge('self_ping.last_time', started)
+        try:
+            session = get_session()
+            async with session.get(ping_url, timeout=timeout,
+                                   headers={SELF_PING_HEADER: "1"}) as response:
+                await response.read()
+                metrics.observe('self_ping.latency', time.time() - started)
+                if response.status == 200:
+                    metrics.inc('self_ping.ok')
+                    log.info(f"[SELF-PING] ✅ Ping ok ({ping_url})")
                 else:
-                    log.warning(f"[SELF-PING] ⚠️ Ping #{ping_count} returned {response.status_code}")
-                    
-            except requests.exceptions.Timeout:
-                log.error(f"[SELF-PING] ❌ Ping #{ping_count} timeout after 15s")
-            except requests.exceptions.RequestException as e:
-                log.error(f"[SELF-PING] ❌ Ping #{ping_count} failed: {e}")
-            except Exception as e:
-                log.error(f"[SELF-PING] ❌ Ping #{ping_count} unexpected error: {e}")
-                
-            # Continue even if ping fails
-    
-    # Start pinger in background
-    thread = threading.Thread(target=pinger, daemon=True)
-    thread.start()
-    log.info("✅ Self-pinger started (will ping every 5 minutes)")
+                    metrics.inc('self_ping.failed')
+                    log.warning(f"[SELF-PING] ⚠️ Ping returned {response.status}")
+        except asyncio.TimeoutError:
+            metrics.inc('self_ping.failed')
+            log.error(f"[SELF-PING] ❌ Ping timeout after {SELF_PING_TIMEOUT}s")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            metrics.inc('self_ping.failed')
+            log.error(f"[SELF-PING] ❌ Ping failed: {e}")
+        # Continue even if ping fails
+
+def start_self_pinger() -> asyncio.Task:
+    """Avvia il self-pinger come task sul loop corrente"""
+    task = asyncio.get_running_loop().create_task(self_pinger())
+    log.info(f"✅ Self-pinger started (every {SELF_PING_INTERVAL}s ± {SELF_PING_JITTER}s)")
+    return task
 
 def run_in_background():
-    """Function that main.py imports from 'web_server'"""
+    """Function that main.py imports from 'web_server' (self-pinger is started separately, on the loop)"""
     global bot_status
     
-    # 1. Start self-pinger
-    start_self_pinger()
-    
-    # 2. Start HTTP server
     thread = threading.Thread(target=run_server, daemon=True)
     thread.start()
     
@@ -193,14 +330,20 @@ def run_bot():
         log.info("🤖 Importing and starting TON NFT Bot...")
         
         # Import main bot
-        from main import scheduler
+        from main import scheduler, telegram_polling_handler
         
         # Update global status
         global bot_status
         bot_status = "Bot scheduler starting"
         
+        async def bot_with_pinger():
+            start_self_pinger()
+            # Comandi Telegram (polling o webhook su questo stesso server)
+            asyncio.get_running_loop().create_task(telegram_polling_handler())
+            await scheduler()
+        
         # Start the bot
-        asyncio.run(scheduler())
+        asyncio.run(bot_with_pinger())
         
     except KeyboardInterrupt:
         bot_status = "Stopped by user"
@@ -215,11 +358,11 @@ if __name__ == "__main__":
     log.info("🚀 Starting TON NFT Bot for Render.com")
     log.info(f"📡 Port: {PORT}")
     log.info(f"🌍 Environment: {os.environ.get('RENDER', 'Local')}")
-    log.info(f"📊 Self-ping: ACTIVE (every 5 minutes)")
+    log.info(f"📊 Self-ping: ACTIVE (every {SELF_PING_INTERVAL}s ± {SELF_PING_JITTER}s)")
     log.info("=" * 60)
     
-    # 1. Start HTTP server with self-ping
+    # 1. Start HTTP server
     run_in_background()
     
-    # 2. Start main bot
+    # 2. Start main bot (+ self-ping task)
     run_bot()
\ No newline at end of file